@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark reproducible (sin red) de las etapas de guatemala_training_pack.py
+- Insumos sintéticos: polígonos ADM (grilla), máscara de país, volcanes
+  (6 a 10 000 puntos en CSV lon/lat) y rásteres tipo WorldPop (250/100/30 m)
+- Etapas: importación CSV (import_csv_points), filtro de volcanes, amenaza,
+  exposición, estadísticas zonales, escenarios, serie multianual y
+  consultas al almacén de resultados (en frío y desde la caché)
+- Resultados en JSON Lines (una línea por medición) para seguir regresiones
+  y curvas de escala entre versiones
+
+Uso:
+    python benchmark_training_pack.py                      # todo, salida bench_results.jsonl
+    python benchmark_training_pack.py --stages hazard exposure --res 250 100 --repeat 3
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+import numpy as np
+
+import guatemala_training_pack as gtp
+
+CRS = gtp.GTM_CRS
+# Caja sintética en UTM 15N (dentro de Guatemala); el tamaño se controla con --extent-km
+ORIGIN = (700000.0, 1550000.0)
+POINT_COUNTS = (6, 100, 1000, 10000)
+RESOLUTIONS = (250, 100, 30)
+STAGES = ("import_csv", "filter_volcanoes", "hazard", "exposure", "zonal_stats", "scenarios", "pyramid",
+          "pop_stats", "accessibility", "exposure_series", "results_query")
+HAZARD_STAGES = ("hazard", "exposure", "accessibility", "exposure_series", "results_query")  # necesitan la amenaza
+QGIS_STAGES = ("filter_volcanoes",)
+ZONES_PER_SIDE = 5
+SERIES_YEARS = 5  # rásteres anuales sintéticos para exposure_series
+
+def synthetic_extent(extent_km):
+    """(xmin, xmax, ymin, ymax) of the synthetic square"""
+    x0, y0 = ORIGIN
+    side = extent_km * 1000.0
+    return (x0, x0 + side, y0, y0 + side)
+
+def make_zones(path, extent, n=ZONES_PER_SIDE, crs=CRS):
+    """n x n grid of rectangular zones with a shapeName field"""
+    from osgeo import ogr, osr
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    ds = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+    lyr = ds.CreateLayer("zonas", srs=srs, geom_type=ogr.wkbPolygon)
+    lyr.CreateField(ogr.FieldDefn(gtp.ZONE_NAME_FIELD, ogr.OFTString))
+    xmin, xmax, ymin, ymax = extent
+    dx, dy = (xmax - xmin) / n, (ymax - ymin) / n
+    for i in range(n):
+        for j in range(n):
+            x, y = xmin + i * dx, ymin + j * dy
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for px, py in ((x, y), (x + dx, y), (x + dx, y + dy), (x, y + dy), (x, y)):
+                ring.AddPoint_2D(px, py)
+            poly = ogr.Geometry(ogr.wkbPolygon)
+            poly.AddGeometry(ring)
+            feat = ogr.Feature(lyr.GetLayerDefn())
+            feat.SetField(gtp.ZONE_NAME_FIELD, f"Zona_{i}_{j}")
+            feat.SetGeometry(poly)
+            lyr.CreateFeature(feat)
+    ds = None
+    return path
+
+def make_mask(path, extent, vertices=2000, seed=0, crs=CRS):
+    """Irregular single polygon (wobbly circle) mimicking a country outline"""
+    from osgeo import ogr, osr
+    rng = np.random.default_rng(seed)
+    xmin, xmax, ymin, ymax = extent
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    r = 0.45 * min(xmax - xmin, ymax - ymin)
+    t = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    rr = r * (1 + 0.08 * np.sin(7 * t) + 0.02 * rng.standard_normal(vertices))
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for px, py in zip(cx + rr * np.cos(t), cy + rr * np.sin(t)):
+        ring.AddPoint_2D(float(px), float(py))
+    ring.CloseRings()
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    ds = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+    lyr = ds.CreateLayer("mask", srs=srs, geom_type=ogr.wkbPolygon)
+    feat = ogr.Feature(lyr.GetLayerDefn())
+    feat.SetGeometry(poly)
+    lyr.CreateFeature(feat)
+    ds = None
+    return path
+
+def make_points(n, extent, seed=0):
+    """n random points (UTM) inside a slightly enlarged extent, so some fall outside the mask"""
+    rng = np.random.default_rng(seed)
+    xmin, xmax, ymin, ymax = extent
+    pad = 0.1 * (xmax - xmin)
+    return np.column_stack((rng.uniform(xmin - pad, xmax + pad, n),
+                            rng.uniform(ymin - pad, ymax + pad, n)))
+
+def make_points_csv(path, xy_utm, crs=CRS):
+    """NOAA-like CSV (Name, Longitude, Latitude, Elevation) from UTM points"""
+    lonlat = gtp.transform_xy(xy_utm, crs, "EPSG:4326")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Name,Longitude,Latitude,Elevation\n")
+        for i, (lon, lat) in enumerate(lonlat):
+            f.write(f"V{i},{lon:.6f},{lat:.6f},{1000 + i % 3000}\n")
+    return path
+
+def make_population(path, extent, res, seed=0, crs=CRS):
+    """WorldPop-like float32 raster: log-normal background, urban blobs, -99999 NoData ring"""
+    rng = np.random.default_rng(seed)
+    gt, (rows, cols) = gtp.grid_from_extent(*extent, res)
+    xs, ys = gtp.cell_centers(gt, (rows, cols))
+    scale = (res / 100.0) ** 2  # personas por celda ~ área
+    pop = np.empty((rows, cols), dtype="float32")
+    centers = make_points(20, extent, seed + 1)
+    for r0, nrows in gtp.iter_row_blocks(rows):
+        block = rng.lognormal(0.0, 1.0, (nrows, cols)).astype("float32")
+        gx, gy = np.meshgrid(xs, ys[r0:r0 + nrows])
+        for cx, cy in centers:
+            block += 200 * np.exp(-((gx - cx) ** 2 + (gy - cy) ** 2) / (2 * 3000.0 ** 2))
+        pop[r0:r0 + nrows] = block * scale
+    edge = max(1, int(0.02 * min(rows, cols)))
+    pop[:edge, :] = -99999
+    pop[:, :edge] = -99999
+    gtp.write_geotiff(path, pop, gt, crs, nodata=-99999)
+    return path
+
+def git_revision():
+    """Short commit of the benchmarked tree, if available"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_meta():
+    """Environment recorded with every measurement"""
+    try:
+        from osgeo import gdal
+        gdal_version = gdal.__version__
+    except ImportError:
+        gdal_version = None
+    return {
+        "run": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "gdal": gdal_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+def measure(records, out, meta, stage, params, fn, repeat=1):
+    """Time fn() repeat times and append one JSON line with min/median seconds"""
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    rec = dict(meta, stage=stage, params=params, repeat=repeat,
+               seconds_min=round(min(times), 4), seconds_median=round(float(np.median(times)), 4))
+    records.append(rec)
+    out.write(json.dumps(rec) + "\n")
+    out.flush()
+    gtp.print_progress(f"⏱️ {stage} {params}: {rec['seconds_min']:.3f} s")
+    return result
+
+def run(args):
+    """Build the synthetic inputs and benchmark the selected stages"""
+    work = args.workdir or tempfile.mkdtemp(prefix="gtp_bench_")
+    os.makedirs(work, exist_ok=True)
+    extent = synthetic_extent(args.extent_km)
+    meta = run_meta()
+    meta["extent_km"] = args.extent_km
+    stages = [s for s in STAGES if s in args.stages]
+
+    if any(s in QGIS_STAGES for s in stages):
+        try:
+            gtp.start_qgis()
+        except ImportError:
+            gtp.print_progress("⚠️ QGIS no disponible: se omiten " + ", ".join(QGIS_STAGES))
+            stages = [s for s in stages if s not in QGIS_STAGES]
+
+    zones = make_zones(os.path.join(work, "zonas.gpkg"), extent)
+    mask = make_mask(os.path.join(work, "mask.gpkg"), extent)
+    points = {n: make_points(n, extent, seed=n) for n in args.points}
+    csvs = {n: make_points_csv(os.path.join(work, f"volcanes_{n}.csv"), xy) for n, xy in points.items()}
+
+    records = []
+    with open(args.output, "a", encoding="utf-8") as out:
+        for n in args.points:
+            if "import_csv" in stages:
+                measure(records, out, meta, "import_csv", {"points": n},
+                        lambda: gtp.import_csv_points(csvs[n], "Longitude", "Latitude",
+                                                      os.path.join(work, f"volcanes_{n}.gpkg"), CRS),
+                        args.repeat)
+            if "filter_volcanoes" in stages:
+                dst = os.path.join(work, f"volcanes_in_{n}.gpkg")
+                measure(records, out, meta, "filter_volcanoes", {"points": n},
+                        lambda: gtp.filter_points_in_polygon(csvs[n], mask, dst, CRS,
+                                                             bbox_wgs84="-180,180,-90,90"),
+                        args.repeat)
+
+        for res in args.res:
+            pop = make_population(os.path.join(work, f"pop_{res}m.tif"), extent, res)
+            cells = int(np.prod(gtp.grid_from_extent(*extent, res)[1]))
+            haz = os.path.join(work, f"hazard_{res}m.tif")
+            if set(HAZARD_STAGES) & set(stages):
+                for n in (args.points if "hazard" in stages else args.points[:1]):
+                    measure(records, out, meta, "hazard", {"res": res, "points": n, "cells": cells},
+                            lambda: gtp.build_hazard_raster(points[n], extent, res, haz, CRS),
+                            args.repeat if "hazard" in stages else 1)
+            if "exposure" in stages:
+                zid_path = gtp.zone_index_path(zones, pop)
+                if os.path.exists(zid_path):
+                    os.remove(zid_path)
+                measure(records, out, meta, "zone_index", {"res": res, "cells": cells},
+                        lambda: gtp.zone_index(zones, pop))
+                measure(records, out, meta, "exposure", {"res": res, "cells": cells},
+                        lambda: gtp.compute_exposure(pop, haz, zones), args.repeat)
+            if "zonal_stats" in stages:
+                measure(records, out, meta, "zonal_stats", {"res": res, "cells": cells},
+                        lambda: gtp.zonal_stats(pop, zones), args.repeat)
+            if "scenarios" in stages:
+                ring_sets = [gtp.HAZARD_RINGS, ((5000, 3), (15000, 2), (25000, 1))]
+                measure(records, out, meta, "scenarios",
+                        {"res": res, "cells": cells, "scenarios": len(ring_sets) * len(gtp.SCENARIO_THRESHOLDS)},
+                        lambda: gtp.run_scenarios(pop, points[args.points[0]], extent, CRS, zones,
+                                                  ring_sets=ring_sets, res=res),
+                        args.repeat)
+            if "accessibility" in stages:
+                fac = points[args.points[-1]]  # el conjunto más grande hace de establecimientos
+                measure(records, out, meta, "accessibility", {"res": res, "cells": cells, "facilities": len(fac)},
+                        lambda: gtp.compute_accessibility(pop, haz, fac, extent, CRS, zones, res=res),
+                        args.repeat)
+            if "exposure_series" in stages:
+                years = {2000 + y: make_population(os.path.join(work, f"pop_{res}m_{2000 + y}.tif"),
+                                                   extent, res, seed=y) for y in range(SERIES_YEARS)}
+                measure(records, out, meta, "exposure_series", {"res": res, "cells": cells, "years": len(years)},
+                        lambda: gtp.compute_exposure_series(years, haz, zones), args.repeat)
+            if "results_query" in stages:
+                store = os.path.join(work, f"resultados_{res}m")
+                shutil.rmtree(store, ignore_errors=True)
+                gtp.clear_results_cache()
+                for cache in ("cold", "memory", "disk"):
+                    if cache == "disk":
+                        gtp.clear_results_cache()
+                    measure(records, out, meta, "results_query", {"res": res, "cells": cells, "cache": cache},
+                            lambda: gtp.query_exposure(store, pop, haz, zones, gtp.SCENARIO_THRESHOLDS),
+                            args.repeat if cache == "memory" else 1)
+            if "pop_stats" in stages:
+                measure(records, out, meta, "pop_stats", {"res": res, "cells": cells},
+                        lambda: gtp.raster_stats(pop), args.repeat)
+            if "pyramid" in stages:
+                levels = (res, int(res * 2.5), res * 10)  # misma proporción que PYRAMID_LEVELS
+                measure(records, out, meta, "pyramid", {"res": res, "cells": cells, "levels": levels},
+                        lambda: gtp.build_pyramid(pop, points[args.points[0]], extent, CRS,
+                                                  os.path.join(work, f"piramide_{res}m"), levels),
+                        args.repeat)
+
+    if not args.workdir and not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    return records
+
+def parse_args(argv=None):
+    """Command-line options"""
+    ap = argparse.ArgumentParser(description="Benchmark sin red de guatemala_training_pack.py")
+    ap.add_argument("--output", default="bench_results.jsonl", help="Archivo JSON Lines (se agrega al final)")
+    ap.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    ap.add_argument("--points", type=int, nargs="+", default=list(POINT_COUNTS))
+    ap.add_argument("--res", type=int, nargs="+", default=list(RESOLUTIONS))
+    ap.add_argument("--extent-km", type=float, default=100.0, help="Lado del área sintética (km)")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--workdir", help="Carpeta para los insumos sintéticos (por defecto temporal)")
+    ap.add_argument("--keep", action="store_true", help="No borrar la carpeta temporal")
+    return ap.parse_args(argv)
+
+if __name__ == "__main__":
+    records = run(parse_args())
+    print(f"{len(records)} mediciones")
+    sys.exit(0)
@@ -1,150 +1,2302 @@
 # -*- coding: utf-8 -*-
 """
 PyQGIS — Paquete de datos para taller Guatemala (compatible sin importdelimitedtext)
-- Carpeta de salida (diálogo)
-- ADM1 geoBoundaries (API -> fallback GitHub)
-- Volcanes: NOAA CSV -> fallback GVP WFS -> fallback CSV manual (6 volcanes)
-- Importación CSV robusta (qgis/native importdelimitedtext -> delimitedtext -> guardar)
-- WorldPop 2020 UN-adjusted (selector si no está)
-- Raster sintético de amenaza volcánica (250 m) alineado a WorldPop
+- Carpeta de salida (diálogo en la consola de QGIS, o --out sin interfaz)
+- Límites geoBoundaries por país (ISO3) y nivel (ADM1/ADM2...) (API -> fallback GitHub); UTM y bbox automáticos
+- Volcanes: NOAA CSV -> fallback GVP WFS -> fallback CSV manual (6 volcanes, Guatemala)
+- Varios países/niveles en paralelo (procesos) con una sola descarga global de volcanes
+- Importación CSV en lote (NumPy + OGR, igual en cualquier versión de QGIS)
+- WorldPop 2020 UN-adjusted (selector si no está); lectura por ventanas (memmap si no está comprimido)
+  y estadísticas exactas en una pasada (_stats.json), validadas contra la suma por unidad
+- Raster sintético de amenaza volcánica (250 m) calculado con NumPy (campo de distancias)
+- Población expuesta por departamento (lectura por bloques de WorldPop, sin rásteres intermedios)
+- Pirámide alineada de amenaza/población expuesta (100 m, 250 m, 1 km) en una pasada
+- Serie 2000-2020 (opcional, --worldpop-years): pila WorldPop anual leída como cubo, tabla año x departamento
+- Accesibilidad (opcional, --facilities): población expuesta a más de 5/10/20 km del establecimiento más cercano
+- Almacén columnar de resultados (03_Resultados, .npz por clave) con consultas memoizadas (query_exposure, LRU)
 - Proyecto QGIS .qgz
+- Etapas incrementales: pack_manifest.json guarda la huella de cada etapa y solo se recalcula lo que cambió
+- Trazas: pack_trace.json (Chrome trace) con duración, memoria, tamaños y fallback de cada etapa,
+  descarga y processing.run, más una tabla resumen al terminar
+
+Uso sin interfaz (QgsApplication propio, sin diálogos Qt):
+    python guatemala_training_pack.py --out C:/packs/gtm --worldpop GTM_ppp_v2b_2020_UNadj.tif
+    python guatemala_training_pack.py --out C:/packs/gtm --worldpop wp.tif --res 250 100 --jobs 2
+    python guatemala_training_pack.py --out C:/packs/ca --iso3 arco --admin-level ADM1 ADM2 --jobs 4
+        --worldpop "C:/worldpop/{iso3}_ppp_v2b_2020_UNadj.tif"   (una plantilla o carpeta por país)
+    python guatemala_training_pack.py --out C:/packs/gtm --worldpop wp.tif --worldpop-years C:/worldpop/anual
 """
-print("# ==========================")
 import os
+import sys
 import json
 import csv
+import math
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 import shutil
 import urllib.request
 import urllib.error
+import http.client
 from datetime import datetime
-from qgis.core import QgsProject, QgsVectorLayer, QgsRasterLayer, QgsApplication
-from qgis.PyQt import QtWidgets
-import processing
+import numpy as np
+# qgis, processing, Qt y osgeo se importan dentro de cada etapa (arranque rápido)
+
+# ---------- Trazas de ejecución (duración, memoria, tamaños, fallbacks) ----------
+TRACE_NAME = "pack_trace.json"  # formato Chrome trace (chrome://tracing, Perfetto)
+_TRACE_LOCK = threading.Lock()
+_TRACE = {"t0": time.perf_counter(), "events": [], "threads": {}}
+_SPANS = threading.local()  # pila de spans abiertos por hilo (para trace_note)
+
+def current_rss():
+    """Resident set size of this process in bytes (None if unknown)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss():
+    """Peak resident set size so far in bytes (None if unknown)"""
+    try:
+        import resource
+    except ImportError:  # Windows: psutil expone peak_wset
+        try:
+            import psutil
+            return getattr(psutil.Process().memory_info(), "peak_wset", None)
+        except ImportError:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux: KiB
+
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 1024 ** 2, 1)
+
+def _trace_event(event):
+    """Append a trace event stamped with time, process and thread"""
+    thread = threading.current_thread()
+    event.setdefault("ts", round((time.perf_counter() - _TRACE["t0"]) * 1e6))
+    event.update(pid=os.getpid(), tid=thread.ident)
+    with _TRACE_LOCK:
+        _TRACE["threads"][thread.ident] = thread.name
+        _TRACE["events"].append(event)
+
+def reset_trace():
+    """Start a new trace (one per pack build)"""
+    with _TRACE_LOCK:
+        _TRACE.update(t0=time.perf_counter(), events=[], threads={})
+
+@contextmanager
+def span(name, cat="stage", **args):
+    """
+    Tramo con nombre: registra duración, RSS antes/después y pico, más args y
+    lo que se añada dentro con trace_note() (tamaños, conteos, fallback
+    usado). Si el cuerpo lanza, status guarda el error y se propaga.
+    """
+    stack = _SPANS.__dict__.setdefault("stack", [])
+    rec = dict(args)
+    stack.append(rec)
+    rss0 = current_rss()
+    t0 = time.perf_counter()
+    try:
+        yield rec
+        rec.setdefault("status", "ok")
+    except BaseException as e:
+        rec.setdefault("status", f"error: {e}")
+        raise
+    finally:
+        t1 = time.perf_counter()
+        stack.pop()
+        rss1 = current_rss()
+        rec.update(rss_mb=_mb(rss1), peak_rss_mb=_mb(peak_rss()),
+                   rss_delta_mb=_mb(rss1 - rss0) if None not in (rss0, rss1) else None)
+        _trace_event({"name": name, "cat": cat, "ph": "X",
+                      "ts": round((t0 - _TRACE["t0"]) * 1e6), "dur": round((t1 - t0) * 1e6),
+                      "args": rec})
+
+def trace_note(**attrs):
+    """Add attributes to the innermost open span of this thread (no-op outside spans)"""
+    stack = getattr(_SPANS, "stack", None)
+    if stack:
+        stack[-1].update(attrs)
+
+def path_bytes(path):
+    """Size of a file (with shapefile sidecars) in bytes; 0 if missing"""
+    return sum(size for _, size, _ in file_signature(path)) if isinstance(path, str) else 0
+
+def feature_count(obj):
+    """Feature count of a QgsVectorLayer or vector file path (None if unknown)"""
+    if hasattr(obj, "featureCount"):
+        return obj.featureCount()
+    if not (isinstance(obj, str) and os.path.exists(obj)):
+        return None
+    from osgeo import ogr
+    ds = ogr.Open(obj)
+    return ds.GetLayer(0).GetFeatureCount() if ds is not None and ds.GetLayerCount() else None
+
+def run_alg(alg, params):
+    """processing.run(alg, params) inside a span with input/output sizes and feature counts"""
+    import processing
+    with span(alg, cat="processing") as rec:
+        src = params.get("INPUT")
+        rec.update(in_bytes=path_bytes(src), in_features=feature_count(src))
+        result = processing.run(alg, params)
+        out = result.get("OUTPUT")
+        rec.update(out_bytes=path_bytes(out), out_features=feature_count(out))
+        return result
+
+def write_trace(path):
+    """Write the collected events as a Chrome trace JSON file"""
+    with _TRACE_LOCK:
+        events = list(_TRACE["events"])
+        names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                  "args": {"name": n}} for tid, n in _TRACE["threads"].items()]
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": names + events, "displayTimeUnit": "ms"}, f,
+                  ensure_ascii=False, default=str)
+    os.replace(path + ".tmp", path)
+    return path
+
+def trace_summary():
+    """Per-span totals: [{name, cat, count, seconds, max_seconds, rss_delta_mb, peak_rss_mb}]"""
+    rows = {}
+    with _TRACE_LOCK:
+        events = [e for e in _TRACE["events"] if e["ph"] == "X"]
+    for e in events:
+        r = rows.setdefault(e["name"], {"name": e["name"], "cat": e["cat"], "count": 0,
+                                        "seconds": 0.0, "max_seconds": 0.0,
+                                        "rss_delta_mb": 0.0, "peak_rss_mb": 0.0})
+        sec = e["dur"] / 1e6
+        r["count"] += 1
+        r["seconds"] += sec
+        r["max_seconds"] = max(r["max_seconds"], sec)
+        r["rss_delta_mb"] += e["args"].get("rss_delta_mb") or 0.0
+        r["peak_rss_mb"] = max(r["peak_rss_mb"], e["args"].get("peak_rss_mb") or 0.0)
+    return sorted(rows.values(), key=lambda r: -r["seconds"])
+
+def print_trace_summary():
+    """End-of-run table of where the time and memory went"""
+    rows = trace_summary()
+    if not rows:
+        return
+    width = max(len(r["name"]) for r in rows)
+    print(f"\n{'tramo':<{width}}  {'tipo':<10} {'n':>3} {'total s':>9} {'máx s':>8} {'ΔRSS MB':>8} {'pico MB':>8}")
+    for r in rows:
+        print(f"{r['name']:<{width}}  {r['cat']:<10} {r['count']:>3} {r['seconds']:>9.2f} "
+              f"{r['max_seconds']:>8.2f} {r['rss_delta_mb']:>8.1f} {r['peak_rss_mb']:>8.1f}")
 
 def print_progress(message):
-    """Print progress message with timestamp"""
+    """Print progress message with timestamp (also kept as an instant event in the trace)"""
     timestamp = datetime.now().strftime("%H:%M:%S")
     print(f"[{timestamp}] {message}")
+    _trace_event({"name": message, "cat": "log", "ph": "i", "s": "t"})
 
-def safe_download(url, dest, timeout=60):
-    """Download with better error handling and progress feedback"""
-    if os.path.exists(dest) and os.path.getsize(dest) > 0:
-        print_progress(f"Archivo ya existe: {os.path.basename(dest)}")
-        return dest
-    
+# ---------- Caché de descargas (direccionada por contenido) ----------
+CACHE_DIR = os.environ.get("GTM_PACK_CACHE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "guatemala_training_pack")
+CACHE_MAX_BYTES = int(os.environ.get("GTM_PACK_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CHUNK_SIZE = 1024 * 1024
+_CACHE_LOCK = threading.Lock()  # índice compartido entre hilos de descarga
+
+class DownloadCancelled(RuntimeError):
+    """A download aborted through its cancel event (not a network failure)"""
+
+def _cache_index_path(cache_dir):
+    return os.path.join(cache_dir or CACHE_DIR, "index.json")
+
+def load_cache_index(cache_dir=None):
+    """URL -> {sha256, size, etag, last_modified, last_used} mapping of the cache (default CACHE_DIR)"""
+    try:
+        with open(_cache_index_path(cache_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache_index(index, cache_dir=None):
+    """Atomically replace the cache index"""
+    os.makedirs(cache_dir or CACHE_DIR, exist_ok=True)
+    tmp = _cache_index_path(cache_dir) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, _cache_index_path(cache_dir))
+
+def cache_object_path(sha256, cache_dir=None):
+    """Content-addressed location of a cached object"""
+    return os.path.join(cache_dir or CACHE_DIR, "objects", sha256[:2], sha256)
+
+def sha256_file(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def evict_cache(index, cache_dir=None, max_bytes=CACHE_MAX_BYTES, keep=()):
+    """Drop least-recently-used entries (except keep) until the objects fit in max_bytes"""
+    sizes = {e["sha256"]: e["size"] for e in index.values()}
+    total = sum(sizes.values())
+    for url, entry in sorted(index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+        if total <= max_bytes:
+            break
+        if url in keep:
+            continue
+        del index[url]
+        sha = entry["sha256"]
+        if any(e["sha256"] == sha for e in index.values()):
+            continue  # mismo contenido referenciado por otra URL
+        try:
+            os.remove(cache_object_path(sha, cache_dir))
+        except OSError:
+            pass
+        total -= sizes.pop(sha, 0)
+    return index
+
+def _download_to_part(url, part, timeout, entry=None, cancel=None):
+    """
+    Descarga url en el archivo parcial 'part'. Con una entrada en caché envía
+    If-None-Match/If-Modified-Since (devuelve None si la respuesta es 304);
+    si el parcial existe, reanuda con Range/If-Range. cancel (threading.Event)
+    interrumpe la descarga entre bloques, dejando el parcial para reanudar.
+    Devuelve (headers, sha256, tamaño).
+    """
+    meta_path = part + ".json"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    req = urllib.request.Request(url)
+    if entry:
+        if entry.get("etag"):
+            req.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            req.add_header("If-Modified-Since", entry["last_modified"])
+    if offset:
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                part_meta = json.load(f)
+        except (OSError, ValueError):
+            part_meta = {}
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            req.add_header("Range", f"bytes={offset}-")
+            req.add_header("If-Range", validator)
+        else:
+            offset = 0
+    try:
+        r = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    with r:
+        if r.status == 304:
+            return None
+        resumed = offset > 0 and r.status == 206
+        h = hashlib.sha256()
+        if resumed:
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            print_progress(f"Reanudando descarga desde {offset:,} bytes")
+        else:
+            offset = 0
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"etag": r.headers.get("ETag"),
+                           "last_modified": r.headers.get("Last-Modified")}, f)
+        expected = r.headers.get("Content-Length")
+        size = offset
+        with open(part, "ab" if resumed else "wb") as f:
+            for chunk in iter(lambda: r.read(CHUNK_SIZE), b""):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled("Descarga cancelada")
+                f.write(chunk)
+                h.update(chunk)
+                size += len(chunk)
+        if expected is not None and size - offset != int(expected):
+            raise urllib.error.ContentTooShortError(
+                f"Descarga incompleta ({size - offset} de {expected} bytes)", None)
+        return r.headers, h.hexdigest(), size
+
+PARTIAL_LOCK_STALE = 6 * 3600  # s; un .lock más viejo quedó de un proceso caído
+
+def _lock_partial(part):
+    """Take the per-URL lock of a resumable partial (lock file, also across processes); None if busy"""
+    lock = part + ".lock"
+    for _ in range(2):
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return lock
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) < PARTIAL_LOCK_STALE:
+                    return None
+                os.remove(lock)
+            except OSError:
+                pass
+    return None
+
+def _unlock_partial(lock):
+    try:
+        os.remove(lock)
+    except OSError:
+        pass
+
+def _fetch_to_cache(url, part, cache_dir, timeout, entry, cached, expected_sha256, max_bytes, cancel):
+    """Download url into part (revalidating entry) and publish it as a content-addressed object"""
+    try:
+        result = _download_to_part(url, part, timeout, entry, cancel)
+    except (urllib.error.URLError, OSError) as e:
+        if cached:
+            print_progress(f"⚠️ Sin conexión ({e}); usando copia en caché")
+            trace_note(cache="offline", bytes=path_bytes(cached))
+            return cached
+        raise
+
+    if result is None:
+        print_progress(f"Caché vigente (304): {url}")
+        with _CACHE_LOCK:
+            index = load_cache_index(cache_dir)
+            if url in index:
+                index[url]["last_used"] = time.time()
+                save_cache_index(index, cache_dir)
+        trace_note(cache="304", bytes=path_bytes(cached))
+        return cached
+
+    headers, sha, size = result
+    bad = (f"Checksum inválido para {url}: {sha}" if expected_sha256 and sha != expected_sha256.lower()
+           else "Archivo descargado está vacío" if size == 0 else None)
+    if not bad:
+        obj = cache_object_path(sha, cache_dir)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        if os.path.exists(obj) and sha256_file(obj) == sha:
+            pass  # otro proceso publicó el mismo contenido mientras descargábamos
+        else:
+            os.replace(part, obj)
+    for pth in (part, part + ".json"):  # un parcial rechazado no debe reanudarse
+        try:
+            os.remove(pth)
+        except OSError:
+            pass
+    if bad:
+        raise RuntimeError(bad)
+
+    with _CACHE_LOCK:
+        index = load_cache_index(cache_dir)  # releer: otro hilo/proceso pudo escribir
+        index[url] = {"sha256": sha, "size": size, "etag": headers.get("ETag"),
+                      "last_modified": headers.get("Last-Modified"), "last_used": time.time()}
+        save_cache_index(evict_cache(index, cache_dir, max_bytes, keep=(url,)), cache_dir)
+    trace_note(cache="descarga", bytes=size)
+    return obj
+
+def cached_fetch(url, timeout=60, cache_dir=None, expected_sha256=None,
+                 max_bytes=CACHE_MAX_BYTES, cancel=None):
+    """
+    Devuelve la ruta local (en la caché compartida; cache_dir=None usa
+    CACHE_DIR) del contenido de url.
+    - Revalida con If-None-Match / If-Modified-Since (304 = sin descarga).
+    - Reanuda descargas parciales con Range / If-Range.
+    - Verifica SHA-256 (y expected_sha256 si se indica) antes de publicar.
+    - Si la red falla y hay una copia en caché, la usa.
+    - Varios hilos/procesos con la misma URL: el primero toma el parcial
+      reanudable (lock por URL), los demás descargan a un parcial propio.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    with span("fetch", cat="download", url=url):
+        index = load_cache_index(cache_dir)
+        entry = index.get(url)
+        cached = None
+        if entry:
+            obj = cache_object_path(entry["sha256"], cache_dir)
+            if os.path.exists(obj) and sha256_file(obj) == entry["sha256"]:
+                cached = obj
+            else:
+                print_progress(f"⚠️ Objeto en caché corrupto o ausente, se descarga de nuevo: {url}")
+                entry = None
+
+        part_dir = os.path.join(cache_dir, "partial")
+        os.makedirs(part_dir, exist_ok=True)
+        part = os.path.join(part_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".part")
+        lock = _lock_partial(part)
+        if lock is None:  # otro hilo/proceso descarga la misma URL: parcial propio, sin reanudar
+            part += f".{os.getpid()}.{threading.get_ident()}"
+        try:
+            return _fetch_to_cache(url, part, cache_dir, timeout, entry, cached,
+                                   expected_sha256, max_bytes, cancel)
+        finally:
+            if lock is not None:
+                _unlock_partial(lock)
+            else:
+                for pth in (part, part + ".json"):
+                    try:
+                        os.remove(pth)
+                    except OSError:
+                        pass
+
+def safe_download(url, dest, timeout=60, cancel=None, cache_dir=None):
+    """Download through the shared cache (cache_dir, default CACHE_DIR) and copy the result to dest"""
     print_progress(f"Descargando: {url}")
     try:
-        urllib.request.urlretrieve(url, dest)
+        src = cached_fetch(url, timeout=timeout, cache_dir=cache_dir, cancel=cancel)
+    except DownloadCancelled:
+        raise  # cancelada: no es un fallo de red, no se sustituye por el archivo existente
+    except (OSError, http.client.HTTPException) as e:  # red (URLError es OSError)
         if os.path.exists(dest) and os.path.getsize(dest) > 0:
-            print_progress(f"✅ Descarga completada: {os.path.basename(dest)}")
+            print_progress(f"⚠️ {e}; usando archivo existente: {os.path.basename(dest)}")
             return dest
-        else:
-            raise RuntimeError("Archivo descargado está vacío o no existe")
-    except Exception as e:
-        if os.path.exists(dest):
-            os.remove(dest)  # Clean up failed download
         raise RuntimeError(f"Error descargando {url}: {str(e)}")
+    except RuntimeError as e:
+        raise RuntimeError(f"Error descargando {url}: {str(e)}")
+    if not (os.path.exists(dest) and sha256_file(dest) == os.path.basename(src)):
+        shutil.copyfile(src, dest)
+    print_progress(f"✅ Descarga completada: {os.path.basename(dest)}")
+    return dest
 
 def unzip(zfile, to_dir):
-    """Extract archive with error handling"""
+    """
+    Extrae el archivo salvo que ya se haya extraído el mismo contenido (SHA-256
+    guardado en <zfile>.sha256) y sus miembros sigan en to_dir: re-extraer
+    renueva las fechas de modificación e invalidaría las etapas que dependen
+    de los archivos extraídos.
+    """
+    import zipfile
+    marker = zfile + ".sha256"
+    try:
+        digest = sha256_file(zfile)
+        with zipfile.ZipFile(zfile) as zf:
+            members = [m for m in zf.namelist() if not m.endswith("/")]
+        with open(marker, encoding="utf-8") as f:
+            unchanged = f.read().strip() == digest
+        if unchanged and all(os.path.exists(os.path.join(to_dir, m)) for m in members):
+            print_progress(f"⏭️ Ya extraído: {os.path.basename(zfile)}")
+            return
+    except (OSError, zipfile.BadZipFile):
+        pass
     try:
         print_progress(f"Extrayendo: {os.path.basename(zfile)}")
         shutil.unpack_archive(zfile, to_dir)
+        with open(marker, "w", encoding="utf-8") as f:
+            f.write(sha256_file(zfile))
         print_progress("✅ Extracción completada")
     except Exception as e:
         raise RuntimeError(f"Error extrayendo {zfile}: {str(e)}")
 
-def find_first_by_ext(root_dir, exts=(".shp", ".geojson", ".json")):
-    """Find first file with specified extensions"""
+def find_first_by_ext(root_dir, exts=(".shp", ".geojson", ".json"), prefix=""):
+    """Find first file with specified extensions (and optional name prefix)"""
     for r, _, files in os.walk(root_dir):
         for fn in files:
-            if fn.lower().endswith(exts):
+            if fn.lower().endswith(exts) and fn.startswith(prefix):
                 return os.path.join(r, fn)
     return None
 
 def raster_extent_str(path):
     """Get raster extent as string for GDAL operations"""
+    from qgis.core import QgsRasterLayer
     rlyr = QgsRasterLayer(path, "ref", "gdal")
     if not rlyr.isValid():
         raise RuntimeError(f"No se pudo cargar el raster: {path}")
     ext = rlyr.extent()
     return f"{ext.xMinimum()},{ext.xMaximum()},{ext.yMinimum()},{ext.yMaximum()}"
 
-def import_csv_points(csv_path, x_field, y_field, out_gpkg):
+def import_csv_points(csv_path, x_field, y_field, out_gpkg, crs="EPSG:4326"):
     """
-    Intenta importar CSV -> puntos con:
-      1) qgis:importdelimitedtext
-      2) native:importdelimitedtext
-      3) Proveedor 'delimitedtext' + guardado a GPKG
-    Devuelve ruta a GPKG con puntos.
+    Importa un CSV lon/lat (EPSG:4326) -> puntos en lote, sin algoritmos de
+    Processing: lectura en una pasada (read_point_table descarta coordenadas
+    vacías, no numéricas o fuera de rango), reproyección opcional a crs en
+    una sola transformación y escritura del GPKG en una transacción con
+    índice espacial. El resultado no depende de la versión de QGIS.
+    Devuelve la ruta del GPKG.
     """
     print_progress(f"Importando CSV: {os.path.basename(csv_path)}")
-    
-    params = {
-        "INPUT": csv_path,
-        "DELIMITER": ",",
-        "XFIELD": x_field,
-        "YFIELD": y_field,
-        "WKT_FIELD": "",
-        "CRS": "EPSG:4326",
-        "GEOMETRY": "Point",
-        "HEADERS": 1,
-        "OUTPUT": out_gpkg
+    xy, attrs = read_point_table(csv_path, x_field, y_field)
+    if len(xy) == 0:
+        raise RuntimeError("CSV no contiene features válidas.")
+    xy = transform_xy(xy, "EPSG:4326", crs)
+    path = write_points_gpkg(out_gpkg, xy, attrs, crs)
+    print_progress(f"✅ CSV importado: {len(xy)} features")
+    trace_note(features=len(xy))
+    return path
+
+# ---------- Motor de amenaza volcánica (NumPy) ----------
+# Anillos de amenaza: (distancia máxima en metros, nivel). 0 = fuera de zona.
+HAZARD_RINGS = ((10000, 3), (20000, 2), (30000, 1))
+HAZARD_RES = 250
+
+def grid_from_extent(xmin, xmax, ymin, ymax, res):
+    """North-up GDAL geotransform and (rows, cols) covering an extent, as gdal:rasterize does"""
+    cols = max(1, int((xmax - xmin) / res + 0.5))
+    rows = max(1, int((ymax - ymin) / res + 0.5))
+    return (xmin, res, 0.0, ymax, 0.0, -res), (rows, cols)
+
+def cell_centers(geotransform, shape, row_off=0, col_off=0):
+    """Cell-centre coordinates (xs, ys) of a window of a north-up grid"""
+    rows, cols = shape
+    x0, dx, _, y0, _, dy = geotransform
+    xs = x0 + (np.arange(col_off, col_off + cols) + 0.5) * dx
+    ys = y0 + (np.arange(row_off, row_off + rows) + 0.5) * dy
+    return xs, ys
+
+def layer_xy(layer):
+    """Point coordinates of a vector layer as an (n, 2) float64 array"""
+    pts = []
+    for feat in layer.getFeatures():
+        geom = feat.geometry()
+        if geom is None or geom.isEmpty():
+            continue
+        for v in geom.vertices():  # Point y MultiPoint
+            pts.append((v.x(), v.y()))
+    return np.asarray(pts, dtype="float64").reshape(-1, 2)
+
+def distance_field(xy, geotransform, shape, max_dist=None, block_rows=256):
+    """
+    Distancia (m) desde el centro de cada celda al punto más cercano.
+    Las celdas más allá de max_dist quedan en inf. Usa un KD-tree (scipy) si
+    está disponible; si no, actualiza solo la ventana de cada punto con NumPy.
+    """
+    rows, cols = shape
+    dist = np.full(shape, np.inf, dtype="float32")
+    xy = np.asarray(xy, dtype="float64").reshape(-1, 2)
+    if len(xy) == 0:
+        return dist
+    xs, ys = cell_centers(geotransform, shape)
+
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+
+    if cKDTree is not None:
+        tree = cKDTree(xy)
+        # Margen de una celda: el corte exacto se aplica después
+        bound = np.inf if max_dist is None else max_dist + abs(geotransform[1])
+        for r0 in range(0, rows, block_rows):
+            r1 = min(rows, r0 + block_rows)
+            gx, gy = np.meshgrid(xs, ys[r0:r1])
+            d, _ = tree.query(np.column_stack((gx.ravel(), gy.ravel())),
+                              distance_upper_bound=bound, workers=-1)
+            dist[r0:r1] = d.reshape(r1 - r0, cols)
+    else:
+        x0, dx, _, y0, _, dy = geotransform
+        reach = np.inf if max_dist is None else max_dist
+        for px, py in xy:
+            if np.isinf(reach):
+                c0, c1, r0, r1 = 0, cols, 0, rows
+            else:
+                c0 = max(0, int(math.floor((px - reach - x0) / dx)))
+                c1 = min(cols, int(math.ceil((px + reach - x0) / dx)) + 1)
+                r0 = max(0, int(math.floor((py + reach - y0) / dy)))
+                r1 = min(rows, int(math.ceil((py - reach - y0) / dy)) + 1)
+            if c0 >= c1 or r0 >= r1:
+                continue
+            d = np.hypot(xs[c0:c1][None, :] - px, ys[r0:r1][:, None] - py)
+            np.minimum(dist[r0:r1, c0:c1], d, out=dist[r0:r1, c0:c1])
+
+    if max_dist is not None:
+        dist[dist > max_dist] = np.inf
+    return dist
+
+def classify_rings(dist, rings=HAZARD_RINGS):
+    """Clasifica un campo de distancias en niveles de amenaza (uint8, 0 = fuera)"""
+    rings = sorted(rings)
+    edges = np.array([d for d, _ in rings], dtype="float64")
+    levels = np.array([lvl for _, lvl in rings] + [0], dtype="uint8")
+    # side="left": una celda a exactamente d metros pertenece al anillo interior
+    return levels[np.searchsorted(edges, dist, side="left")]
+
+# ---------- Salidas ráster optimizadas (COG) ----------
+COG_BLOCKSIZE = 512
+
+def array_to_dataset(array, geotransform, crs, nodata=None):
+    """2-D NumPy array as an in-memory (MEM) GDAL dataset"""
+    from osgeo import gdal, gdal_array, osr
+    rows, cols = array.shape
+    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+    ds = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal_type)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    ds.SetGeoTransform(geotransform)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(array)
+    return ds
+
+def cog_compression():
+    """ZSTD when this GDAL build supports it, DEFLATE otherwise"""
+    from osgeo import gdal
+    drv = gdal.GetDriverByName("COG") or gdal.GetDriverByName("GTiff")
+    return "ZSTD" if "ZSTD" in (drv.GetMetadataItem("DMD_CREATIONOPTIONLIST") or "") else "DEFLATE"
+
+def is_cog(path):
+    """True if GDAL reports the file as a Cloud Optimized GeoTIFF"""
+    from osgeo import gdal
+    ds = gdal.Open(path)
+    return ds is not None and ds.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE") == "COG"
+
+def write_cog(src, dst, categorical=False):
+    """
+    Escribe src (ruta o dataset) como COG: teselado interno, ZSTD/DEFLATE con
+    predictor, pirámides internas (MODE para categorías, AVERAGE para
+    conteos) y estadísticas exactas en el .aux.xml.
+    """
+    from osgeo import gdal
+    tmp = dst + ".tmp.tif"
+    resampling = "MODE" if categorical else "AVERAGE"
+    if gdal.GetDriverByName("COG") is not None:
+        opts = [f"COMPRESS={cog_compression()}", "PREDICTOR=YES", f"BLOCKSIZE={COG_BLOCKSIZE}",
+                "OVERVIEWS=AUTO", f"OVERVIEW_RESAMPLING={resampling}", "BIGTIFF=IF_SAFER",
+                "NUM_THREADS=ALL_CPUS"]
+        out = gdal.Translate(tmp, src, format="COG", creationOptions=opts)
+    else:
+        # GDAL < 3.1: GeoTIFF teselado + overviews internas
+        src_ds = gdal.Open(src) if isinstance(src, str) else src
+        mem = gdal.Translate("", src_ds, format="MEM")
+        mem.BuildOverviews(resampling, [2, 4, 8, 16, 32])
+        dt = mem.GetRasterBand(1).DataType
+        predictor = "3" if dt in (gdal.GDT_Float32, gdal.GDT_Float64) else "2"
+        out = gdal.GetDriverByName("GTiff").CreateCopy(tmp, mem, options=[
+            "TILED=YES", f"BLOCKXSIZE={COG_BLOCKSIZE}", f"BLOCKYSIZE={COG_BLOCKSIZE}",
+            f"COMPRESS={cog_compression()}", f"PREDICTOR={predictor}",
+            "COPY_SRC_OVERVIEWS=YES", "BIGTIFF=IF_SAFER"])
+    if out is None:
+        raise RuntimeError(f"No se pudo escribir el COG: {dst}")
+    out = None
+    for ext in ("", ".aux.xml"):
+        if os.path.exists(dst + ext):
+            os.remove(dst + ext)
+    os.replace(tmp, dst)
+    ds = gdal.Open(dst)
+    ds.GetRasterBand(1).ComputeStatistics(False)  # exactas (approx_ok=False) -> .aux.xml
+    ds = None
+    return dst
+
+def ensure_cog(src, dst, categorical=False):
+    """Copy src to dst as a COG; converts in place when src == dst and is not a COG yet"""
+    if os.path.abspath(src) == os.path.abspath(dst) and is_cog(dst):
+        return dst
+    print_progress(f"Escribiendo COG: {os.path.basename(dst)}")
+    return write_cog(src, dst, categorical)
+
+def write_geotiff(path, array, geotransform, crs, nodata=None, categorical=False):
+    """Write a 2-D NumPy array as a single-band COG"""
+    return write_cog(array_to_dataset(array, geotransform, crs, nodata), path, categorical)
+
+def build_hazard_raster(xy, extent, res, out_path, crs, rings=HAZARD_RINGS):
+    """
+    Raster de amenaza por anillos de distancia en una sola pasada:
+    puntos (CRS métrico) -> campo de distancias -> niveles -> GeoTIFF.
+    extent = (xmin, xmax, ymin, ymax) en el mismo CRS que los puntos.
+    """
+    gt, shape = grid_from_extent(*extent, res)
+    dist = distance_field(xy, gt, shape, max_dist=max(d for d, _ in rings))
+    haz = classify_rings(dist, rings)  # uint8: el tipo sin pérdida más pequeño
+    write_geotiff(out_path, haz, gt, crs, nodata=0, categorical=True)
+    print_progress(f"Amenaza: {len(xy)} puntos, {shape[1]}x{shape[0]} celdas de {res} m")
+    trace_note(points=len(xy), cells=shape[0] * shape[1])
+    return out_path
+
+# ---------- Exposición por bloques (amenaza -> máscara -> población expuesta -> zonales) ----------
+EXPOSURE_THRESHOLD = 2     # amenaza >= "moderada"
+EXPOSURE_BLOCK_ROWS = 512  # filas por bloque; acota la memoria (~cols * 512 * 4 bytes)
+WRITE_INTERMEDIATES = False  # escribir hazard_ge*_bin.tif / pop_expuesta_100m.tif
+ZONE_NAME_FIELD = "shapeName"
+
+def iter_row_blocks(rows, block_rows=EXPOSURE_BLOCK_ROWS):
+    """Yield (row_off, nrows) strips covering a raster"""
+    for r0 in range(0, rows, block_rows):
+        yield r0, min(block_rows, rows - r0)
+
+def warp_to_grid_vrt(src_path, ref_ds, resample="near"):
+    """Virtual (lazy) warp of a raster onto the grid of ref_ds; nothing is written to disk"""
+    from osgeo import gdal
+    gt = ref_ds.GetGeoTransform()
+    cols, rows = ref_ds.RasterXSize, ref_ds.RasterYSize
+    bounds = (gt[0], gt[3] + rows * gt[5], gt[0] + cols * gt[1], gt[3])
+    vrt = gdal.Warp("", src_path, format="VRT", dstSRS=ref_ds.GetProjection(),
+                    outputBounds=bounds, width=cols, height=rows, resampleAlg=resample)
+    if vrt is None:
+        raise RuntimeError(f"No se pudo alinear {src_path} a la grilla de referencia")
+    return vrt
+
+def load_zones(zones_path, name_field=ZONE_NAME_FIELD):
+    """
+    Copia los polígonos zonales a una capa OGR en memoria con un campo entero
+    'zid' (1..n; 0 = fuera de toda zona). Devuelve (datasource, capa, nombres).
+    """
+    from osgeo import ogr
+    src = ogr.Open(zones_path)
+    if src is None:
+        raise RuntimeError(f"No se pudo abrir la capa zonal: {zones_path}")
+    src_lyr = src.GetLayer(0)
+    mem = ogr.GetDriverByName("Memory").CreateDataSource("zones")
+    lyr = mem.CreateLayer("zones", srs=src_lyr.GetSpatialRef(), geom_type=ogr.wkbMultiPolygon)
+    lyr.CreateField(ogr.FieldDefn("zid", ogr.OFTInteger))
+    names = []
+    for feat in src_lyr:
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        names.append(feat.GetField(name_field) if name_field else str(feat.GetFID()))
+        out = ogr.Feature(lyr.GetLayerDefn())
+        out.SetField("zid", len(names))
+        out.SetGeometry(geom.Clone())
+        lyr.CreateFeature(out)
+    return mem, lyr, names
+
+def rasterize_zones(zone_layer, ref_ds, row_off=0, nrows=None):
+    """Burn the 'zid' field of zone_layer into a strip of the ref_ds grid (uint16 array)"""
+    from osgeo import gdal
+    gt = ref_ds.GetGeoTransform()
+    cols = ref_ds.RasterXSize
+    nrows = ref_ds.RasterYSize - row_off if nrows is None else nrows
+    mem = gdal.GetDriverByName("MEM").Create("", cols, nrows, 1, gdal.GDT_UInt16)
+    mem.SetGeoTransform((gt[0], gt[1], gt[2], gt[3] + row_off * gt[5], gt[4], gt[5]))
+    mem.SetProjection(ref_ds.GetProjection())
+    gdal.RasterizeLayer(mem, [1], zone_layer, options=["ATTRIBUTE=zid"])
+    return mem.GetRasterBand(1).ReadAsArray()
+
+def create_grid(path, geotransform, shape, crs, gdal_type, nodata=None):
+    """Empty single-band tiled GeoTIFF on a grid; crs = any SetFromUserInput string or WKT"""
+    from osgeo import gdal, osr
+    rows, cols = shape
+    ds = gdal.GetDriverByName("GTiff").Create(
+        path, cols, rows, 1, gdal_type, ["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"])
+    if ds is None:
+        raise RuntimeError(f"No se pudo crear el raster: {path}")
+    ds.SetGeoTransform(geotransform)
+    if crs:
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(crs)
+        ds.SetProjection(srs.ExportToWkt())
+    if nodata is not None:
+        ds.GetRasterBand(1).SetNoDataValue(nodata)
+    return ds
+
+def create_like(path, ref_ds, gdal_type, nodata=None):
+    """Empty single-band GeoTIFF on the grid of ref_ds"""
+    return create_grid(path, ref_ds.GetGeoTransform(), (ref_ds.RasterYSize, ref_ds.RasterXSize),
+                       ref_ds.GetProjection(), gdal_type, nodata)
+
+def valid_population(block, nodata):
+    """Population block as float64 with NoData/NaN/negatives set to 0"""
+    block = block.astype("float64", copy=False)
+    if not block.flags.writeable:  # vista memmap de solo lectura (iter_windows)
+        block = block.copy()
+    bad = ~np.isfinite(block) | (block < 0)
+    if nodata is not None:
+        bad |= block == nodata
+    block[bad] = 0.0
+    return block
+
+# ---------- Acceso por ventanas a WorldPop (memmap) y estadísticas exactas ----------
+# Bordes de histograma para conteos de población por celda (personas)
+POP_HIST_EDGES = (0, 0.001, 0.1, 1, 5, 10, 50, 100, 500, 1000)
+
+def raster_memmap(path):
+    """
+    Vista np.memmap de solo lectura de la banda 1 de un GeoTIFF sin
+    compresión con los bloques contiguos en el archivo: (rows, cols) si está
+    en tiras, (teselas_y, teselas_x, alto, ancho) si está teselado. None si
+    no aplica (comprimido, intercalado por píxel, bloques dispersos...).
+    """
+    from osgeo import gdal, gdal_array
+    ds = gdal.Open(path)
+    if ds is None or ds.GetDriver().ShortName != "GTiff":
+        return None
+    if ds.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE") or (
+            ds.RasterCount > 1 and ds.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE") == "PIXEL"):
+        return None
+    band = ds.GetRasterBand(1)
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+    bw, bh = band.GetBlockSize()
+    nbx, nby = -(-cols // bw), -(-rows // bh)
+    with open(path, "rb") as f:
+        order = "<" if f.read(2) == b"II" else ">"
+    dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)).newbyteorder(order)
+
+    def offset(bx, by):
+        return int(band.GetMetadataItem(f"BLOCK_OFFSET_{bx}_{by}", "TIFF") or 0)
+
+    tiled = bw != cols  # GTiff en tiras: bloque = ancho completo; teselas pueden ser más anchas que el raster
+    if not tiled:
+        nbx = 1
+    block_bytes = bw * bh * dtype.itemsize
+    first = offset(0, 0)
+    if not first or any(offset(bx, by) != first + (by * nbx + bx) * block_bytes
+                        for by in range(nby) for bx in range(nbx)):
+        return None
+    if tiled:
+        return np.memmap(path, dtype=dtype, mode="r", offset=first, shape=(nby, nbx, bh, bw))
+    return np.memmap(path, dtype=dtype, mode="r", offset=first, shape=(rows, cols))
+
+def iter_windows(path, block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Recorre la banda 1 en tiras: (row_off, array). Sin compresión, vistas
+    memmap sin copia (tiras) o tiras armadas de teselas mapeadas; si no,
+    lecturas GDAL alineadas a la altura de bloque del archivo (cada tesela
+    comprimida se decodifica una sola vez). Las vistas son de solo lectura.
+    """
+    from osgeo import gdal
+    ds = gdal.Open(path)
+    if ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster: {path}")
+    band = ds.GetRasterBand(1)
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+    bh = band.GetBlockSize()[1]
+    mm = raster_memmap(path)
+    for r0, nrows in iter_row_blocks(rows, max(bh, block_rows // bh * bh)):
+        if mm is None:
+            yield r0, band.ReadAsArray(0, r0, cols, nrows)
+        elif mm.ndim == 2:
+            yield r0, mm[r0:r0 + nrows]
+        else:
+            t0, t1 = r0 // bh, -(-(r0 + nrows) // bh)
+            strip = mm[t0:t1].transpose(0, 2, 1, 3).reshape((t1 - t0) * bh, -1)
+            yield r0, strip[:nrows, :cols]
+
+def raster_access(path):
+    """How iter_windows reads a raster: 'memmap-strips', 'memmap-tiles' or 'gdal-blocks'"""
+    mm = raster_memmap(path)
+    return "gdal-blocks" if mm is None else ("memmap-strips" if mm.ndim == 2 else "memmap-tiles")
+
+def raster_stats(path, edges=POP_HIST_EDGES, block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Estadísticas exactas de la banda 1 en una pasada por ventanas (nunca el
+    arreglo completo en memoria): count, sum, min, max, mean, % válido,
+    conteos de NaN/NoData/negativos e histograma sobre edges (primer bin
+    < edges[0], último >= edges[-1]). NaN y NoData no cuentan como válidos.
+    """
+    from osgeo import gdal
+    ds = gdal.Open(path)
+    if ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster: {path}")
+    nodata = ds.GetRasterBand(1).GetNoDataValue()
+    edges = np.asarray(edges, dtype="float64")
+    hist = np.zeros(len(edges) + 1, dtype="int64")
+    sums, count, n_nan, n_nodata, n_neg = [], 0, 0, 0, 0
+    vmin, vmax = math.inf, -math.inf
+    for _, block in iter_windows(path, block_rows):
+        v = np.asarray(block, dtype="float64").ravel()
+        finite = np.isfinite(v)
+        n_finite = int(finite.sum())
+        n_nan += v.size - n_finite
+        if nodata is not None:
+            finite &= v != nodata
+        v = v[finite]
+        n_nodata += n_finite - v.size
+        if v.size == 0:
+            continue
+        count += v.size
+        sums.append(float(v.sum()))  # suma por pares en float64; fsum entre bloques
+        vmin, vmax = min(vmin, float(v.min())), max(vmax, float(v.max()))
+        n_neg += int((v < 0).sum())
+        hist += np.bincount(np.searchsorted(edges, v, side="right"), minlength=len(hist))
+    total = math.fsum(sums)
+    cells = ds.RasterXSize * ds.RasterYSize
+    bounds = [-math.inf] + edges.tolist() + [math.inf]
+    stats = {
+        "path": os.path.basename(path), "access": raster_access(path), "cells": cells,
+        "count": count, "nan": n_nan, "nodata": n_nodata, "negative": n_neg,
+        "sum": total, "min": vmin if count else None, "max": vmax if count else None,
+        "mean": total / count if count else None,
+        "valid_percent": round(100.0 * count / cells, 4) if cells else 0.0,
+        "histogram": [{"from": bounds[i], "to": bounds[i + 1], "count": int(c)}
+                      for i, c in enumerate(hist)],
+    }
+    print_progress(f"Estadísticas exactas de {stats['path']}: suma {total:,.0f}, "
+                   f"{count:,} celdas válidas ({stats['valid_percent']}%), acceso {stats['access']}")
+    trace_note(cells=cells, access=stats["access"])
+    return stats
+
+def write_json(obj, path):
+    """Write a JSON document (non-finite floats as null)"""
+    def clean(o):
+        if isinstance(o, float) and not math.isfinite(o):
+            return None
+        if isinstance(o, dict):
+            return {k: clean(v) for k, v in o.items()}
+        if isinstance(o, (list, tuple)):
+            return [clean(v) for v in o]
+        return o
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(clean(obj), f, indent=1, ensure_ascii=False)
+    return path
+
+def check_population_totals(stats, exposure_csv, tolerance=0.01):
+    """
+    Validación: la suma por unidad (pop_sum de la tabla de exposición) no
+    debe alejarse del total nacional exacto más que tolerance (fracción).
+    Devuelve la razón suma_unidades / total nacional.
+    """
+    with open(exposure_csv, newline="", encoding="utf-8") as f:
+        zones_total = math.fsum(float(row["pop_sum"]) for row in csv.DictReader(f))
+    ratio = zones_total / stats["sum"] if stats["sum"] else float("nan")
+    msg = (f"Total nacional {stats['sum']:,.0f} vs suma por unidad {zones_total:,.0f} "
+           f"({100 * ratio:.2f}%)")
+    print_progress(("✅ " if abs(ratio - 1) <= tolerance else "⚠️ ") + msg)
+    if stats["negative"] or stats["nan"]:
+        print_progress(f"⚠️ WorldPop: {stats['negative']:,} celdas negativas, {stats['nan']:,} NaN (tratadas como 0)")
+    return ratio
+
+# ---------- Índice zonal precalculado (raster de IDs de departamento) ----------
+SIDECAR_EXTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+def file_signature(path):
+    """Size + mtime of a file and, for shapefiles, of its sidecars"""
+    stem, ext = os.path.splitext(path)
+    paths = [stem + e for e in SIDECAR_EXTS] if ext.lower() == ".shp" else [path]
+    sig = []
+    for pth in paths:
+        if os.path.exists(pth):
+            st = os.stat(pth)
+            sig.append([os.path.basename(pth), st.st_size, int(st.st_mtime)])
+    return sig
+
+def grid_signature(ds):
+    """[geotransform, cols, rows, WKT] of a dataset's grid"""
+    return [list(ds.GetGeoTransform()), ds.RasterXSize, ds.RasterYSize, ds.GetProjection()]
+
+def zone_index_path(zones_path, ref_path, cache_dir=None):
+    """
+    Cache location of the zone-ID raster: <zones>_zid_<grid digest>.tif next
+    to the reference raster (or in cache_dir), so indexes of several grids
+    in one folder coexist
+    """
+    from osgeo import gdal
+    ref_ds = gdal.Open(ref_path)
+    if ref_ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster de referencia: {ref_path}")
+    digest = hashlib.sha1(json.dumps(grid_signature(ref_ds)).encode("utf-8")).hexdigest()[:10]
+    stem = os.path.splitext(os.path.basename(zones_path))[0]
+    return os.path.join(cache_dir or os.path.dirname(ref_path), f"{stem}_zid_{digest}.tif")
+
+def zone_index(zones_path, ref_path, name_field=ZONE_NAME_FIELD,
+               block_rows=EXPOSURE_BLOCK_ROWS, cache_dir=None):
+    """
+    Raster de IDs de zona (uint16; 0 = sin zona) alineado a la grilla de
+    ref_path, construido una vez y reutilizado (uno por grilla, junto a
+    ref_path o en cache_dir). La clave (firma de la capa zonal + grilla +
+    campo) se guarda en los metadatos; si cambia, se reconstruye. Devuelve
+    (ruta, nombres) con nombres[i] = zona i + 1.
+    """
+    from osgeo import gdal
+    cache_path = zone_index_path(zones_path, ref_path, cache_dir)
+    ref_ds = gdal.Open(ref_path)
+    key = json.dumps({
+        "zones": file_signature(zones_path),
+        "field": name_field,
+        "grid": grid_signature(ref_ds),
+    }, sort_keys=True)
+
+    if os.path.exists(cache_path):
+        cached = gdal.Open(cache_path)
+        if cached is not None and cached.GetMetadataItem("ZONE_KEY") == key:
+            print_progress(f"Índice zonal en caché: {os.path.basename(cache_path)}")
+            trace_note(zone_index="caché")
+            return cache_path, json.loads(cached.GetMetadataItem("ZONE_NAMES"))
+        cached = None
+
+    print_progress(f"Construyendo índice zonal: {os.path.basename(cache_path)}")
+    _zones_ds, zone_lyr, names = load_zones(zones_path, name_field)
+    out = create_like(cache_path, ref_ds, gdal.GDT_UInt16, nodata=None)
+    for r0, nrows in iter_row_blocks(ref_ds.RasterYSize, block_rows):
+        out.GetRasterBand(1).WriteArray(rasterize_zones(zone_lyr, ref_ds, r0, nrows), 0, r0)
+    out.SetMetadataItem("ZONE_KEY", key)
+    out.SetMetadataItem("ZONE_NAMES", json.dumps(names, ensure_ascii=False))
+    out = None
+    trace_note(zone_index="construido")
+    return cache_path, names
+
+def zonal_reduce(values, zid, nzones, valid=None):
+    """Per-zone (sum, count) of a block via bincount; zid 0 = outside every zone"""
+    zid = zid.ravel()
+    values = values.ravel()
+    if valid is not None:
+        valid = valid.ravel()
+        zid = zid[valid]
+        values = values[valid]
+    return (np.bincount(zid, weights=values, minlength=nzones),
+            np.bincount(zid, minlength=nzones))
+
+def zonal_stats(raster_path, zones_path, name_field=ZONE_NAME_FIELD,
+                block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    SUM/COUNT/MEAN por zona de cualquier raster en la grilla del índice zonal
+    (por ejemplo pop_expuesta_100m.tif). Ignora NoData y NaN.
+    """
+    from osgeo import gdal
+    zid_path, names = zone_index(zones_path, raster_path, name_field, block_rows)
+    ds, zid_ds = gdal.Open(raster_path), gdal.Open(zid_path)
+    band, zid_band = ds.GetRasterBand(1), zid_ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    nz = len(names) + 1
+    sums = np.zeros(nz, dtype="float64")
+    counts = np.zeros(nz, dtype="int64")
+    for r0, block in iter_windows(raster_path, block_rows):
+        nrows = block.shape[0]
+        vals = block.astype("float64", copy=False)
+        valid = np.isfinite(vals) if nodata is None else np.isfinite(vals) & (vals != nodata)
+        s_, c_ = zonal_reduce(vals, zid_band.ReadAsArray(0, r0, ds.RasterXSize, nrows), nz, valid)
+        sums += s_
+        counts += c_
+    means = np.divide(sums, counts, out=np.zeros(nz), where=counts > 0)
+    return [{"zone": n, "sum": float(sums[i]), "count": int(counts[i]), "mean": float(means[i])}
+            for i, n in enumerate(names, start=1)]
+
+def compute_exposure(pop_path, haz_path, zones_path, threshold=EXPOSURE_THRESHOLD,
+                     name_field=ZONE_NAME_FIELD, block_rows=EXPOSURE_BLOCK_ROWS,
+                     mask_out=None, exposed_out=None):
+    """
+    Población expuesta por zona en una sola pasada por bloques sobre la grilla
+    de población: amenaza alineada (VRT, vecino más cercano) >= umbral ->
+    población * máscara -> suma por zona (índice zonal en caché, zone_index).
+    mask_out/exposed_out (opcionales) escriben hazard_ge*_bin.tif y
+    pop_expuesta_*.tif bloque a bloque.
+    Devuelve una lista de dicts {zone, pop_sum, exp_sum}.
+    """
+    from osgeo import gdal
+    pop_ds = gdal.Open(pop_path)
+    if pop_ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster de población: {pop_path}")
+    pop_band = pop_ds.GetRasterBand(1)
+    pop_nodata = pop_band.GetNoDataValue()
+    haz_band = warp_to_grid_vrt(haz_path, pop_ds).GetRasterBand(1)
+    zid_path, names = zone_index(zones_path, pop_path, name_field, block_rows)
+    zid_ds = gdal.Open(zid_path)
+    zid_band = zid_ds.GetRasterBand(1)
+
+    nz = len(names) + 1
+    pop_sum = np.zeros(nz, dtype="float64")
+    exp_sum = np.zeros(nz, dtype="float64")
+    mask_ds = create_like(mask_out, pop_ds, gdal.GDT_Byte) if mask_out else None
+    exp_ds = create_like(exposed_out, pop_ds, gdal.GDT_Float32) if exposed_out else None
+
+    cols = pop_ds.RasterXSize
+    for r0, block in iter_windows(pop_path, block_rows):
+        nrows = block.shape[0]
+        pop = valid_population(block, pop_nodata)
+        exposed_mask = haz_band.ReadAsArray(0, r0, cols, nrows) >= threshold
+        exposed = pop * exposed_mask
+        zid = zid_band.ReadAsArray(0, r0, cols, nrows)
+        pop_sum += zonal_reduce(pop, zid, nz)[0]
+        exp_sum += zonal_reduce(exposed, zid, nz)[0]
+        if mask_ds is not None:
+            mask_ds.GetRasterBand(1).WriteArray(exposed_mask.astype("uint8"), 0, r0)
+        if exp_ds is not None:
+            exp_ds.GetRasterBand(1).WriteArray(exposed.astype("float32"), 0, r0)
+
+    mask_ds = exp_ds = None  # cierra y vuelca a disco
+    print_progress(f"Exposición (amenaza >= {threshold}): {exp_sum[1:].sum():,.0f} personas")
+    trace_note(cells=cols * pop_ds.RasterYSize, zones=len(names))
+    return [{"zone": n, "pop_sum": float(pop_sum[i + 1]), "exp_sum": float(exp_sum[i + 1])}
+            for i, n in enumerate(names)]
+
+# ---------- Escenarios: barrido de umbrales y distancias de anillo ----------
+SCENARIO_THRESHOLDS = (1, 2, 3)
+
+def distance_on_grid(xy, extent, crs, res, ref_ds, max_dist=None):
+    """
+    Campo de distancias calculado una vez en el CRS métrico (extent, res) y
+    remuestreado (vecino más cercano) a la grilla de ref_ds. Fuera del
+    extent métrico la distancia es inf.
+    """
+    from osgeo import gdal, osr
+    gt, shape = grid_from_extent(*extent, res)
+    dist = distance_field(xy, gt, shape, max_dist=max_dist)
+    src = gdal.GetDriverByName("MEM").Create("", shape[1], shape[0], 1, gdal.GDT_Float32)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    src.SetGeoTransform(gt)
+    src.SetProjection(srs.ExportToWkt())
+    src.GetRasterBand(1).WriteArray(dist)
+    dist = None
+
+    rgt = ref_ds.GetGeoTransform()
+    cols, rows = ref_ds.RasterXSize, ref_ds.RasterYSize
+    out = gdal.Warp("", src, format="MEM", dstSRS=ref_ds.GetProjection(),
+                    outputBounds=(rgt[0], rgt[3] + rows * rgt[5], rgt[0] + cols * rgt[1], rgt[3]),
+                    width=cols, height=rows, resampleAlg="near", dstNodata=-1,
+                    warpOptions=["INIT_DEST=NO_DATA"])
+    if out is None:
+        raise RuntimeError("No se pudo remuestrear el campo de distancias")
+    field = out.GetRasterBand(1).ReadAsArray()
+    field[field < 0] = np.inf
+    return field
+
+def open_raster(path, what="población"):
+    """gdal.Open(path) or RuntimeError naming what the raster is"""
+    from osgeo import gdal
+    ds = gdal.Open(path)
+    if ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster de {what}: {path}")
+    return ds
+
+def zonal_bin_table(pop_path, zones_path, nb, bin_fn, name_field=ZONE_NAME_FIELD,
+                    block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Población por (zona, intervalo) en una sola pasada por tiras de pop_path:
+    bin_fn(r0, nrows) devuelve (intervalo 0..nb-1 de cada celda de la tira,
+    máscara de celdas a contar o None). Cada pregunta (escenario, umbral,
+    corte) es luego una suma sobre la tabla. Devuelve (nombres, tabla
+    (zonas + 1, nb)); la fila 0 es "fuera de toda zona".
+    """
+    from osgeo import gdal
+    pop_ds = open_raster(pop_path)
+    pop_nodata = pop_ds.GetRasterBand(1).GetNoDataValue()
+    zid_path, names = zone_index(zones_path, pop_path, name_field, block_rows)
+    zid_band = gdal.Open(zid_path).GetRasterBand(1)
+
+    nz = len(names) + 1
+    table = np.zeros(nz * nb, dtype="float64")
+    cols = pop_ds.RasterXSize
+    for r0, block in iter_windows(pop_path, block_rows):
+        nrows = block.shape[0]
+        pop = valid_population(block, pop_nodata)
+        bins, keep = bin_fn(r0, nrows)
+        if keep is not None:
+            pop = pop * keep
+        zid = zid_band.ReadAsArray(0, r0, cols, nrows).astype("int64")
+        table += np.bincount((zid * nb + bins).ravel(), weights=pop.ravel(), minlength=nz * nb)
+    trace_note(cells=cols * pop_ds.RasterYSize, zones=len(names))
+    return names, table.reshape(nz, nb)
+
+def distance_bins(dist, edges):
+    """Intervalo de cada distancia entre bordes ordenados; side="left" como en classify_rings"""
+    return np.searchsorted(edges, dist, side="left")
+
+def scenario_rows(names, table, edges, ring_sets, thresholds):
+    """
+    Filas {rings, threshold, zone, exp_sum} a partir de la tabla (zona,
+    intervalo de distancia) de zonal_bin_table con bordes edges.
+    """
+    rows = []
+    for rings in ring_sets:
+        # Nivel de cada intervalo: el del borde superior (el último intervalo es 0)
+        bin_level = np.append(classify_rings(edges, rings), 0)
+        for t in thresholds:
+            exp = table[:, bin_level >= t].sum(axis=1)
+            rows.extend({"rings": ring_set_label(rings), "threshold": t, "zone": n,
+                         "exp_sum": float(exp[i])} for i, n in enumerate(names, start=1))
+    return rows
+
+def ring_set_label(rings):
+    """'10/20/30 km' style label for a ring set"""
+    return "/".join(f"{d / 1000:g}" for d, _ in sorted(rings)) + " km"
+
+def run_scenarios(pop_path, xy, extent, crs, zones_path, thresholds=SCENARIO_THRESHOLDS,
+                  ring_sets=(HAZARD_RINGS,), res=100, name_field=ZONE_NAME_FIELD,
+                  block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Evalúa todos los escenarios (conjunto de anillos x umbral) con una sola
+    lectura de población y un solo campo de distancias. La pasada por bloques
+    acumula la población por (zona, intervalo de distancia) usando los bordes
+    de todos los anillos; cada escenario es luego una suma sobre esa tabla.
+    Devuelve filas {rings, threshold, zone, exp_sum}.
+    """
+    edges = np.unique([float(d) for rings in ring_sets for d, _ in rings])
+    dist = distance_on_grid(xy, extent, crs, res, open_raster(pop_path), max_dist=edges[-1])
+    # último intervalo: más allá de todos los anillos
+    names, table = zonal_bin_table(
+        pop_path, zones_path, len(edges) + 1,
+        lambda r0, nrows: (distance_bins(dist[r0:r0 + nrows], edges), None),
+        name_field, block_rows)
+    rows = scenario_rows(names, table, edges, ring_sets, thresholds)
+    print_progress(f"Escenarios evaluados: {len(ring_sets) * len(thresholds)}")
+    trace_note(scenarios=len(ring_sets) * len(thresholds))
+    return rows
+
+def write_rows_csv(rows, path):
+    """Write a list of dicts (same keys) as CSV"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+        w.writeheader()
+        w.writerows(rows)
+    return path
+
+# ---------- Accesibilidad: población expuesta lejos de establecimientos ----------
+ACCESS_CUTOFFS = (5000, 10000, 20000)  # m al establecimiento más cercano
+FACILITY_FIELDS = ("Longitude", "Latitude")
+
+def accessibility_rows(names, table, edges):
+    """
+    Filas {zone, cutoff_km, exp_sum, underserved, underserved_pct} a partir de
+    la tabla (zona, intervalo de distancia) de zonal_bin_table con bordes
+    edges (distance_bins). Desatendida = distancia > corte: el intervalo k
+    termina en edges[k] incluido, así que el corte k suma los intervalos k+1..
+    """
+    exp_sum = table.sum(axis=1)
+    rows = []
+    for k, cutoff in enumerate(edges):
+        under = table[:, k + 1:].sum(axis=1)
+        pct = np.divide(100 * under, exp_sum, out=np.zeros(len(exp_sum)), where=exp_sum > 0)
+        rows.extend({"zone": n, "cutoff_km": cutoff / 1000, "exp_sum": float(exp_sum[i]),
+                     "underserved": float(under[i]), "underserved_pct": round(float(pct[i]), 2)}
+                    for i, n in enumerate(names, start=1))
+    return rows
+
+def compute_accessibility(pop_path, haz_path, facilities_xy, extent, crs, zones_path,
+                          cutoffs=ACCESS_CUTOFFS, threshold=EXPOSURE_THRESHOLD, res=100,
+                          name_field=ZONE_NAME_FIELD, block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Población expuesta (amenaza >= umbral) y desatendida (establecimiento más
+    cercano a más de cada distancia de corte) por zona, para todos los cortes
+    en una sola pasada. La distancia al establecimiento más cercano se
+    calcula una vez (KD-tree sobre los establecimientos consultado con los
+    centros de celda, distance_on_grid); la pasada por bloques acumula la
+    población expuesta por (zona, intervalo de distancia) y cada corte es
+    una suma sobre esa tabla (zonal_bin_table, como en run_scenarios).
+    Devuelve filas {zone, cutoff_km, exp_sum, underserved, underserved_pct}.
+    """
+    edges = np.unique([float(c) for c in cutoffs])
+    pop_ds = open_raster(pop_path)
+    cols = pop_ds.RasterXSize
+    haz_band = warp_to_grid_vrt(haz_path, pop_ds).GetRasterBand(1)
+    dist = distance_on_grid(facilities_xy, extent, crs, res, pop_ds, max_dist=edges[-1])
+
+    def bins(r0, nrows):
+        # b = número de cortes < distancia: la celda queda desatendida para los cortes 0..b-1
+        return (distance_bins(dist[r0:r0 + nrows], edges),
+                haz_band.ReadAsArray(0, r0, cols, nrows) >= threshold)
+
+    names, table = zonal_bin_table(pop_path, zones_path, len(edges) + 1, bins, name_field, block_rows)
+    rows = accessibility_rows(names, table, edges)
+    print_progress(f"Accesibilidad: {len(facilities_xy)} establecimientos, cortes "
+                   f"{ring_set_label([(c, 0) for c in edges])}; desatendida a "
+                   f"{edges[-1] / 1000:g} km: {table[1:, -1].sum():,.0f} personas expuestas")
+    trace_note(facilities=len(facilities_xy), cutoffs=len(edges), zones=len(names))
+    return rows
+
+# ---------- Serie temporal WorldPop: cubo multianual con una sola máscara ----------
+WORLDPOP_YEARS = tuple(range(2000, 2021))
+WORLDPOP_YEAR_TEMPLATE = "{iso}_ppp_{year}_UNadj.tif"  # nombres de WorldPop por año (iso en minúsculas)
+CUBE_BLOCK_BYTES = 128 * 1024 ** 2  # cubo por tira (años x filas x columnas, float64); el reordenado usa otro tanto
+
+def check_aligned(paths):
+    """Raise unless every raster shares the grid (size, geotransform, CRS) of the first one"""
+    from osgeo import gdal, osr
+    ref = None
+    for pth in paths:
+        ds = gdal.Open(pth)
+        if ds is None:
+            raise RuntimeError(f"No se pudo abrir el raster: {pth}")
+        srs = osr.SpatialReference(wkt=ds.GetProjection())
+        grid = ((ds.RasterXSize, ds.RasterYSize), np.array(ds.GetGeoTransform()), srs)
+        if ref is None:
+            ref = grid
+        elif (grid[0] != ref[0] or not np.allclose(grid[1], ref[1], rtol=0, atol=1e-6 * abs(ref[1][1]))
+              or not grid[2].IsSame(ref[2])):
+            raise RuntimeError(f"{os.path.basename(pth)} no está en la grilla de {os.path.basename(paths[0])}")
+    return paths
+
+def cube_rows(paths, nbytes=CUBE_BLOCK_BYTES, block_rows=None):
+    """
+    Filas por tira del cubo: múltiplo común de la altura de bloque de todos
+    los archivos (así iter_windows recorre las mismas ventanas en cada año)
+    y dentro de nbytes para años x filas x columnas en float64, o lo más
+    cerca de block_rows si se indica.
+    """
+    from osgeo import gdal
+    step, cols = 1, 0
+    for pth in paths:
+        ds = gdal.Open(pth)
+        step = math.lcm(step, ds.GetRasterBand(1).GetBlockSize()[1])
+        cols = ds.RasterXSize
+    if block_rows:
+        return step * max(1, block_rows // step)
+    return step * max(1, nbytes // (len(paths) * cols * 8 * step))
+
+def iter_cube(paths, block_rows=None):
+    """
+    Recorre una pila de rásteres alineados como un cubo en tiras:
+    (row_off, cubo) con cubo (años, filas, columnas) en float64 y
+    NoData/NaN/negativos en 0 (valid_population). Cada año se lee con
+    iter_windows (memmap si no está comprimido).
+    """
+    from osgeo import gdal
+    block_rows = cube_rows(paths, block_rows=block_rows)
+    nodatas = [gdal.Open(pth).GetRasterBand(1).GetNoDataValue() for pth in paths]
+    for windows in zip(*(iter_windows(pth, block_rows) for pth in paths)):
+        r0 = windows[0][0]
+        yield r0, np.stack([valid_population(block, nd) for (_, block), nd in zip(windows, nodatas)])
+
+def zone_exposed_sums(cube, zid, exposed, nz):
+    """
+    Sumas (años, 2 * nz) de un cubo (años, filas, columnas) por clave
+    2 * zona + expuesta: las celdas se ordenan por clave una vez y todos los
+    años se suman juntos con np.add.reduceat. Columnas pares = no expuesta,
+    impares = expuesta.
+    """
+    ny = cube.shape[0]
+    key = (zid.astype("int64") * 2 + exposed).ravel()
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    out = np.zeros((ny, nz * 2), dtype="float64")
+    if key.size:
+        out[:, key[starts]] = np.add.reduceat(cube.reshape(ny, -1)[:, order], starts, axis=1)
+    return out
+
+def compute_exposure_series(pop_paths, haz_path, zones_path, threshold=EXPOSURE_THRESHOLD,
+                            name_field=ZONE_NAME_FIELD, block_rows=None, zid_dir=None):
+    """
+    Población total y expuesta por (año, zona) en una sola pasada por un cubo
+    multianual (pop_paths = {año: ruta}, todos en la misma grilla). La
+    amenaza alineada y el índice zonal se leen una vez por tira, no por año:
+    cada celda recibe la clave zona x expuesta, las celdas se ordenan por
+    clave una vez y todos los años se suman juntos (zone_exposed_sums).
+    zid_dir fija dónde guardar el índice zonal (por defecto junto al primer año).
+    Devuelve filas {year, zone, pop_sum, exp_sum}.
+    """
+    from osgeo import gdal
+    years = sorted(pop_paths)
+    paths = check_aligned([pop_paths[y] for y in years])
+    ref_path = paths[0]
+    ref_ds = gdal.Open(ref_path)
+    haz_band = warp_to_grid_vrt(haz_path, ref_ds).GetRasterBand(1)
+    zid_path, names = zone_index(zones_path, ref_path, name_field, cache_dir=zid_dir)
+    zid_band = gdal.Open(zid_path).GetRasterBand(1)
+
+    ny, nz = len(years), len(names) + 1
+    table = np.zeros((ny, nz * 2), dtype="float64")  # columna 2*zona + (amenaza >= umbral)
+    cols = ref_ds.RasterXSize
+    block_rows = cube_rows(paths, block_rows=block_rows)
+    for r0, cube in iter_cube(paths, block_rows):
+        nrows = cube.shape[1]
+        table += zone_exposed_sums(cube, zid_band.ReadAsArray(0, r0, cols, nrows),
+                                   haz_band.ReadAsArray(0, r0, cols, nrows) >= threshold, nz)
+
+    exp_sum = table[:, 1::2]
+    pop_sum = table[:, 0::2] + exp_sum
+    print_progress(f"Serie de exposición {years[0]}-{years[-1]} ({ny} años, amenaza >= {threshold}): "
+                   f"{exp_sum[0, 1:].sum():,.0f} -> {exp_sum[-1, 1:].sum():,.0f} personas")
+    trace_note(years=ny, cells=cols * ref_ds.RasterYSize, zones=len(names), cube_rows=block_rows,
+               access=raster_access(ref_path))
+    return [{"year": y, "zone": n, "pop_sum": float(pop_sum[k, i]), "exp_sum": float(exp_sum[k, i])}
+            for k, y in enumerate(years) for i, n in enumerate(names, start=1)]
+
+# ---------- Almacén columnar de resultados de exposición (consultas memoizadas) ----------
+RESULTS_DIR = "03_Resultados"
+RESULTS_COLUMNS = ("zone", "pop_sum", "exp_sum")
+RESULTS_LRU_BYTES = 64 * 1024 ** 2  # tope de los resultados en memoria (LRU)
+_RESULTS_LOCK = threading.Lock()
+_RESULTS = {"lru": OrderedDict(), "bytes": 0}  # hash -> columnas; el más reciente al final
+
+def result_key(pop_path, haz_path, zones_path, threshold, level=None, name_field=ZONE_NAME_FIELD,
+               hazard_params=None, population=None):
+    """
+    Clave de un resultado: amenaza (firma del raster + parámetros), umbral,
+    nivel zonal (firma de la capa, nivel, campo) y fuente de población
+    (firma del raster + etiqueta, p. ej. el año). Devuelve (clave, hash).
+    """
+    key = {
+        "hazard": dict(hazard_params or {}, file=file_signature(haz_path)),
+        "threshold": threshold,
+        "zones": {"file": file_signature(zones_path), "level": level, "field": name_field},
+        "population": {"file": file_signature(pop_path), "label": population},
+    }
+    payload = json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    return key, hashlib.sha256(payload).hexdigest()[:32]
+
+def result_path(store_dir, digest):
+    """Location of one stored result (typed NumPy archive, one array per column)"""
+    return os.path.join(store_dir, "exposicion", f"{digest}.npz")
+
+def save_result(store_dir, digest, key, columns):
+    """Atomically write the columns of one result plus its key"""
+    path = result_path(store_dir, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, key=np.array(json.dumps(key, sort_keys=True, default=str)), **columns)
+    os.replace(path + ".tmp", path)
+    return path
+
+def load_result(store_dir, digest):
+    """Columns of a stored result, or None (missing, truncated or corrupt: recomputed by the caller)"""
+    import zipfile
+    try:
+        with np.load(result_path(store_dir, digest)) as z:
+            return {c: z[c] for c in RESULTS_COLUMNS}
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        return None
+
+def _lru_get(digest):
+    with _RESULTS_LOCK:
+        columns = _RESULTS["lru"].get(digest)
+        if columns is not None:
+            _RESULTS["lru"].move_to_end(digest)
+        return columns
+
+def _lru_put(digest, columns, max_bytes=RESULTS_LRU_BYTES):
+    nbytes = sum(a.nbytes for a in columns.values())
+    with _RESULTS_LOCK:
+        lru = _RESULTS["lru"]
+        if digest in lru:
+            _RESULTS["bytes"] -= sum(a.nbytes for a in lru.pop(digest).values())
+        lru[digest] = columns
+        _RESULTS["bytes"] += nbytes
+        while _RESULTS["bytes"] > max_bytes and len(lru) > 1:
+            _, old = lru.popitem(last=False)
+            _RESULTS["bytes"] -= sum(a.nbytes for a in old.values())
+
+def clear_results_cache():
+    """Empty the in-memory result cache (the store on disk is kept)"""
+    with _RESULTS_LOCK:
+        _RESULTS["lru"].clear()
+        _RESULTS["bytes"] = 0
+
+def compute_exposure_thresholds(pop_path, haz_path, zones_path, thresholds,
+                                name_field=ZONE_NAME_FIELD, block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Población total y expuesta por zona para varios umbrales en una sola
+    pasada: acumula la población por (zona, umbrales superados) y cada umbral
+    es una suma sobre esa tabla (zonal_bin_table). Devuelve (nombres, pop_sum,
+    {umbral: exp_sum}).
+    """
+    edges = np.unique([float(t) for t in thresholds])
+    pop_ds = open_raster(pop_path)
+    cols = pop_ds.RasterXSize
+    haz_band = warp_to_grid_vrt(haz_path, pop_ds).GetRasterBand(1)
+    # b = umbrales <= amenaza: la celda está expuesta para los umbrales 0..b-1
+    names, table = zonal_bin_table(
+        pop_path, zones_path, len(edges) + 1,
+        lambda r0, nrows: (np.searchsorted(edges, haz_band.ReadAsArray(0, r0, cols, nrows), side="right"), None),
+        name_field, block_rows)
+    table = table[1:]
+    trace_note(thresholds=len(edges))
+    return names, table.sum(axis=1), {t: table[:, k + 1:].sum(axis=1) for k, t in enumerate(edges)}
+
+def query_exposure(store_dir, pop_paths, haz_path, zones_path, thresholds=(EXPOSURE_THRESHOLD,),
+                   level=None, name_field=ZONE_NAME_FIELD, hazard_params=None, zones=None,
+                   total=False, max_bytes=RESULTS_LRU_BYTES):
+    """
+    Población expuesta por (población, umbral, zona) desde el almacén
+    columnar: primero la caché LRU en memoria, luego los .npz de store_dir;
+    solo las claves que faltan se calculan (una pasada por fuente de
+    población para todos sus umbrales faltantes) y se guardan.
+    pop_paths = ruta o {etiqueta: ruta} (p. ej. {2020: ...}); zones filtra
+    por nombre; total=True suma las zonas. Devuelve columnas (dict de
+    arreglos NumPy): population, threshold, [zone,] pop_sum, exp_sum.
+    """
+    if isinstance(pop_paths, str):
+        pop_paths = {None: pop_paths}
+    thresholds = list(dict.fromkeys(float(t) for t in thresholds))
+    found, missing = {}, {}
+    hits = {"memoria": 0, "disco": 0, "calculados": 0}
+    for label, pth in pop_paths.items():
+        for t in thresholds:
+            key, digest = result_key(pth, haz_path, zones_path, t, level, name_field,
+                                     hazard_params, label)
+            columns = _lru_get(digest)
+            if columns is not None:
+                hits["memoria"] += 1
+            else:
+                columns = load_result(store_dir, digest)
+                if columns is not None:
+                    hits["disco"] += 1
+                    _lru_put(digest, columns, max_bytes)
+            if columns is None:
+                missing.setdefault(label, []).append((t, key, digest))
+            else:
+                found[label, t] = columns
+
+    for label, todo in missing.items():
+        with span("exposure_thresholds", cat="results", population=str(label)):
+            names, pop_sum, exp = compute_exposure_thresholds(
+                pop_paths[label], haz_path, zones_path, [t for t, _, _ in todo], name_field)
+        for t, key, digest in todo:
+            columns = {"zone": np.array(names, dtype=str), "pop_sum": pop_sum, "exp_sum": exp[t]}
+            save_result(store_dir, digest, key, columns)
+            _lru_put(digest, columns, max_bytes)
+            found[label, t] = columns
+            hits["calculados"] += 1
+
+    parts = []
+    for label in pop_paths:
+        for t in thresholds:
+            columns = found[label, t]
+            keep = np.isin(columns["zone"], list(zones)) if zones else slice(None)
+            zone = columns["zone"][keep]
+            pop_sum, exp_sum = columns["pop_sum"][keep], columns["exp_sum"][keep]
+            if total:
+                zone, pop_sum, exp_sum = None, pop_sum.sum(keepdims=True), exp_sum.sum(keepdims=True)
+            n = len(pop_sum)
+            part = {"population": np.full(n, "" if label is None else str(label)),
+                    "threshold": np.full(n, t)}
+            if zone is not None:
+                part["zone"] = zone
+            part.update(pop_sum=pop_sum, exp_sum=exp_sum)
+            parts.append(part)
+    trace_note(**{f"results_{k}": v for k, v in hits.items()})
+    print_progress("Resultados de exposición: " + ", ".join(f"{v} {k}" for k, v in hits.items()))
+    return {c: np.concatenate([p[c] for p in parts]) for c in parts[0]}
+
+# ---------- Pirámide multiresolución (amenaza + población expuesta) ----------
+PYRAMID_LEVELS = (100, 250, 1000)  # m; el más fino es la base, los demás se agregan de él
+PYRAMID_DIR = "piramide"
+
+def snapped_grid(extent, res, snap):
+    """Grid of cell size res whose edges are snapped outwards to multiples of snap (-tap)"""
+    xmin, xmax, ymin, ymax = extent
+    xmin, ymin = math.floor(xmin / snap) * snap, math.floor(ymin / snap) * snap
+    xmax, ymax = math.ceil(xmax / snap) * snap, math.ceil(ymax / snap) * snap
+    return grid_from_extent(xmin, xmax, ymin, ymax, res)
+
+def window_geotransform(geotransform, row_off):
+    """Geotransform of a strip starting at row_off"""
+    x0, dx, rx, y0, ry, dy = geotransform
+    return (x0, dx, rx, y0 + row_off * dy, ry, dy)
+
+def _sum_axis(a, ratio, axis):
+    """Sum fine cells into coarse cells of `ratio` fine cells along one axis"""
+    n = a.shape[axis]
+    if ratio.denominator == 1:
+        k = int(ratio)
+        return a.reshape(a.shape[:axis] + (n // k, k) + a.shape[axis + 1:]).sum(axis=axis + 1)
+    # Suma acumulada interpolada en los bordes gruesos: la celda fina partida
+    # por un borde se reparte según la fracción de área
+    csum = np.cumsum(a, axis=axis)
+    csum = np.concatenate([np.zeros_like(np.take(csum, [0], axis=axis)), csum], axis=axis)
+    pos = np.arange(int(n / ratio) + 1) * float(ratio)
+    i = np.minimum(np.floor(pos).astype("int64"), n)
+    f = (pos - i).reshape([-1 if ax == axis else 1 for ax in range(a.ndim)])
+    lo = np.take(csum, i, axis=axis)
+    edges = lo + f * (np.take(csum, np.minimum(i + 1, n), axis=axis) - lo)
+    return np.diff(edges, axis=axis)
+
+def block_sum(a, ratio):
+    """
+    Suma de un bloque fino en celdas de ratio x ratio celdas finas (ratio
+    racional >= 1, p. ej. Fraction(10) o Fraction(5, 2)). Con ratio entero
+    es una suma por bloques exacta; si no, las celdas cortadas por un borde
+    grueso se reparten por área. En ambos casos el total se conserva.
+    """
+    return _sum_axis(_sum_axis(a, ratio, 0), ratio, 1)
+
+def pyramid_paths(out_dir, levels):
+    """{res: {"hazard", "population", "exposed"}} output paths of each pyramid level"""
+    return {int(r): {kind: os.path.join(out_dir, f"{name}_{int(r)}m.tif") for kind, name in
+                     (("hazard", "amenaza"), ("population", "poblacion"), ("exposed", "pop_expuesta"))}
+            for r in levels}
+
+def build_pyramid(pop_path, xy, extent, crs, out_dir, levels=PYRAMID_LEVELS,
+                  rings=HAZARD_RINGS, threshold=EXPOSURE_THRESHOLD,
+                  block_rows=EXPOSURE_BLOCK_ROWS):
+    """
+    Amenaza, población y población expuesta alineadas en varias resoluciones
+    en una sola pasada. La población se alinea una vez (warp 'sum', GDAL
+    >= 3.1) a la grilla base (nivel más fino, bordes en múltiplos del mcm de
+    los niveles); los niveles gruesos son sumas de la base (block_sum: por
+    bloques si la razón es entera, repartidas por área si no, p. ej. 250 m
+    desde 100 m), así que la población expuesta total es la misma en todos. La amenaza de cada
+    nivel se clasifica sobre su propia grilla.
+    Devuelve {res: {"hazard", "population", "exposed"}} (rutas COG).
+    """
+    from fractions import Fraction
+    from osgeo import gdal, osr
+    levels = sorted(int(r) for r in levels)
+    base = levels[0]
+    snap = math.lcm(*levels)
+    ratios = {r: Fraction(r, base) for r in levels}
+    step = math.lcm(*(q.numerator for q in ratios.values()))
+    block_rows = max(step, block_rows // step * step)  # bloques alineados a todos los niveles
+
+    grids = {r: snapped_grid(extent, r, snap) for r in levels}
+    gt, shape = grids[base]
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    ref = gdal.GetDriverByName("MEM").Create("", shape[1], shape[0], 0)
+    ref.SetGeoTransform(gt)
+    ref.SetProjection(srs.ExportToWkt())
+    pop_ds = gdal.Open(pop_path)
+    if pop_ds is None:
+        raise RuntimeError(f"No se pudo abrir el raster de población: {pop_path}")
+    pop_band = warp_to_grid_vrt(pop_path, ref, resample="sum").GetRasterBand(1)
+    pop_nodata = pop_ds.GetRasterBand(1).GetNoDataValue()
+
+    os.makedirs(out_dir, exist_ok=True)
+    outputs, tmp = pyramid_paths(out_dir, levels), {}
+    for r in levels:
+        g_gt, g_shape = grids[r]
+        tmp[r] = {
+            "hazard": create_grid(outputs[r]["hazard"] + ".part.tif", g_gt, g_shape, crs, gdal.GDT_Byte, 0),
+            "population": create_grid(outputs[r]["population"] + ".part.tif", g_gt, g_shape, crs, gdal.GDT_Float32),
+            "exposed": create_grid(outputs[r]["exposed"] + ".part.tif", g_gt, g_shape, crs, gdal.GDT_Float32),
+        }
+    max_dist = max(d for d, _ in rings)
+    totals = dict.fromkeys(levels, 0.0)
+
+    for r0, nrows in iter_row_blocks(shape[0], block_rows):
+        pop = valid_population(pop_band.ReadAsArray(0, r0, shape[1], nrows), pop_nodata)
+        haz = classify_rings(distance_field(xy, window_geotransform(gt, r0), (nrows, shape[1]),
+                                            max_dist=max_dist), rings)
+        exposed = pop * (haz >= threshold)
+        for r in levels:
+            ratio = ratios[r]
+            g_gt, g_shape = grids[r]
+            c0, crows = int(r0 / ratio), int(nrows / ratio)
+            if r == base:
+                lvl_haz, lvl_pop, lvl_exp = haz, pop, exposed
+            else:
+                lvl_haz = classify_rings(distance_field(xy, window_geotransform(g_gt, c0),
+                                                        (crows, g_shape[1]), max_dist=max_dist), rings)
+                lvl_pop, lvl_exp = block_sum(pop, ratio), block_sum(exposed, ratio)
+            tmp[r]["hazard"].GetRasterBand(1).WriteArray(lvl_haz, 0, c0)
+            tmp[r]["population"].GetRasterBand(1).WriteArray(lvl_pop.astype("float32"), 0, c0)
+            tmp[r]["exposed"].GetRasterBand(1).WriteArray(lvl_exp.astype("float32"), 0, c0)
+            totals[r] += float(lvl_exp.sum())
+
+    for r in levels:
+        for kind in ("hazard", "population", "exposed"):
+            tmp[r][kind] = None  # cierra y vuelca a disco
+            part = outputs[r][kind] + ".part.tif"
+            write_cog(part, outputs[r][kind], categorical=kind == "hazard")
+            os.remove(part)
+        print_progress(f"Pirámide {r} m: {grids[r][1][1]}x{grids[r][1][0]} celdas, "
+                       f"{totals[r]:,.0f} personas expuestas")
+    trace_note(levels=levels, cells=shape[0] * shape[1])
+    return {str(r): outputs[r] for r in levels}
+
+# ---------- Países y niveles administrativos ----------
+COUNTRY = "GTM"        # ISO3 por defecto
+ADMIN_LEVEL = "ADM1"   # nivel geoBoundaries por defecto
+COUNTRY_NAMES = {
+    "GTM": "Guatemala", "BLZ": "Belice", "SLV": "El Salvador", "HND": "Honduras",
+    "NIC": "Nicaragua", "CRI": "Costa Rica", "PAN": "Panamá", "MEX": "México",
+}
+CENTRAL_AMERICA_ARC = ("GTM", "SLV", "HND", "NIC", "CRI", "PAN")  # --iso3 arco
+ADMIN_UNIT_NAMES = {"ADM0": "pais", "ADM1": "departamentos", "ADM2": "municipios"}
+WORLDPOP_FILE_TEMPLATE = "{iso3}_ppp_v2b_2020_UNadj.tif"
+BBOX_MARGIN_DEG = 0.25  # margen del prefiltro WGS84 de volcanes alrededor del país
+
+def country_name(iso3):
+    """Display name of a country (the ISO3 code itself if unknown)"""
+    return COUNTRY_NAMES.get(iso3.upper(), iso3.upper())
+
+def slugify(text):
+    """ASCII, lower-case, underscore-separated version of a name ('Panamá' -> 'panama')"""
+    import re
+    import unicodedata
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+def pack_names(iso3=COUNTRY, level=ADMIN_LEVEL):
+    """
+    Nombres base de las salidas de un paquete. Para GTM/ADM1 son los nombres
+    históricos (departamentos_gtm_adm1, guatemala_mask, volcanes_gtm, ...).
+    """
+    iso, lvl = iso3.lower(), level.upper()
+    slug = slugify(country_name(iso3))
+    units = ADMIN_UNIT_NAMES.get(lvl, f"unidades_{lvl.lower()}")
+    return {
+        "country": country_name(iso3),
+        "units_label": f"{units.replace('_', ' ').capitalize()} ({lvl})",
+        "units": f"{units}_{iso}_{lvl.lower()}",
+        "mask": f"{slug}_mask",
+        "volcanoes": f"volcanes_{iso}",
+        "project": f"{slug}_raster_training",
+        "worldpop": WORLDPOP_FILE_TEMPLATE.format(iso3=iso3.upper()),
     }
+
+def layer_bbox_wgs84(path, margin=BBOX_MARGIN_DEG):
+    """(xmin, xmax, ymin, ymax) in EPSG:4326 of a vector file, padded by margin degrees"""
+    from osgeo import ogr
+    ds = ogr.Open(path)
+    if ds is None:
+        raise RuntimeError(f"No se pudo abrir la capa: {path}")
+    lyr = ds.GetLayer(0)
+    xmin, xmax, ymin, ymax = lyr.GetExtent()
+    srs = lyr.GetSpatialRef()
+    if srs is not None and not (srs.IsGeographic() and srs.GetAuthorityCode(None) == "4326"):
+        corners = np.array([(x, y) for x in (xmin, xmax) for y in (ymin, ymax)], dtype="float64")
+        ll = transform_xy(corners, srs.ExportToWkt(), "EPSG:4326")
+        xmin, ymin = ll.min(axis=0)
+        xmax, ymax = ll.max(axis=0)
+    return (max(-180.0, xmin - margin), min(180.0, xmax + margin),
+            max(-90.0, ymin - margin), min(90.0, ymax + margin))
+
+def bbox_str(bbox):
+    """'xmin,xmax,ymin,ymax' (the format of filter_points_in_polygon)"""
+    return ",".join(f"{v:.4f}" for v in bbox)
+
+def utm_crs(bbox):
+    """WGS84 UTM zone (EPSG:326zz / 327zz) of the centre of a lon/lat bbox"""
+    lon = (bbox[0] + bbox[1]) / 2
+    lat = (bbox[2] + bbox[3]) / 2
+    zone = min(60, max(1, int((lon + 180) // 6) + 1))
+    return f"EPSG:{(32600 if lat >= 0 else 32700) + zone}"
+
+# ---------- Adquisición concurrente de insumos (límites + volcanes) ----------
+GB_API_URL = "https://www.geoboundaries.org/api/current/gbOpen/{iso3}/{level}/"
+GB_FALLBACK_URL = ("https://raw.githubusercontent.com/wmgeolab/geoBoundaries/main/releaseData/"
+                   "gbOpen/{iso3}/{level}/geoBoundaries-{iso3}-{level}.geojson")
+NOAA_CSV_URL = "https://www.ncei.noaa.gov/pub/data/volcano/Global_Volcano_Locations_Database.csv"
+GVP_WFS_URL = ("https://webservices.volcano.si.edu/geoserver/GVP-VOTW/ows"
+               "?service=WFS&version=1.0.0&request=GetFeature"
+               "&typeName=GVP-VOTW:volcanoes&outputFormat=application/json")
+DOWNLOAD_TIMEOUT = 60
+
+def fetch_boundaries(vec_dir, timeout=DOWNLOAD_TIMEOUT, iso3=COUNTRY, level=ADMIN_LEVEL, cache_dir=None):
+    """Límites geoBoundaries iso3/level (API -> fallback GitHub). Solo red/archivos: seguro en un hilo."""
+    stem = f"geoBoundaries-{iso3}-{level}"
+    try:
+        with open(cached_fetch(GB_API_URL.format(iso3=iso3, level=level), timeout=timeout,
+                               cache_dir=cache_dir), encoding="utf-8") as f:
+            data = json.load(f)
+        
+        item = data[0] if isinstance(data, list) else data
+        shp_url = item.get("shpDownloadURL") or item.get("shpURL")
+        gj_url = item.get("gjDownloadURL") or item.get("geojsonDownloadURL")
+        
+        if shp_url:
+            adm_zip = os.path.join(vec_dir, f"{stem}.zip")
+            safe_download(shp_url, adm_zip, timeout, cache_dir=cache_dir)
+            unzip(adm_zip, vec_dir)
+            # Prefijo: en una re-ejecución 01_Vector ya contiene otros .shp del paquete
+            adm_path = find_first_by_ext(vec_dir, exts=(".shp",), prefix=stem)
+        elif gj_url:
+            adm_path = safe_download(gj_url, os.path.join(vec_dir, f"{stem}.geojson"), timeout,
+                                     cache_dir=cache_dir)
+        else:
+            raise RuntimeError("API sin URL de descarga.")
+            
+    except Exception as e:
+        print_progress(f"⚠️ API geoBoundaries falló, usando fallback: {e}")
+        adm_path = safe_download(GB_FALLBACK_URL.format(iso3=iso3, level=level),
+                                 os.path.join(vec_dir, f"{stem}.geojson"), timeout, cache_dir=cache_dir)
     
-    # Try processing algorithms first
-    for alg in ("qgis:importdelimitedtext", "native:importdelimitedtext"):
+    if not adm_path or not os.path.exists(adm_path):
+        raise RuntimeError(f"No se pudo obtener {level} de {country_name(iso3)}.")
+    return adm_path
+
+def fetch_noaa_volcanoes(timeout=DOWNLOAD_TIMEOUT, cancel=None, cache_dir=None):
+    """
+    CSV global de NOAA; válido si trae columnas Longitude/Latitude. Devuelve
+    el objeto de la caché: no es un entregable, no se copia a 01_Vector.
+    """
+    print_progress(f"Descargando: {NOAA_CSV_URL}")
+    path = cached_fetch(NOAA_CSV_URL, timeout=timeout, cache_dir=cache_dir, cancel=cancel)
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        header = next(csv.reader(f), [])
+    if not {"Longitude", "Latitude"} <= set(header):
+        raise RuntimeError("CSV NOAA sin columnas Longitude/Latitude")
+    return path
+
+def fetch_gvp_volcanoes(timeout=DOWNLOAD_TIMEOUT, cancel=None, cache_dir=None):
+    """GeoJSON del WFS de GVP; válido si trae al menos una feature. Devuelve el objeto de la caché."""
+    print_progress(f"Descargando: {GVP_WFS_URL}")
+    path = cached_fetch(GVP_WFS_URL, timeout=timeout, cache_dir=cache_dir, cancel=cancel)
+    with open(path, encoding="utf-8-sig") as f:
+        if not json.load(f).get("features"):
+            raise RuntimeError("GeoJSON GVP sin features")
+    return path
+
+VOLCANO_SOURCES = (("noaa", fetch_noaa_volcanoes), ("gvp", fetch_gvp_volcanoes))
+
+def _timed(name, timings, fn, *args, **kwargs):
+    """Run fn inside a download span and append {source, status, seconds} to timings"""
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        with span(f"download:{name}", cat="download") as rec:
+            try:
+                rec["path"] = fn(*args, **kwargs)
+                rec["bytes"] = path_bytes(rec["path"])
+                return rec["path"]
+            except Exception as e:
+                status = rec["status"] = "cancelada" if isinstance(e, DownloadCancelled) else f"error: {e}"
+                raise
+    finally:
+        entry = {"source": name, "status": status, "seconds": round(time.perf_counter() - t0, 3)}
+        timings.append(entry)
+        print_progress(f"⏱️ {json.dumps(entry, ensure_ascii=False)}")
+
+def acquire_inputs(vec_dir, timeout=DOWNLOAD_TIMEOUT, iso3=COUNTRY, level=ADMIN_LEVEL,
+                   boundaries=True, volcanoes=True, cache_dir=None):
+    """
+    Descarga los límites iso3/level y las fuentes de volcanes en paralelo.
+    Las fuentes de volcanes arrancan a la vez pero se respeta la prioridad de
+    VOLCANO_SOURCES (NOAA, luego GVP): se usa la primera fuente en ese orden
+    que termine bien y las de menor prioridad se cancelan; el resultado no
+    depende de cuál responde antes. boundaries=False descarga solo los
+    volcanes (descarga global compartida por varios países) y
+    volcanoes=False solo los límites. cache_dir: caché de descargas.
+    Devuelve (adm_path o None, (fuente, ruta) o None, timings).
+    """
+    timings = []
+    cancel = threading.Event()
+    ex = ThreadPoolExecutor(max_workers=1 + len(VOLCANO_SOURCES))
+    try:
+        f_adm = (ex.submit(_timed, level.lower(), timings, fetch_boundaries, vec_dir, timeout, iso3, level,
+                           cache_dir) if boundaries else None)
+        volc_futs = ([(name, ex.submit(_timed, name, timings, fn, timeout, cancel, cache_dir))
+                      for name, fn in VOLCANO_SOURCES] if volcanoes else [])
+        volc = None
+        for name, fut in volc_futs:  # en orden de prioridad
+            try:
+                volc = (name, fut.result())
+                break
+            except Exception as e:
+                print_progress(f"⚠️ Volcanes {name} falló: {e}")
+        cancel.set()  # las fuentes de menor prioridad abortan en el siguiente bloque descargado
+        trace_note(volcano_download=volc[0] if volc else None)
+        adm_path = f_adm.result() if f_adm else None
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+    return adm_path, volc, timings
+
+# ---------- Arranque de QGIS y diálogos (solo modo interactivo) ----------
+GTM_CRS = "EPSG:32615"  # UTM 15N de Guatemala (lo que da utm_crs); CRS de los insumos sintéticos del benchmark
+WORLDPOP_FILE_NAME = WORLDPOP_FILE_TEMPLATE.format(iso3=COUNTRY)
+
+def start_qgis():
+    """Start a headless QgsApplication + Processing unless already inside QGIS"""
+    from qgis.core import QgsApplication
+    app = QgsApplication.instance()
+    if app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QgsApplication([], False)
+        app.initQgis()
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    if QgsApplication.processingRegistry().providerById("native") is None:
+        from qgis.analysis import QgsNativeAlgorithms
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+    return app
+
+def _qt_app():
+    """QApplication for file dialogs (created only when a dialog is needed)"""
+    from qgis.PyQt import QtWidgets
+    app = QtWidgets.QApplication.instance()
+    if not app:
+        app = QtWidgets.QApplication([])
+    return app
+
+def pick_output_dir():
+    """Diálogo de carpeta destino"""
+    from qgis.PyQt import QtWidgets
+    _qt_app()
+    return QtWidgets.QFileDialog.getExistingDirectory(
+        None, "Selecciona la carpeta DESTINO (mejor una carpeta vacía)"
+    )
+
+def pick_worldpop(start_dir, iso3=COUNTRY):
+    """Diálogo del raster WorldPop"""
+    from qgis.PyQt import QtWidgets
+    _qt_app()
+    picked, _ = QtWidgets.QFileDialog.getOpenFileName(
+        None,
+        f"Selecciona el raster WorldPop {country_name(iso3)} 2020 UN-adjusted (GeoTIFF)",
+        start_dir,
+        "GeoTIFF (*.tif *.tiff)"
+    )
+    return picked
+
+def resolve_worldpop(worldpop, iso3=COUNTRY):
+    """WorldPop path for a country: a file, a folder holding <ISO3>_ppp_..., or a '{iso3}' template"""
+    if not worldpop:
+        return None
+    if "{iso3}" in worldpop:
+        return worldpop.format(iso3=iso3.upper())
+    if os.path.isdir(worldpop):
+        return os.path.join(worldpop, pack_names(iso3)["worldpop"])
+    return worldpop
+
+def resolve_worldpop_years(spec, years=WORLDPOP_YEARS, iso3=COUNTRY):
+    """{year: path} from a folder holding WorldPop yearly files or a template with {year} (and {iso3}/{iso})"""
+    if os.path.isdir(spec):
+        spec = os.path.join(spec, WORLDPOP_YEAR_TEMPLATE)
+    paths = {int(y): spec.format(year=y, iso3=iso3.upper(), iso=iso3.lower()) for y in years}
+    missing = [str(y) for y, pth in paths.items() if not os.path.exists(pth)]
+    if missing:
+        raise RuntimeError(f"Faltan rásteres WorldPop para los años {', '.join(missing)} ({spec})")
+    return paths
+
+# ---------- Grafo de etapas incremental (manifiesto) ----------
+MANIFEST_NAME = "pack_manifest.json"
+
+def load_manifest(out_root):
+    """Stage records of a previous run ({'stages': {name: record}})"""
+    try:
+        with open(os.path.join(out_root, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault("stages", {})
+    return manifest
+
+def save_manifest(manifest, out_root):
+    """Atomically write the manifest"""
+    path = os.path.join(out_root, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def stage_key(manifest, deps=(), params=None, inputs=()):
+    """Fingerprint: upstream stage keys + parameters + signatures of external inputs"""
+    payload = {
+        "deps": {d: manifest["stages"][d]["key"] for d in deps},
+        "params": params or {},
+        "inputs": {os.path.basename(pth): file_signature(pth) for pth in inputs},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def run_stage(manifest, out_root, name, fn, deps=(), params=None, inputs=(), outputs=()):
+    """
+    Ejecuta fn() salvo que la etapa ya esté en el manifiesto con la misma
+    huella y sus salidas (outputs y, si es una ruta, el resultado) sigan
+    intactas. El resultado de fn debe ser serializable a JSON.
+    """
+    key = stage_key(manifest, deps, params, inputs)
+    rec = manifest["stages"].get(name)
+    if rec and rec["key"] == key and all(
+            os.path.exists(pth) and file_signature(pth) == sig for pth, sig in rec["outputs"].items()):
+        print_progress(f"⏭️ Etapa sin cambios: {name}")
+        with span(f"stage:{name}", skipped=True):
+            return rec["result"]
+
+    print_progress(f"▶️ Etapa: {name}")
+    with span(f"stage:{name}") as srec:
+        srec["in_bytes"] = sum(path_bytes(pth) for pth in inputs)
+        result = fn()
+        paths = list(outputs) + ([result] if isinstance(result, str) and os.path.exists(result) else [])
+        srec["out_bytes"] = sum(path_bytes(pth) for pth in paths)
+    manifest["stages"][name] = {
+        "key": key,
+        "result": result,
+        "outputs": {pth: file_signature(pth) for pth in paths},
+        "finished": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_manifest(manifest, out_root)  # guardar tras cada etapa: un fallo posterior no la repite
+    return result
+
+# ---------- Etapas del paquete ----------
+# Respaldo manual por país (último fallback si ninguna fuente aporta volcanes)
+MANUAL_VOLCANOES = {
+    "GTM": (
+        ("Fuego", -90.880, 14.473),
+        ("Pacaya", -90.601, 14.381),
+        ("Acatenango", -90.876, 14.501),
+        ("Agua", -90.744, 14.465),
+        ("Santa_Maria", -91.552, 14.756),
+        ("Tajumulco", -91.904, 15.043),
+    ),
+}
+
+def reproject_boundaries(adm_path, adm_utm, crs):
+    """Límites administrativos -> CRS destino"""
+    from qgis.core import QgsVectorLayer
+    adm_raw = QgsVectorLayer(adm_path, "ADM_raw", "ogr")
+    if not adm_raw.isValid():
+        raise RuntimeError(f"Límites administrativos inválidos: {adm_path}")
+    run_alg("native:reprojectlayer", {
+        "INPUT": adm_raw,
+        "TARGET_CRS": crs,
+        "OUTPUT": adm_utm
+    })
+    return adm_utm
+
+def dissolve_country(adm_utm, mask_country):
+    """Máscara de país (dissolve de los límites administrativos)"""
+    run_alg("native:dissolve", {
+        "INPUT": adm_utm,
+        "FIELD": [],
+        "SEPARATE_DISJOINT": False,
+        "OUTPUT": mask_country
+    })
+    print_progress("✅ Máscara de país creada")
+    return mask_country
+
+def parse_float(value):
+    """float(value) or None for empty/invalid cells"""
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return v if math.isfinite(v) else None
+
+def read_point_table(path, x_field="Longitude", y_field="Latitude"):
+    """
+    Lee puntos lon/lat de un CSV o GeoJSON en una sola pasada. El formato
+    sale de la extensión o, sin ella (objetos de la caché de descargas), del
+    contenido. Descarta coordenadas vacías, no numéricas o fuera de rango.
+    Devuelve (xy (n, 2) float64, lista de dicts de atributos).
+    """
+    xy, attrs = [], []
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        head = f.read(64).lstrip()
+    if path.lower().endswith((".geojson", ".json")) or head.startswith("{"):
+        with open(path, encoding="utf-8-sig") as f:
+            features = json.load(f).get("features") or []
+        for feat in features:
+            geom = feat.get("geometry") or {}
+            if geom.get("type") != "Point":
+                continue
+            coords = geom.get("coordinates") or []
+            xy.append((parse_float(coords[0]) if len(coords) > 1 else None,
+                       parse_float(coords[1]) if len(coords) > 1 else None))
+            attrs.append(feat.get("properties") or {})
+    else:
+        with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+            for row in csv.DictReader(f):
+                xy.append((parse_float(row.get(x_field)), parse_float(row.get(y_field))))
+                attrs.append(row)
+    arr = np.array([(np.nan if x is None else x, np.nan if y is None else y) for x, y in xy],
+                   dtype="float64").reshape(-1, 2)
+    ok = (np.isfinite(arr).all(axis=1) & (np.abs(arr[:, 0]) <= 180) & (np.abs(arr[:, 1]) <= 90))
+    return arr[ok], [a for a, keep in zip(attrs, ok) if keep]
+
+def transform_xy(xy, src_crs, dst_crs):
+    """Batch-transform an (n, 2) coordinate array between CRSs (x/y = lon/lat order)"""
+    from osgeo import osr
+    if len(xy) == 0 or src_crs == dst_crs:
+        return np.asarray(xy, dtype="float64").reshape(-1, 2)
+    src, dst = osr.SpatialReference(), osr.SpatialReference()
+    src.SetFromUserInput(src_crs)
+    dst.SetFromUserInput(dst_crs)
+    for srs in (src, dst):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = osr.CoordinateTransformation(src, dst)
+    return np.array(ct.TransformPoints(np.asarray(xy, dtype="float64").tolist()))[:, :2]
+
+def bbox_mask(xy, xmin, xmax, ymin, ymax):
+    """Boolean mask of points inside an axis-aligned box"""
+    return ((xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax))
+
+def prepared_polygon(path):
+    """Union of a polygon layer as a prepared GEOS engine + its bounding box"""
+    from qgis.core import QgsGeometry, QgsVectorLayer
+    lyr = QgsVectorLayer(path, "mask", "ogr")
+    if not lyr.isValid():
+        raise RuntimeError(f"No se pudo cargar la máscara: {path}")
+    geom = QgsGeometry.unaryUnion([f.geometry() for f in lyr.getFeatures()])
+    engine = QgsGeometry.createGeometryEngine(geom.constGet())
+    engine.prepareGeometry()
+    box = geom.boundingBox()
+    return engine, (box.xMinimum(), box.xMaximum(), box.yMinimum(), box.yMaximum())
+
+def ogr_field_type(values):
+    """Narrowest OGR field type holding all non-empty values (int, real, string)"""
+    from osgeo import ogr
+    vals = [v for v in values if v not in (None, "")]
+    if vals and all(isinstance(v, int) or (isinstance(v, str) and v.lstrip("-").isdigit()) for v in vals):
+        return ogr.OFTInteger64
+    if vals and all(parse_float(v) is not None and not isinstance(v, bool) for v in vals):
+        return ogr.OFTReal
+    return ogr.OFTString
+
+def write_points_gpkg(path, xy, attrs, crs, layer_name=None):
+    """Write points + attributes to a GeoPackage in one transaction (with spatial index)"""
+    from osgeo import gdal, ogr, osr
+    if gdal.VSIStatL(path) is not None:  # también rutas /vsimem/
+        gdal.Unlink(path)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ds = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+    if ds is None:
+        raise RuntimeError(f"No se pudo crear el GeoPackage: {path}")
+    lyr = ds.CreateLayer(layer_name or os.path.splitext(os.path.basename(path))[0],
+                         srs=srs, geom_type=ogr.wkbPoint, options=["SPATIAL_INDEX=YES"])
+    names = list(dict.fromkeys(k for a in attrs for k in a if k))
+    types = {}
+    for name in names:
+        types[name] = ogr_field_type([a.get(name) for a in attrs])
+        lyr.CreateField(ogr.FieldDefn(name, types[name]))
+    defn = lyr.GetLayerDefn()
+    lyr.StartTransaction()
+    for (x, y), a in zip(xy, attrs):
+        feat = ogr.Feature(defn)
+        for name in names:
+            v = a.get(name)
+            if v in (None, ""):
+                continue
+            if types[name] == ogr.OFTInteger64:
+                feat.SetField(name, int(v))
+            elif types[name] == ogr.OFTReal:
+                feat.SetField(name, float(v))
+            else:
+                feat.SetField(name, str(v))
+        pt = ogr.Geometry(ogr.wkbPoint)
+        pt.AddPoint_2D(float(x), float(y))
+        feat.SetGeometry(pt)
+        lyr.CreateFeature(feat)
+    lyr.CommitTransaction()
+    ds = None
+    return path
+
+def filter_points_in_polygon(src_path, mask_path, out_gpkg, crs, bbox_wgs84=None,
+                             x_field="Longitude", y_field="Latitude"):
+    """
+    Filtro de una pasada: lectura del CSV/GeoJSON -> bbox WGS84 (NumPy;
+    "xmin,xmax,ymin,ymax", None = sin prefiltro) -> transformación en lote ->
+    bbox de la máscara -> intersects con la máscara preparada (GEOS).
+    Escribe solo los puntos dentro de la máscara y devuelve cuántos son.
+    """
+    from qgis.core import QgsPoint
+    xy, attrs = read_point_table(src_path, x_field, y_field)
+    xmin, xmax, ymin, ymax = (float(v) for v in (bbox_wgs84 or "-180,180,-90,90").split(","))
+    keep = np.flatnonzero(bbox_mask(xy, xmin, xmax, ymin, ymax))
+    pxy = transform_xy(xy[keep], "EPSG:4326", crs)
+    engine, mbox = prepared_polygon(mask_path)
+    cand = np.flatnonzero(bbox_mask(pxy, *mbox))
+    inside = [i for i in cand if engine.intersects(QgsPoint(float(pxy[i, 0]), float(pxy[i, 1])))]
+    print_progress(f"Filtro de puntos: {len(xy)} leídos -> {len(keep)} en bbox -> {len(inside)} en la máscara")
+    trace_note(points_read=len(xy), points_bbox=len(keep), points_inside=len(inside))
+    if inside:
+        write_points_gpkg(out_gpkg, pxy[inside], [attrs[keep[i]] for i in inside], crs)
+    return len(inside)
+
+def extract_country_volcanoes(vec_dir, volc_download, mask_country, crs, bbox_wgs84=None,
+                              iso3=COUNTRY, timeout=DOWNLOAD_TIMEOUT, cache_dir=None):
+    """
+    volcanes_<iso3>.gpkg en una pasada desde la fuente elegida de la descarga
+    concurrente (la misma descarga global sirve a todos los países); si no
+    aporta volcanes, las fuentes canceladas (descargadas con timeout y
+    cache_dir) y por último el CSV manual del país, si existe. Devuelve la
+    ruta del GPKG.
+    """
+    names = pack_names(iso3)
+    volc_gtm = os.path.join(vec_dir, f"{names['volcanoes']}.gpkg")
+    candidates = [volc_download] if volc_download else []
+    remaining = [src for src in VOLCANO_SOURCES if volc_download and src[0] != volc_download[0]]
+    while candidates or remaining:
+        if candidates:
+            name, path = candidates.pop(0)
+        else:
+            name, fetch = remaining.pop(0)
+            try:
+                path = fetch(timeout, None, cache_dir)
+            except Exception as e:
+                print_progress(f"⚠️ Volcanes {name} falló: {e}")
+                continue
         try:
-            print_progress(f"Intentando con {alg}")
-            processing.run(alg, params)
-            lyr = QgsVectorLayer(out_gpkg, "tmp", "ogr")
-            if lyr.isValid() and lyr.featureCount() > 0:
-                print_progress(f"✅ CSV importado con {alg}")
-                return out_gpkg
+            n = filter_points_in_polygon(path, mask_country, volc_gtm, crs, bbox_wgs84)
+            if n:
+                print_progress(f"✅ Volcanes {name.upper()} procesados: {n} features")
+                trace_note(volcano_source=name)
+                return volc_gtm
+            print_progress(f"⚠️ Volcanes {name}: ninguno dentro de la máscara")
         except Exception as e:
-            print_progress(f"⚠️ {alg} falló: {str(e)}")
-            continue
-    
-    # Fallback: provider delimitedtext
-    print_progress("Usando proveedor delimitedtext como fallback")
-    uri = f"file:///{csv_path}?delimiter=,&xField={x_field}&yField={y_field}&crs=epsg:4326"
-    lyr = QgsVectorLayer(uri, "csv_points", "delimitedtext")
+            print_progress(f"⚠️ Volcanes {name} falló: {e}")
     
+    # Use manual CSV as final fallback
+    manual = MANUAL_VOLCANOES.get(iso3.upper(), ())
+    n = 0
+    if manual:
+        print_progress(f"📝 Usando CSV manual de respaldo con {len(manual)} volcanes de {names['country']}")
+        manual_csv = os.path.join(vec_dir, f"{names['volcanoes']}_manual.csv")
+        with open(manual_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["Name", "Longitude", "Latitude"])
+            w.writerows(manual)
+        n = filter_points_in_polygon(manual_csv, mask_country, volc_gtm, crs, bbox_wgs84)
+    if not n:
+        raise RuntimeError(f"No se encontraron volcanes dentro del límite de {names['country']} tras todos los fallbacks.")
+    print_progress(f"✅ Volcanes procesados: {n} features")
+    trace_note(volcano_source="manual")
+    return volc_gtm
+
+def vector_extent(path):
+    """(xmin, xmax, ymin, ymax) of a vector layer"""
+    from qgis.core import QgsVectorLayer
+    lyr = QgsVectorLayer(path, "extent", "ogr")
     if not lyr.isValid():
-        raise RuntimeError("No se pudo leer el CSV como puntos (delimitedtext).")
-    
-    if lyr.featureCount() == 0:
-        raise RuntimeError("CSV no contiene features válidas.")
-    
-    # Guardar: intentar savefeatures, si no, reprojectlayer
-    try:
-        processing.run("native:savefeatures", {"INPUT": lyr, "OUTPUT": out_gpkg})
-    except Exception:
-        processing.run("native:reprojectlayer", {
-            "INPUT": lyr,
-            "TARGET_CRS": "EPSG:4326",
-            "OUTPUT": out_gpkg
-        })
+        raise RuntimeError(f"No se pudo cargar la capa para obtener la extensión: {path}")
+    ext = lyr.extent()
+    return (ext.xMinimum(), ext.xMaximum(), ext.yMinimum(), ext.yMaximum())
+
+def vector_xy(path):
+    """Point coordinates of a vector file (see layer_xy)"""
+    from qgis.core import QgsVectorLayer
+    return layer_xy(QgsVectorLayer(path, "points", "ogr"))
+
+def write_project(prj_dir, adm_utm, volc_gtm, worldpop_path, haz_raster, names=None):
+    """Proyecto .qgz con las capas en orden (fondo -> frente)"""
+    from qgis.core import QgsProject, QgsVectorLayer, QgsRasterLayer
+    names = names or pack_names()
+    prj = QgsProject.instance()
+    prj.clear()
     
-    lyr2 = QgsVectorLayer(out_gpkg, "tmp2", "ogr")
-    if not (lyr2.isValid() and lyr2.featureCount() > 0):
-        raise RuntimeError("Fallo al guardar el CSV como GPKG.")
+    # Add layers in logical order (background to foreground)
+    prj.addMapLayer(QgsVectorLayer(adm_utm, names["units_label"], "ogr"))
+    prj.addMapLayer(QgsVectorLayer(volc_gtm, "Volcanes", "ogr"))
+    prj.addMapLayer(QgsRasterLayer(worldpop_path, f"Población WorldPop 2020 (100 m) - {names['worldpop']}", "gdal"))
+    prj.addMapLayer(QgsRasterLayer(haz_raster, "Amenaza volcánica (sintética)", "gdal"))
     
-    print_progress(f"✅ CSV importado con delimitedtext: {lyr2.featureCount()} features")
-    return out_gpkg
+    project_path = os.path.join(prj_dir, f"{names['project']}.qgz")
+    prj.write(project_path)
+    return project_path
 
-def main():
-    """Main execution function"""
-    print("🚀 Iniciando creación del paquete de entrenamiento Guatemala...")
-    
-    # ---------- UI: carpeta de salida ----------
-    app = QtWidgets.QApplication.instance()
-    if not app:
-        app = QtWidgets.QApplication([])
+def write_readme(out_root, res, haz_raster, crs, levels=PYRAMID_LEVELS, names=None):
+    """README.txt del paquete"""
+    names = names or pack_names()
+    title = f"PAQUETE DE ENTRENAMIENTO QGIS - {names['country'].upper()}"
+    readme_path = os.path.join(out_root, "README.txt")
+    with open(readme_path, "w", encoding="utf-8") as f:
+        f.write(
+            f"{title}\n"
+            f"{'=' * len(title)}\n\n"
+            f"Generado el: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+            f"CONTENIDO:\n"
+            f"----------\n"
+            f"• Límites administrativos - {names['units_label']} - {names['units']}.shp\n"
+            f"• Máscara de país - {names['mask']}.shp\n"
+            f"• Volcanes - {names['volcanoes']}.gpkg\n"
+            f"• Población WorldPop 2020 (UN-adjusted, 100 m) - {names['worldpop']}\n"
+            f"• Raster sintético de amenaza volcánica ({res} m) - {os.path.basename(haz_raster)}\n"
+            f"• Población expuesta por unidad (amenaza ≥ {EXPOSURE_THRESHOLD}) - {names['units']}_exposicion.csv\n"
+            f"• Pirámide alineada ({' / '.join(f'{r} m' for r in levels)}): amenaza, población y población expuesta - "
+            f"{PYRAMID_DIR}/ (niveles gruesos = sumas de la base: por bloques si la razón es entera, "
+            f"repartidas por área si no; el total se conserva)\n\n"
+            f"CRS: {crs}\n\n"
+            f"ESTRUCTURA DE CARPETAS:\n"
+            f"----------------------\n"
+            f"01_Vector/     - Capas vectoriales\n"
+            f"02_Raster/     - Rasters de población y amenaza\n"
+            f"03_Resultados/ - Resultados de exposición por clave (amenaza, umbral, nivel, población; .npz)\n"
+            f"QGIS_Project/  - Proyecto QGIS (.qgz)\n\n"
+            f"USO:\n"
+            f"----\n"
+            f"1. Abrir {names['project']}.qgz en QGIS\n"
+            f"2. Todas las capas están precargadas y proyectadas\n"
+            f"3. Listo para análisis y visualización\n\n"
+            f"Ubicación: {out_root}\n"
+        )
+    return readme_path
+
+def main(out_root=None, worldpop=None, crs=None, res=HAZARD_RES, rings=HAZARD_RINGS,
+         write_intermediates=WRITE_INTERMEDIATES, interactive=True, force=False,
+         levels=PYRAMID_LEVELS, iso3=COUNTRY, admin_level=ADMIN_LEVEL, volc_download=None,
+         facilities=None, facility_fields=FACILITY_FIELDS, access_cutoffs=ACCESS_CUTOFFS,
+         worldpop_years=None, years=WORLDPOP_YEARS, cache_dir=None):
+    """
+    Construye el paquete de un país (iso3) y nivel administrativo como una
+    secuencia de etapas con huella en pack_manifest.json: al repetir, solo se
+    recalculan las etapas cuyos insumos o parámetros cambiaron (force=True
+    recalcula todo). crs=None usa la zona UTM del centro del país y el
+    prefiltro de volcanes usa su bbox. volc_download = (fuente, ruta) de una
+    descarga global ya hecha (varios países); si falta, se descarga aquí.
+    facilities (CSV/GeoJSON lon/lat, admite '{iso3}') añade la tabla de
+    población expuesta y desatendida para cada distancia de access_cutoffs.
+    worldpop_years (carpeta o plantilla con '{year}') añade la tabla año x
+    unidad de población expuesta para years, en una pasada por el cubo.
+    cache_dir: caché de descargas (por defecto CACHE_DIR).
+    Sin out_root/worldpop y con interactive=True usa diálogos Qt; con
+    interactive=False (CLI) nunca abre ventanas.
+    """
+    iso3, admin_level = iso3.upper(), admin_level.upper()
+    names = pack_names(iso3, admin_level)
+    print(f"🚀 Iniciando creación del paquete de entrenamiento {names['country']} ({admin_level})...")
     
-    out_root = QtWidgets.QFileDialog.getExistingDirectory(
-        None, "Selecciona la carpeta DESTINO (mejor una carpeta vacía)"
-    )
+    # ---------- Carpeta de salida ----------
+    if not out_root and interactive:
+        out_root = pick_output_dir()
     if not out_root:
         print("❌ No se seleccionó carpeta. Saliendo.")
         return
@@ -158,330 +2310,174 @@ def main():
         os.makedirs(d, exist_ok=True)
         print_progress(f"📁 Carpeta creada: {d}")
     
-    CRS_TARGET = "EPSG:32615"  # UTM 15N
+    rings = [list(r) for r in rings]
+    manifest = {"stages": {}} if force else load_manifest(OUTPUT_ROOT)
     
+    def stage(name, fn, **kwargs):
+        return run_stage(manifest, OUTPUT_ROOT, name, fn, **kwargs)
+    
+    reset_trace()
     try:
-        # ---------- 1) ADM1 (geoBoundaries) ----------
-        print_progress("🌍 Obteniendo límites administrativos (ADM1)...")
-        adm1_path = None
-        
-        try:
-            gb_api = "https://www.geoboundaries.org/api/current/gbOpen/GTM/ADM1/"
-            with urllib.request.urlopen(gb_api, timeout=60) as r:
-                data = json.loads(r.read().decode("utf-8"))
-            
-            item = data[0] if isinstance(data, list) else data
-            shp_url = item.get("shpDownloadURL") or item.get("shpURL")
-            gj_url = item.get("gjDownloadURL") or item.get("geojsonDownloadURL")
-            
-            if shp_url:
-                adm1_zip = os.path.join(VEC_DIR, "geoBoundaries-GTM-ADM1.zip")
-                safe_download(shp_url, adm1_zip)
-                unzip(adm1_zip, VEC_DIR)
-                adm1_path = find_first_by_ext(VEC_DIR, exts=(".shp",))
-            elif gj_url:
-                adm1_path = safe_download(gj_url, os.path.join(VEC_DIR, "geoBoundaries-GTM-ADM1.geojson"))
-            else:
-                raise RuntimeError("API sin URL de descarga.")
-                
-        except Exception as e:
-            print_progress(f"⚠️ API geoBoundaries falló, usando fallback: {e}")
-            gb_fallback = "https://raw.githubusercontent.com/wmgeolab/geoBoundaries/main/releaseData/gbOpen/GTM/ADM1/geoBoundaries-GTM-ADM1.geojson"
-            adm1_path = safe_download(gb_fallback, os.path.join(VEC_DIR, "geoBoundaries-GTM-ADM1.geojson"))
-        
-        if not adm1_path or not os.path.exists(adm1_path):
-            raise RuntimeError("No se pudo obtener ADM1 de Guatemala.")
+        # ---------- 1) Límites (geoBoundaries) + descargas de volcanes en paralelo ----------
+        print_progress(f"🌍 Obteniendo límites administrativos ({admin_level}) y volcanes en paralelo...")
+        with span("acquire_inputs", cat="download"):
+            adm_path, downloaded, _timings = acquire_inputs(
+                VEC_DIR, iso3=iso3, level=admin_level, volcanoes=not volc_download, cache_dir=cache_dir)
+        volc_download = volc_download or downloaded
+        print_progress(f"✅ {admin_level} obtenido, procesando...")
         
-        print_progress("✅ ADM1 obtenido, procesando...")
-        adm1_raw = QgsVectorLayer(adm1_path, "ADM1_raw", "ogr")
-        if not adm1_raw.isValid():
-            raise RuntimeError("ADM1 inválido.")
+        # Zona UTM y prefiltro de volcanes derivados de los límites del país
+        bbox = bbox_str(layer_bbox_wgs84(adm_path))
+        CRS_TARGET = crs or utm_crs([float(v) for v in bbox.split(",")])
+        print_progress(f"🧭 {names['country']}: bbox {bbox}, CRS {CRS_TARGET}")
         
-        # Reproject to UTM
-        adm1_utm = os.path.join(VEC_DIR, "departamentos_gtm_adm1.shp")
-        processing.run("native:reprojectlayer", {
-            "INPUT": adm1_raw,
-            "TARGET_CRS": CRS_TARGET,
-            "OUTPUT": adm1_utm
-        })
+        adm_utm = os.path.join(VEC_DIR, f"{names['units']}.shp")
+        stage("boundaries", lambda: reproject_boundaries(adm_path, adm_utm, CRS_TARGET),
+              params={"crs": CRS_TARGET, "iso3": iso3, "level": admin_level},
+              inputs=[adm_path], outputs=[adm_utm])
         
-        # Create country mask
-        mask_country = os.path.join(VEC_DIR, "guatemala_mask.shp")
-        processing.run("native:dissolve", {
-            "INPUT": adm1_utm,
-            "FIELD": [],
-            "SEPARATE_DISJOINT": False,
-            "OUTPUT": mask_country
-        })
-        print_progress("✅ Máscara de país creada")
+        mask_country = os.path.join(VEC_DIR, f"{names['mask']}.shp")
+        stage("country_mask", lambda: dissolve_country(adm_utm, mask_country),
+              deps=["boundaries"], outputs=[mask_country])
         
         # ---------- 2) Volcanes (NOAA -> GVP -> CSV manual) ----------
         print_progress("🌋 Obteniendo datos de volcanes...")
-        volc_layer = None
-        
-        # Try NOAA CSV first
-        noaa_csv_url = "https://www.ncei.noaa.gov/pub/data/volcano/Global_Volcano_Locations_Database.csv"
-        volc_csv = os.path.join(VEC_DIR, "volcanes_global_noaa.csv")
-        
-        try:
-            safe_download(noaa_csv_url, volc_csv)
-            volc_points = os.path.join(VEC_DIR, "volcanes_global.gpkg")
-            import_csv_points(volc_csv, "Longitude", "Latitude", volc_points)
-            volc_layer = QgsVectorLayer(volc_points, "Volcanes_WGS84", "ogr")
-            print_progress("✅ Volcanes NOAA obtenidos")
-        except Exception as e:
-            print_progress(f"⚠️ NOAA CSV falló: {e}")
-        
-        # Try GVP WFS if NOAA failed
-        if volc_layer is None or not volc_layer.isValid():
-            gvp_geojson = ("https://webservices.volcano.si.edu/geoserver/GVP-VOTW/ows"
-                          "?service=WFS&version=1.0.0&request=GetFeature"
-                          "&typeName=GVP-VOTW:volcanoes&outputFormat=application/json")
-            volc_geojson_path = os.path.join(VEC_DIR, "volcanes_gvp.geojson")
-            
-            try:
-                safe_download(gvp_geojson, volc_geojson_path)
-                volc_layer = QgsVectorLayer(volc_geojson_path, "Volcanes_WGS84", "ogr")
-                print_progress("✅ Volcanes GVP obtenidos")
-            except Exception as e:
-                print_progress(f"⚠️ GVP WFS falló: {e}")
-        
-        # Use manual CSV as final fallback
-        if volc_layer is None or not volc_layer.isValid():
-            print_progress("📝 Usando CSV manual de respaldo con 6 volcanes de Guatemala")
-            manual_csv = os.path.join(VEC_DIR, "volcanes_gtm_manual.csv")
-            
-            with open(manual_csv, "w", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow(["Name", "Longitude", "Latitude"])
-                w.writerow(["Fuego", -90.880, 14.473])
-                w.writerow(["Pacaya", -90.601, 14.381])
-                w.writerow(["Acatenango", -90.876, 14.501])
-                w.writerow(["Agua", -90.744, 14.465])
-                w.writerow(["Santa_Maria", -91.552, 14.756])
-                w.writerow(["Tajumulco", -91.904, 15.043])
-            
-            volc_points = os.path.join(VEC_DIR, "volcanes_manual.gpkg")
-            import_csv_points(manual_csv, "Longitude", "Latitude", volc_points)
-            volc_layer = QgsVectorLayer(volc_points, "Volcanes_WGS84", "ogr")
-        
-        # BBOX preliminar en WGS84 para reducir ruido: (-92.5, -88.0, 13.5, 18.0)
-        volc_bbox = os.path.join(VEC_DIR, "volcanes_bbox.gpkg")
-        processing.run("native:extractbyextent", {
-            "INPUT": volc_layer,
-            "EXTENT": "-92.5,-88.0,13.5,18.0",
-            "CLIP": True,
-            "OUTPUT": volc_bbox
-        })
-        
-        volc_bbox_lyr = QgsVectorLayer(volc_bbox, "Volcanes_bbox", "ogr")
-        
-        # Reproject to UTM and clip to Guatemala
-        volc_prj = os.path.join(VEC_DIR, "volcanes_prj.gpkg")
-        processing.run("native:reprojectlayer", {
-            "INPUT": volc_bbox_lyr,
-            "TARGET_CRS": CRS_TARGET,
-            "OUTPUT": volc_prj
-        })
-        
-        volc_gtm = os.path.join(VEC_DIR, "volcanes_gtm.gpkg")
-        processing.run("native:extractbylocation", {
-            "INPUT": volc_prj,
-            "PREDICATE": [0],
-            "INTERSECT": mask_country,
-            "OUTPUT": volc_gtm
-        })
-        
-        volc_gtm_lyr = QgsVectorLayer(volc_gtm, "Volcanes_GTM", "ogr")
-        
-        if (not volc_gtm_lyr.isValid()) or (volc_gtm_lyr.featureCount() == 0):
-            volc_gtm = os.path.join(VEC_DIR, "volcanes_gtm_clip.gpkg")
-            processing.run("native:clip", {
-                "INPUT": volc_prj,
-                "OVERLAY": mask_country,
-                "OUTPUT": volc_gtm
-            })
-            volc_gtm_lyr = QgsVectorLayer(volc_gtm, "Volcanes_GTM", "ogr")
-        
-        if (not volc_gtm_lyr.isValid()) or (volc_gtm_lyr.featureCount() == 0):
-            raise RuntimeError("No se encontraron volcanes dentro del límite de Guatemala tras todos los fallbacks.")
-        
-        print_progress(f"✅ Volcanes procesados: {volc_gtm_lyr.featureCount()} features")
+        volc_gtm = stage(
+            "volcanoes",
+            lambda: extract_country_volcanoes(VEC_DIR, volc_download, mask_country, CRS_TARGET,
+                                              bbox, iso3, cache_dir=cache_dir),
+            deps=["country_mask"],
+            params={"crs": CRS_TARGET, "bbox": bbox,
+                    "source": volc_download[0] if volc_download else "manual",
+                    "manual": MANUAL_VOLCANOES.get(iso3, ())},
+            inputs=[volc_download[1]] if volc_download else [])
         
         # ---------- 3) WorldPop (selector si no está) ----------
         print_progress("👥 Procesando datos de población WorldPop...")
-        WORLDPOP_FILE_NAME = "GTM_ppp_v2b_2020_UNadj.tif"
-        worldpop_src = os.path.join(RAS_DIR, WORLDPOP_FILE_NAME)
+        worldpop_src = os.path.join(RAS_DIR, names["worldpop"])
+        worldpop = resolve_worldpop(worldpop, iso3)
         
-        if not os.path.exists(worldpop_src):
-            picked, _ = QtWidgets.QFileDialog.getOpenFileName(
-                None,
-                "Selecciona el raster WorldPop Guatemala 2020 UN-adjusted (GeoTIFF)",
-                OUTPUT_ROOT,
-                "GeoTIFF (*.tif *.tiff)"
-            )
-            if not picked:
+        if not worldpop and not os.path.exists(worldpop_src):
+            worldpop = pick_worldpop(OUTPUT_ROOT, iso3) if interactive else None
+            if not worldpop:
                 raise RuntimeError("No se encontró el raster de WorldPop. Descárgalo (UN-adjusted, 100 m) y vuelve a intentar.")
-            shutil.copy(picked, worldpop_src)
-            print_progress("✅ WorldPop copiado a la carpeta de destino")
+        source = worldpop or worldpop_src
+        external = os.path.abspath(source) != os.path.abspath(worldpop_src)
         
-        # Use original WorldPop file directly (no reprojection/clipping needed)
+        # Mismos valores y grilla que el original, reescrito como COG (teselado, comprimido, pirámides)
+        stage("worldpop", lambda: ensure_cog(source, worldpop_src),
+              params={"cog": [COG_BLOCKSIZE, "AVERAGE"]},
+              inputs=[source] if external else [], outputs=[worldpop_src])
         worldpop_clip = worldpop_src  # Keep original file path for consistency
-        print_progress("✅ WorldPop original usado directamente")
-        
-        # ---------- 4) Amenaza volcánica sintética (250 m) ----------
-        print_progress("🔥 Generando raster de amenaza volcánica...")
-        
-        def add_level(src_path, level, out_path):
-            processing.run("qgis:fieldcalculator", {
-                "INPUT": src_path,
-                "FIELD_NAME": "level",
-                "FIELD_TYPE": 1,
-                "FIELD_LENGTH": 2,
-                "FIELD_PRECISION": 0,
-                "NEW_FIELD": True,
-                "FORMULA": str(level),
-                "OUTPUT": out_path
-            })
-            return out_path
+        print_progress("✅ WorldPop listo (COG)")
         
-        # Create buffers
-        buf10_raw = os.path.join(VEC_DIR, "buf10km_raw.gpkg")
-        processing.run("native:buffer", {
-            "INPUT": volc_gtm_lyr,
-            "DISTANCE": 10000,
-            "SEGMENTS": 16,
-            "END_CAP_STYLE": 0,
-            "JOIN_STYLE": 0,
-            "MITER_LIMIT": 2,
-            "DISSOLVE": True,
-            "OUTPUT": buf10_raw
-        })
-        buf10 = add_level(buf10_raw, 3, os.path.join(VEC_DIR, "buf10km.gpkg"))
+        # Estadísticas exactas (total nacional, % válido, histograma) en una pasada por ventanas
+        stats_json = os.path.splitext(worldpop_src)[0] + "_stats.json"
+        stage("worldpop_stats", lambda: write_json(raster_stats(worldpop_src), stats_json),
+              deps=["worldpop"], params={"edges": POP_HIST_EDGES})
+        with open(stats_json, encoding="utf-8") as f:
+            pop_stats = json.load(f)
+        print_progress(f"👥 Población total ({names['country']}): {pop_stats['sum']:,.0f}")
         
-        buf20_raw = os.path.join(VEC_DIR, "buf20km_raw.gpkg")
-        processing.run("native:buffer", {
-            "INPUT": volc_gtm_lyr,
-            "DISTANCE": 20000,
-            "SEGMENTS": 16,
-            "END_CAP_STYLE": 0,
-            "JOIN_STYLE": 0,
-            "MITER_LIMIT": 2,
-            "DISSOLVE": True,
-            "OUTPUT": buf20_raw
-        })
-        buf20 = add_level(buf20_raw, 2, os.path.join(VEC_DIR, "buf20km.gpkg"))
-        
-        buf30_raw = os.path.join(VEC_DIR, "buf30km_raw.gpkg")
-        processing.run("native:buffer", {
-            "INPUT": volc_gtm_lyr,
-            "DISTANCE": 30000,
-            "SEGMENTS": 16,
-            "END_CAP_STYLE": 0,
-            "JOIN_STYLE": 0,
-            "MITER_LIMIT": 2,
-            "DISSOLVE": True,
-            "OUTPUT": buf30_raw
-        })
-        buf30 = add_level(buf30_raw, 1, os.path.join(VEC_DIR, "buf30km.gpkg"))
+        # ---------- 4) Amenaza volcánica sintética ----------
+        print_progress("🔥 Generando raster de amenaza volcánica...")
         
-        # Build non-overlapping rings to preserve classes in rasterization
-        ring30 = os.path.join(VEC_DIR, "ring_30km.gpkg")
-        processing.run("native:difference", {
-            "INPUT": buf30,
-            "OVERLAY": buf20,
-            "OUTPUT": ring30
-        })
-        ring20 = os.path.join(VEC_DIR, "ring_20_10km.gpkg")
-        processing.run("native:difference", {
-            "INPUT": buf20,
-            "OVERLAY": buf10,
-            "OUTPUT": ring20
-        })
-        ring10 = buf10  # inner ring remains as-is
+        # Extensión de la máscara de país (CRS destino) en lugar del raster de población;
+        # anillos 0-10/10-20/20-30 km calculados directamente sobre la grilla
+        haz_raster = os.path.join(RAS_DIR, f"hazard_volcanica_{res}m.tif")
+        stage("hazard",
+              lambda: build_hazard_raster(vector_xy(volc_gtm), vector_extent(mask_country),
+                                          res, haz_raster, CRS_TARGET, rings),
+              deps=["volcanoes", "country_mask"],
+              params={"res": res, "rings": rings, "crs": CRS_TARGET, "cog": [COG_BLOCKSIZE, "MODE"]},
+              outputs=[haz_raster])
+        print_progress("✅ Raster de amenaza volcánica generado")
         
-        # Merge and dissolve (rings do not overlap; dissolve is optional)
-        merged = os.path.join(VEC_DIR, "haz_buffers_merged.gpkg")
-        processing.run("native:mergevectorlayers", {
-            "LAYERS": [ring30, ring20, ring10],
-            "OUTPUT": merged
-        })
+        # ---------- 5) Población expuesta por departamento ----------
+        print_progress("📊 Calculando población expuesta por departamento...")
+        exposure_csv = os.path.join(VEC_DIR, f"{names['units']}_exposicion.csv")
+        mask_out = os.path.join(RAS_DIR, f"hazard_ge{EXPOSURE_THRESHOLD}_bin.tif") if write_intermediates else None
+        exposed_out = os.path.join(RAS_DIR, "pop_expuesta_100m.tif") if write_intermediates else None
+        stage("exposure",
+              lambda: write_rows_csv(compute_exposure(
+                  worldpop_clip, haz_raster, adm_utm, threshold=EXPOSURE_THRESHOLD,
+                  mask_out=mask_out, exposed_out=exposed_out), exposure_csv),
+              deps=["hazard", "boundaries", "worldpop"],
+              params={"threshold": EXPOSURE_THRESHOLD, "intermediates": write_intermediates},
+              outputs=[exposure_csv] + [pth for pth in (mask_out, exposed_out) if pth])
+        print_progress(f"✅ Tabla de exposición: {os.path.basename(exposure_csv)}")
+        check_population_totals(pop_stats, exposure_csv)
         
-        haz_diss = os.path.join(VEC_DIR, "haz_buffers_diss.gpkg")
-        processing.run("native:dissolve", {
-            "INPUT": merged,
-            "FIELD": ["level"],
-            "SEPARATE_DISJOINT": False,
-            "OUTPUT": haz_diss
-        })
+        # Almacén columnar (03_Resultados): umbrales de escenario por clave; al repetir solo se calcula lo nuevo
+        with span("results_store", cat="results"):
+            query_exposure(os.path.join(OUTPUT_ROOT, RESULTS_DIR), {2020: worldpop_clip}, haz_raster, adm_utm,
+                           SCENARIO_THRESHOLDS, level=admin_level,
+                           hazard_params={"res": res, "rings": rings, "crs": CRS_TARGET})
         
-        # Rasterize
-        haz_raster = os.path.join(RAS_DIR, "hazard_volcanica_250m.tif")
+        # Serie temporal (opcional): pila WorldPop multianual alineada -> tabla año x unidad en una pasada
+        if worldpop_years:
+            year_paths = resolve_worldpop_years(worldpop_years, years, iso3)
+            series_csv = os.path.join(VEC_DIR, f"{names['units']}_exposicion_anual.csv")
+            stage("exposure_series",
+                  lambda: write_rows_csv(compute_exposure_series(
+                      year_paths, haz_raster, adm_utm, threshold=EXPOSURE_THRESHOLD,
+                      zid_dir=RAS_DIR), series_csv),
+                  deps=["hazard", "boundaries"],
+                  params={"years": sorted(year_paths), "threshold": EXPOSURE_THRESHOLD},
+                  inputs=list(year_paths.values()))
+            print_progress(f"✅ Serie de exposición ({len(year_paths)} años): {os.path.basename(series_csv)}")
         
-        # Get extent from the country mask (which is in the target CRS) instead of population raster
-        mask_lyr = QgsVectorLayer(mask_country, "mask", "ogr")
-        if not mask_lyr.isValid():
-            raise RuntimeError("No se pudo cargar la máscara de país para obtener la extensión")
+        # Accesibilidad (opcional): expuestos lejos del establecimiento más cercano, todos los cortes a la vez
+        facilities = facilities.format(iso3=iso3) if facilities and "{iso3}" in facilities else facilities
+        if facilities:
+            fac_gpkg = os.path.join(VEC_DIR, f"establecimientos_{iso3.lower()}.gpkg")
+            stage("facilities",
+                  lambda: import_csv_points(facilities, *facility_fields, out_gpkg=fac_gpkg, crs=CRS_TARGET),
+                  params={"fields": list(facility_fields), "crs": CRS_TARGET}, inputs=[facilities])
+            access_csv = os.path.join(VEC_DIR, f"{names['units']}_accesibilidad.csv")
+            cutoffs = sorted(float(c) for c in access_cutoffs)
+            stage("accessibility",
+                  lambda: write_rows_csv(compute_accessibility(
+                      worldpop_clip, haz_raster, vector_xy(fac_gpkg), vector_extent(mask_country),
+                      CRS_TARGET, adm_utm, cutoffs), access_csv),
+                  deps=["facilities", "hazard", "boundaries", "country_mask", "worldpop"],
+                  params={"cutoffs": cutoffs, "threshold": EXPOSURE_THRESHOLD})
+            print_progress(f"✅ Tabla de accesibilidad: {os.path.basename(access_csv)}")
         
-        ext = mask_lyr.extent()
-        extent_str = f"{ext.xMinimum()},{ext.xMaximum()},{ext.yMinimum()},{ext.yMaximum()}"
+        # Barrido de umbrales (≥1, ≥2, ≥3) con una sola lectura de población; misma grilla (res) que la amenaza,
+        # así la fila ≥2 coincide con _exposicion.csv y 03_Resultados
+        scenarios_csv = os.path.join(VEC_DIR, f"{names['units']}_escenarios.csv")
+        stage("scenarios",
+              lambda: write_rows_csv(run_scenarios(
+                  worldpop_clip, vector_xy(volc_gtm), vector_extent(mask_country),
+                  CRS_TARGET, adm_utm, ring_sets=(rings,), res=res), scenarios_csv),
+              deps=["volcanoes", "country_mask", "boundaries", "worldpop"],
+              params={"thresholds": SCENARIO_THRESHOLDS, "rings": rings, "crs": CRS_TARGET, "res": res},
+              outputs=[scenarios_csv])
+        print_progress(f"✅ Tabla de escenarios: {os.path.basename(scenarios_csv)}")
         
-        processing.run("gdal:rasterize", {
-            "INPUT": haz_diss,
-            "FIELD": "level",
-            "UNITS": 1,
-            "WIDTH": 250,
-            "HEIGHT": 250,
-            "EXTENT": extent_str,
-            "NODATA": 0,
-            "DATA_TYPE": 1,
-            "INIT": 0,
-            "INVERT": False,
-            "OUTPUT": haz_raster
-        })
-        print_progress("✅ Raster de amenaza volcánica generado")
+        # Pirámide alineada 100 m / 250 m / 1 km: niveles gruesos = sumas de la base (250 m: reparto por área)
+        levels = sorted(int(r) for r in levels)
+        pyramid_dir = os.path.join(RAS_DIR, PYRAMID_DIR)
+        stage("pyramid",
+              lambda: build_pyramid(worldpop_clip, vector_xy(volc_gtm), vector_extent(mask_country),
+                                    CRS_TARGET, pyramid_dir, levels, rings),
+              deps=["volcanoes", "country_mask", "worldpop"],
+              params={"levels": levels, "rings": rings, "threshold": EXPOSURE_THRESHOLD,
+                      "crs": CRS_TARGET, "cog": [COG_BLOCKSIZE]},
+              outputs=[pth for paths in pyramid_paths(pyramid_dir, levels).values()
+                       for pth in paths.values()])
+        print_progress(f"✅ Pirámide: {', '.join(f'{r} m' for r in levels)} en {PYRAMID_DIR}/")
         
-        # ---------- 5) Proyecto QGIS & README ----------
+        # ---------- 6) Proyecto QGIS & README ----------
         print_progress("🗺️ Creando proyecto QGIS...")
-        prj = QgsProject.instance()
-        prj.clear()
-        
-        # Add layers in logical order (background to foreground)
-        prj.addMapLayer(QgsVectorLayer(adm1_utm, "Departamentos (ADM1)", "ogr"))
-        prj.addMapLayer(QgsVectorLayer(volc_gtm, "Volcanes", "ogr"))
-        prj.addMapLayer(QgsRasterLayer(worldpop_clip, f"Población WorldPop 2020 (100 m) - {WORLDPOP_FILE_NAME}", "gdal"))
-        prj.addMapLayer(QgsRasterLayer(haz_raster, "Amenaza volcánica (sintética)", "gdal"))
-        
-        project_path = os.path.join(PRJ_DIR, "guatemala_raster_training.qgz")
-        prj.write(project_path)
-        
-        # Create README
-        readme_path = os.path.join(OUTPUT_ROOT, "README.txt")
-        with open(readme_path, "w", encoding="utf-8") as f:
-            f.write(
-                f"PAQUETE DE ENTRENAMIENTO QGIS - GUATEMALA\n"
-                f"==========================================\n\n"
-                f"Generado el: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                f"CONTENIDO:\n"
-                f"----------\n"
-                f"• Límites administrativos (ADM1) - departamentos_gtm_adm1.shp\n"
-                f"• Máscara de país - guatemala_mask.shp\n"
-                f"• Volcanes - volcanes_gtm.gpkg\n"
-                f"• Población WorldPop 2020 (UN-adjusted, 100 m) - {WORLDPOP_FILE_NAME}\n"
-                f"• Raster sintético de amenaza volcánica (250 m) - hazard_volcanica_250m.tif\n\n"
-                f"CRS: EPSG:32615 (UTM 15N - Zona 15 Norte)\n\n"
-                f"ESTRUCTURA DE CARPETAS:\n"
-                f"----------------------\n"
-                f"01_Vector/     - Capas vectoriales\n"
-                f"02_Raster/     - Rasters de población y amenaza\n"
-                f"QGIS_Project/  - Proyecto QGIS (.qgz)\n\n"
-                f"USO:\n"
-                f"----\n"
-                f"1. Abrir guatemala_raster_training.qgz en QGIS\n"
-                f"2. Todas las capas están precargadas y proyectadas\n"
-                f"3. Listo para análisis y visualización\n\n"
-                f"Ubicación: {OUTPUT_ROOT}\n"
-            )
+        project_path = stage(
+            "project",
+            lambda: write_project(PRJ_DIR, adm_utm, volc_gtm, worldpop_clip, haz_raster, names),
+            deps=["boundaries", "volcanoes", "hazard", "worldpop"])
+        readme_path = stage(
+            "readme", lambda: write_readme(OUTPUT_ROOT, res, haz_raster, CRS_TARGET, levels, names),
+            deps=["project"], params={"res": res, "crs": CRS_TARGET, "levels": levels, "names": names})
         
         print_progress("✅ Proyecto QGIS y README creados")
         
@@ -502,13 +2498,135 @@ def main():
         print("El proceso se detuvo debido a un error.")
         return False
     
+    finally:
+        # También en fallos: la traza muestra dónde se detuvo y cuánto tardó cada tramo
+        print_trace_summary()
+        print(f"⏱️ Traza: {write_trace(os.path.join(OUTPUT_ROOT, TRACE_NAME))}")
+    
     return True
 
 
-# if __name__ == "__main__":
-success = main()
-if not success:
+def print_suggestions():
+    """Hints printed after a failed run"""
     print("\n💡 Sugerencias para resolver problemas:")
     print("- Verifica tu conexión a internet")
     print("- Asegúrate de tener permisos de escritura en la carpeta destino")
-    print("- Si el error persiste, intenta ejecutar el script nuevamente")
\ No newline at end of file
+    print("- Si el error persiste, intenta ejecutar el script nuevamente")
+
+def run_pack(spec):
+    """Build one pack in a (possibly fresh) process: spec = kwargs for main()"""
+    start_qgis()
+    return bool(main(interactive=False, **spec))
+
+SHARED_DIR = "00_Compartido"  # descargas globales compartidas por varios paquetes
+
+def build_packs(specs, jobs=1, shared_dir=None):
+    """
+    Build several packs, in parallel across a process pool when jobs > 1.
+    With several packs the global volcano catalogue is downloaded once into
+    shared_dir and each pack only filters it for its own country.
+    """
+    if len(specs) > 1 and shared_dir and not any(s.get("volc_download") for s in specs):
+        os.makedirs(shared_dir, exist_ok=True)
+        print_progress("🌋 Descarga global de volcanes (compartida por todos los paquetes)...")
+        _, volc, _ = acquire_inputs(shared_dir, boundaries=False, cache_dir=specs[0].get("cache_dir"))
+        specs = [dict(spec, volc_download=volc) for spec in specs]
+    if jobs <= 1 or len(specs) <= 1:
+        return [run_pack(spec) for spec in specs]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        return list(ex.map(run_pack, specs))
+
+def parse_args(argv=None):
+    """Command-line options for headless builds"""
+    import argparse
+    ap = argparse.ArgumentParser(description="Paquete de entrenamiento QGIS - amenaza volcánica por país (sin interfaz)")
+    ap.add_argument("--out", required=True, help="Carpeta raíz de salida")
+    ap.add_argument("--iso3", nargs="+", default=[COUNTRY],
+                    help="Países (ISO3); 'arco' = " + " ".join(CENTRAL_AMERICA_ARC) + " (default: %(default)s)")
+    ap.add_argument("--admin-level", nargs="+", default=[ADMIN_LEVEL],
+                    help="Niveles geoBoundaries (ADM1, ADM2, ...) (default: %(default)s)")
+    ap.add_argument("--worldpop",
+                    help=f"Raster WorldPop (se copia como {WORLDPOP_FILE_NAME}); con varios países, "
+                         "una carpeta con <ISO3>_ppp_... o una plantilla con {iso3}")
+    ap.add_argument("--crs", default=None, help="CRS destino (default: zona UTM del país)")
+    ap.add_argument("--res", type=int, nargs="+", default=[HAZARD_RES],
+                    help="Resolución(es) de la amenaza en metros; varias = un paquete por resolución")
+    ap.add_argument("--rings", type=float, nargs="+",
+                    default=[d / 1000 for d, _ in sorted(HAZARD_RINGS)],
+                    help="Distancias de los anillos en km, de adentro hacia afuera (niveles n..1)")
+    ap.add_argument("--force", action="store_true",
+                    help="Recalcular todas las etapas aunque el manifiesto no haya cambiado")
+    ap.add_argument("--write-intermediates", action="store_true",
+                    help="Escribir hazard_ge*_bin.tif y pop_expuesta_100m.tif")
+    ap.add_argument("--levels", type=int, nargs="+", default=list(PYRAMID_LEVELS),
+                    help="Resoluciones de la pirámide en metros; la más fina es la base (default: %(default)s)")
+    ap.add_argument("--facilities",
+                    help="Establecimientos (CSV/GeoJSON lon/lat; admite {iso3}) para la tabla de accesibilidad")
+    ap.add_argument("--facility-fields", nargs=2, default=list(FACILITY_FIELDS), metavar=("X", "Y"),
+                    help="Columnas lon/lat del CSV de establecimientos (default: %(default)s)")
+    ap.add_argument("--access-km", type=float, nargs="+",
+                    default=[c / 1000 for c in ACCESS_CUTOFFS],
+                    help="Distancias de corte al establecimiento más cercano en km (default: %(default)s)")
+    ap.add_argument("--worldpop-years",
+                    help="WorldPop por año para la serie de exposición: carpeta con "
+                         f"{WORLDPOP_YEAR_TEMPLATE} o plantilla con {{year}} (y {{iso3}}/{{iso}})")
+    ap.add_argument("--years", type=int, nargs="+", default=list(WORLDPOP_YEARS),
+                    help=f"Años de la serie (default: {WORLDPOP_YEARS[0]}-{WORLDPOP_YEARS[-1]})")
+    ap.add_argument("--cache-dir", default=None,
+                    help="Caché de descargas compartida (default: GTM_PACK_CACHE o ~/.cache/guatemala_training_pack)")
+    ap.add_argument("--jobs", type=int, default=1, help="Paquetes en paralelo (procesos)")
+    return ap.parse_args(argv)
+
+def cli(argv=None):
+    """Headless entry point; returns a process exit code"""
+    args = parse_args(argv)
+    km = sorted(args.rings)
+    rings = [(int(d * 1000), len(km) - i) for i, d in enumerate(km)]
+    countries = list(dict.fromkeys(
+        iso.upper() for code in args.iso3
+        for iso in (CENTRAL_AMERICA_ARC if code.lower() == "arco" else (code,))))
+    admin_levels = list(dict.fromkeys(lvl.upper() for lvl in args.admin_level))
+    if len(countries) > 1 and args.worldpop and not (
+            "{iso3}" in args.worldpop or os.path.isdir(args.worldpop)):
+        print(f"❌ --worldpop {args.worldpop} es un solo raster para {len(countries)} países; "
+              "usa una carpeta con <ISO3>_ppp_... o una plantilla con {iso3}")
+        return 2
+    units = [(iso, lvl) for iso in countries for lvl in admin_levels]
+    specs = []
+    for iso, lvl in units:
+        for res in args.res:
+            parts = ([f"{iso}_{lvl}"] if len(units) > 1 else []) + ([f"{res}m"] if len(args.res) > 1 else [])
+            specs.append({
+                "out_root": os.path.join(args.out, *parts),
+                "iso3": iso,
+                "admin_level": lvl,
+                "worldpop": args.worldpop,
+                "crs": args.crs,
+                "res": res,
+                "rings": rings,
+                "write_intermediates": args.write_intermediates,
+                "force": args.force,
+                "levels": args.levels,
+                "facilities": args.facilities,
+                "facility_fields": args.facility_fields,
+                "access_cutoffs": [km * 1000 for km in args.access_km],
+                "worldpop_years": args.worldpop_years,
+                "years": args.years,
+                "cache_dir": args.cache_dir,
+            })
+    results = build_packs(specs, args.jobs, shared_dir=os.path.join(args.out, SHARED_DIR))
+    for spec, ok in zip(specs, results):
+        if len(specs) > 1:
+            print(f"{'✅' if ok else '❌'} {spec['iso3']} {spec['admin_level']} {spec['res']} m: {spec['out_root']}")
+    if not all(results):
+        print_suggestions()
+        return 1
+    return 0
+
+if __name__ == "__main__" and [a for a in sys.argv[1:] if a]:
+    sys.exit(cli())
+elif __name__ in ("__main__", "__console__"):  # consola Python de QGIS
+    success = main()
+    if not success:
+        print_suggestions()
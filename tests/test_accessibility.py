@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+def strip_table(dist, zid, pop, edges, nz):
+    nb = len(edges) + 1
+    b = gtp.distance_bins(dist, edges)
+    return np.bincount((zid * nb + b).ravel(), weights=pop.ravel(), minlength=nz * nb).reshape(nz, nb)
+
+
+def test_underserved_is_strictly_beyond_cutoff():
+    edges = np.array([5000.0, 10000.0])
+    dist = np.array([0.0, 5000.0, 5000.001, 10000.0, 10000.001, np.inf])
+    pop = np.array([1.0, 10, 100, 1000, 10000, 100000])
+    rows = gtp.accessibility_rows(["Z"], strip_table(dist, np.ones(6, int), pop, edges, 2), edges)
+    assert [(r["cutoff_km"], r["underserved"]) for r in rows] == [(5.0, 111100.0), (10.0, 110000.0)]
+    assert rows[0]["exp_sum"] == 111111.0
+    assert rows[1]["underserved_pct"] == pytest.approx(99.0, abs=0.01)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_accessibility_rows_match_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    edges = np.array([2000.0, 5000.0, 10000.0, 20000.0])
+    dist = rng.uniform(0, 30000, 400)
+    dist[:4] = edges
+    dist[-3:] = np.inf
+    zid = rng.integers(0, 5, dist.size)
+    pop = rng.lognormal(size=dist.size)
+    pop[zid == 4] = 0  # zona sin población expuesta: porcentaje 0, no NaN
+    names = ["A", "B", "C", "D"]
+    rows = gtp.accessibility_rows(names, strip_table(dist, zid, pop, edges, 5), edges)
+    assert len(rows) == len(edges) * len(names)
+    for r in rows:
+        i = names.index(r["zone"]) + 1
+        cutoff = r["cutoff_km"] * 1000
+        assert r["exp_sum"] == pytest.approx(pop[zid == i].sum(), rel=1e-12)
+        assert r["underserved"] == pytest.approx(pop[(zid == i) & (dist > cutoff)].sum(), rel=1e-12)
+        if r["zone"] == "D":
+            assert r["underserved_pct"] == 0
+
+
+def test_compute_accessibility_matches_brute_force(tmp_path):
+    gdal = pytest.importorskip("osgeo.gdal")
+    import benchmark_training_pack as bench
+    extent = bench.synthetic_extent(20)
+    zones = bench.make_zones(str(tmp_path / "zonas.gpkg"), extent)
+    pop = bench.make_population(str(tmp_path / "pop.tif"), extent, 100)
+    haz = gtp.build_hazard_raster(bench.make_points(2, extent), extent, 250, str(tmp_path / "haz.tif"), bench.CRS)
+    fac = bench.make_points(6, extent, seed=5)
+    cutoffs = (3000, 8000)
+    rows = gtp.compute_accessibility(pop, haz, fac, extent, bench.CRS, zones, cutoffs=cutoffs,
+                                     res=100, block_rows=41)
+
+    pop_ds = gdal.Open(pop)
+    band = pop_ds.GetRasterBand(1)
+    people = gtp.valid_population(band.ReadAsArray(), band.GetNoDataValue())
+    exposed = people * (gtp.warp_to_grid_vrt(haz, pop_ds).ReadAsArray() >= gtp.EXPOSURE_THRESHOLD)
+    dist = gtp.distance_on_grid(fac, extent, bench.CRS, 100, pop_ds, max_dist=max(cutoffs))
+    zid_path, names = gtp.zone_index(zones, pop)
+    zid = gdal.Open(zid_path).ReadAsArray()
+    single = {r["zone"]: r["exp_sum"] for r in gtp.compute_exposure(pop, haz, zones)}
+    for r in rows:
+        i = names.index(r["zone"]) + 1
+        assert r["exp_sum"] == pytest.approx(single[r["zone"]], rel=1e-9)
+        under = exposed[(zid == i) & (dist > r["cutoff_km"] * 1000)].sum()
+        assert r["underserved"] == pytest.approx(under, rel=1e-9)
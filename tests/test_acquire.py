@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+def source(name, delay, fail=False):
+    def fetch(timeout, cancel, cache_dir=None):
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError(f"{name} caído")
+        return f"cache/{name}.csv"
+    return name, fetch
+
+
+@pytest.mark.parametrize("sources, expected", [
+    ((source("noaa", 0.2), source("gvp", 0.0)), "noaa"),              # la más rápida no gana
+    ((source("noaa", 0.0, fail=True), source("gvp", 0.1)), "gvp"),    # respaldo solo si NOAA falla
+    ((source("noaa", 0.2, fail=True), source("gvp", 0.0)), "gvp"),
+])
+def test_acquire_inputs_keeps_source_priority(monkeypatch, sources, expected):
+    monkeypatch.setattr(gtp, "VOLCANO_SOURCES", sources)
+    _, volc, timings = gtp.acquire_inputs("v", boundaries=False)
+    assert volc == (expected, f"cache/{expected}.csv")
+
+
+def test_acquire_inputs_all_sources_fail(monkeypatch):
+    monkeypatch.setattr(gtp, "VOLCANO_SOURCES", (source("noaa", 0, True), source("gvp", 0, True)))
+    assert gtp.acquire_inputs("v", boundaries=False)[1] is None
+
+
+def test_volcano_fallback_fetch_keeps_timeout_and_cache_dir(monkeypatch, tmp_path):
+    seen = []
+
+    def fetch_gvp(timeout, cancel, cache_dir=None):
+        seen.append((timeout, cache_dir))
+        return f"{cache_dir}/gvp"
+
+    monkeypatch.setattr(gtp, "VOLCANO_SOURCES", (source("noaa", 0), ("gvp", fetch_gvp)))
+    monkeypatch.setattr(gtp, "filter_points_in_polygon",
+                        lambda path, *a: 0 if path.endswith("noaa.csv") else 3)
+    out = gtp.extract_country_volcanoes(str(tmp_path), ("noaa", "cache/noaa.csv"), "mask.shp", "EPSG:32615",
+                                        timeout=7, cache_dir="mi_cache")
+    assert out.endswith("volcanes_gtm.gpkg")
+    assert seen == [(7, "mi_cache")]
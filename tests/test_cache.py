@@ -0,0 +1,234 @@
+"""Caché de descargas contra un servidor HTTP local (sin red)"""
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import guatemala_training_pack as gtp
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        srv.log.append(dict(self.headers))
+        body = srv.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        rng = self.headers.get("Range")
+        if rng and not srv.ignore_range and self.headers.get("If-Range") in (etag, LAST_MODIFIED):
+            start = int(rng.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        data = body[start:]
+        step = max(1, len(data) // 8)
+        for i in range(0, len(data), step):  # srv.delay > 0: respuesta lenta, para solapar descargas
+            self.wfile.write(data[i:i + step])
+            time.sleep(srv.delay)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.files, srv.log, srv.ignore_range, srv.delay = {}, [], False, 0
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_partial(cache_dir, url, data, etag):
+    part_dir = os.path.join(cache_dir, "partial")
+    os.makedirs(part_dir, exist_ok=True)
+    part = os.path.join(part_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".part")
+    with open(part, "wb") as f:
+        f.write(data)
+    with open(part + ".json", "w", encoding="utf-8") as f:
+        json.dump({"etag": etag, "last_modified": LAST_MODIFIED}, f)
+
+
+def test_revalidation_304_reuses_object(server, tmp_path):
+    body = os.urandom(5000)
+    server.files["/a.csv"] = body
+    url, cache = server.url + "/a.csv", str(tmp_path / "cache")
+    first = gtp.cached_fetch(url, cache_dir=cache)
+    second = gtp.cached_fetch(url, cache_dir=cache)
+    assert first == second and read(second) == body
+    assert os.path.basename(first) == sha(body)
+    assert "If-None-Match" in server.log[-1]
+    assert len(server.log) == 2
+
+
+def test_range_resume(server, tmp_path):
+    body = os.urandom(3 * 1024 * 1024 + 17)
+    server.files["/big.tif"] = body
+    url, cache = server.url + "/big.tif", str(tmp_path / "cache")
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+    write_partial(cache, url, body[:1000], etag)
+    path = gtp.cached_fetch(url, cache_dir=cache)
+    assert read(path) == body and os.path.basename(path) == sha(body)
+    assert server.log[-1]["Range"] == "bytes=1000-"
+    assert server.log[-1]["If-Range"] == etag
+
+
+def test_full_reply_to_resume_request_restarts(server, tmp_path):
+    body = os.urandom(20000)
+    server.files["/b.csv"] = body
+    server.ignore_range = True
+    url, cache = server.url + "/b.csv", str(tmp_path / "cache")
+    write_partial(cache, url, b"basura-vieja", '"otra"')
+    path = gtp.cached_fetch(url, cache_dir=cache)
+    assert read(path) == body
+    assert "Range" in server.log[-1]
+
+
+def test_checksum_mismatch_is_not_published(server, tmp_path):
+    server.files["/c.csv"] = b"Longitude,Latitude\n1,2\n"
+    url, cache = server.url + "/c.csv", str(tmp_path / "cache")
+    with pytest.raises(RuntimeError, match="Checksum"):
+        gtp.cached_fetch(url, cache_dir=cache, expected_sha256="0" * 64)
+    assert url not in gtp.load_cache_index(cache)
+    assert os.listdir(os.path.join(cache, "partial")) == []
+
+
+def test_offline_fallback_uses_cached_copy(server, tmp_path):
+    body = b"Longitude,Latitude\n-90.88,14.47\n"
+    server.files["/d.csv"] = body
+    url, cache = server.url + "/d.csv", str(tmp_path / "cache")
+    path = gtp.cached_fetch(url, cache_dir=cache)
+    server.shutdown()
+    server.server_close()
+    assert gtp.cached_fetch(url, cache_dir=cache, timeout=2) == path
+    with pytest.raises(urllib.error.URLError):
+        gtp.cached_fetch(server.url + "/nunca.csv", cache_dir=cache, timeout=2)
+
+
+def test_lru_eviction_by_bytes(server, tmp_path):
+    cache = str(tmp_path / "cache")
+    bodies = {f"/{n}.bin": os.urandom(1000) for n in "xyz"}
+    server.files.update(bodies)
+    paths = {p: gtp.cached_fetch(server.url + p, cache_dir=cache, max_bytes=2500) for p in bodies}
+    index = gtp.load_cache_index(cache)
+    assert server.url + "/x.bin" not in index  # el menos usado recientemente
+    assert not os.path.exists(paths["/x.bin"])
+    assert {server.url + "/y.bin", server.url + "/z.bin"} <= set(index)
+    assert all(os.path.exists(paths[p]) for p in ("/y.bin", "/z.bin"))
+
+
+def test_safe_download_threads_cache_dir(server, tmp_path):
+    server.files["/e.csv"] = b"a,b\n1,2\n"
+    cache, dest = str(tmp_path / "cache"), str(tmp_path / "e.csv")
+    assert gtp.safe_download(server.url + "/e.csv", dest, cache_dir=cache) == dest
+    assert read(dest) == b"a,b\n1,2\n"
+    assert server.url + "/e.csv" in gtp.load_cache_index(cache)
+
+
+def test_cancelled_download_is_not_replaced_by_existing_file(server, tmp_path):
+    server.files["/f.csv"] = os.urandom(4096)
+    cache, dest = str(tmp_path / "cache"), str(tmp_path / "f.csv")
+    with open(dest, "wb") as f:
+        f.write(b"copia anterior")
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(gtp.DownloadCancelled):
+        gtp.safe_download(server.url + "/f.csv", dest, cancel=cancel, cache_dir=cache)
+    timings = []
+    with pytest.raises(gtp.DownloadCancelled):
+        gtp._timed("gvp", timings, gtp.safe_download, server.url + "/f.csv", dest, 60, cancel, cache)
+    assert timings[0]["status"] == "cancelada"
+
+
+def test_network_error_falls_back_to_existing_file(server, tmp_path):
+    cache, dest = str(tmp_path / "cache"), str(tmp_path / "g.csv")
+    with open(dest, "wb") as f:
+        f.write(b"copia anterior")
+    assert gtp.safe_download(server.url + "/no-existe.csv", dest, cache_dir=cache) == dest
+    os.remove(dest)
+    with pytest.raises(RuntimeError, match="Error descargando"):
+        gtp.safe_download(server.url + "/no-existe.csv", dest, cache_dir=cache)
+
+
+def test_concurrent_fetches_of_one_url(server, tmp_path):
+    body = os.urandom(200000)
+    server.files["/adm.zip"] = body
+    server.delay = 0.02
+    url, cache = server.url + "/adm.zip", str(tmp_path / "cache")
+    results, errors = [], []
+
+    def fetch():
+        try:
+            results.append(gtp.cached_fetch(url, cache_dir=cache))
+        except Exception as e:  # noqa: BLE001 - se revisa abajo
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(set(results)) == 1 and read(results[0]) == body
+    assert os.listdir(os.path.join(cache, "partial")) == []
+    assert gtp.load_cache_index(cache)[url]["sha256"] == sha(body)
+
+
+def test_stale_partial_lock_is_taken_over(server, tmp_path):
+    body = os.urandom(3000)
+    server.files["/h.csv"] = body
+    url, cache = server.url + "/h.csv", str(tmp_path / "cache")
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+    write_partial(cache, url, body[:1000], etag)
+    part = os.path.join(cache, "partial", hashlib.sha1(url.encode("utf-8")).hexdigest() + ".part")
+    open(part + ".lock", "w").close()
+    os.utime(part + ".lock", (0, 0))
+    assert read(gtp.cached_fetch(url, cache_dir=cache)) == body
+    assert server.log[-1]["Range"] == "bytes=1000-"  # reanudó el parcial compartido
+    assert not os.path.exists(part + ".lock")
+
+
+def test_volcano_sources_are_read_from_the_cache(server, tmp_path, monkeypatch):
+    server.files["/noaa"] = b"\xef\xbb\xbfName,Longitude,Latitude\nFuego,-90.88,14.47\n"
+    server.files["/gvp"] = json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-91.55, 14.76]},
+         "properties": {"Volcano_Name": "Santa María"}}]}).encode("utf-8")
+    monkeypatch.setattr(gtp, "NOAA_CSV_URL", server.url + "/noaa")
+    monkeypatch.setattr(gtp, "GVP_WFS_URL", server.url + "/gvp")
+    cache = str(tmp_path / "cache")
+    for fetch, name in ((gtp.fetch_noaa_volcanoes, "Fuego"), (gtp.fetch_gvp_volcanoes, "Santa María")):
+        path = fetch(cache_dir=cache)
+        assert path.startswith(os.path.join(cache, "objects"))  # sin copia en la carpeta del paquete
+        xy, attrs = gtp.read_point_table(path)  # formato por contenido: el objeto no tiene extensión
+        assert len(xy) == 1 and name in attrs[0].values()
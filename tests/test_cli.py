@@ -0,0 +1,37 @@
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+@pytest.fixture
+def built(monkeypatch):
+    specs = []
+
+    def fake_build(s, jobs=1, shared_dir=None):
+        specs.extend(s)
+        return [True] * len(s)
+
+    monkeypatch.setattr(gtp, "build_packs", fake_build)
+    return specs
+
+
+def test_single_worldpop_file_rejected_for_several_countries(tmp_path, built, capsys):
+    wp = tmp_path / "GTM_ppp_v2b_2020_UNadj.tif"
+    wp.write_bytes(b"x")
+    assert gtp.cli(["--out", str(tmp_path), "--iso3", "arco", "--worldpop", str(wp)]) == 2
+    assert built == []
+    assert "{iso3}" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("worldpop", ["{tmp}/{{iso3}}_ppp_v2b_2020_UNadj.tif", "{tmp}"])
+def test_worldpop_template_or_folder_for_several_countries(tmp_path, built, worldpop):
+    spec = worldpop.format(tmp=tmp_path)
+    assert gtp.cli(["--out", str(tmp_path), "--iso3", "GTM", "SLV", "--worldpop", spec]) == 0
+    assert [s["iso3"] for s in built] == ["GTM", "SLV"]
+    assert {gtp.resolve_worldpop(s["worldpop"], s["iso3"]) for s in built} == {
+        str(tmp_path / "GTM_ppp_v2b_2020_UNadj.tif"), str(tmp_path / "SLV_ppp_v2b_2020_UNadj.tif")}
+
+
+def test_single_worldpop_file_for_one_country(tmp_path, built):
+    assert gtp.cli(["--out", str(tmp_path), "--worldpop", "wp.tif"]) == 0
+    assert built[0]["worldpop"] == "wp.tif"
@@ -0,0 +1,63 @@
+import sys
+
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+def brute_force(xy, gt, shape, max_dist=None):
+    xs, ys = gtp.cell_centers(gt, shape)
+    gx, gy = np.meshgrid(xs, ys)
+    d = np.min([np.hypot(gx - px, gy - py) for px, py in xy], axis=0)
+    if max_dist is not None:
+        d[d > max_dist] = np.inf
+    return d
+
+
+@pytest.fixture(params=["kdtree", "ventanas"])
+def backend(request, monkeypatch):
+    if request.param == "kdtree":
+        pytest.importorskip("scipy.spatial")
+    else:
+        monkeypatch.setitem(sys.modules, "scipy.spatial", None)  # fuerza el respaldo NumPy
+    return request.param
+
+
+GT, SHAPE = (500000.0, 250.0, 0.0, 1600000.0, 0.0, -250.0), (60, 80)
+
+
+@pytest.mark.parametrize("max_dist", [None, 7000.0])
+def test_distance_field_matches_brute_force(backend, max_dist):
+    rng = np.random.default_rng(3)
+    xy = np.column_stack((rng.uniform(495000, 525000, 12), rng.uniform(1580000, 1605000, 12)))
+    xy[0] = (490000.0, 1590000.0)  # volcán fuera de la grilla (al oeste)
+    got = gtp.distance_field(xy, GT, SHAPE, max_dist=max_dist, block_rows=7)
+    expected = brute_force(xy, GT, SHAPE, max_dist)
+    np.testing.assert_array_equal(np.isinf(got), np.isinf(expected))
+    finite = np.isfinite(expected)
+    np.testing.assert_allclose(got[finite], expected[finite], rtol=1e-6)
+
+
+def test_point_outside_grid_only(backend):
+    xy = [(480000.0, 1590000.0)]  # 20 km al oeste del borde
+    got = gtp.distance_field(xy, GT, SHAPE)
+    np.testing.assert_allclose(got, brute_force(xy, GT, SHAPE), rtol=1e-6)
+    assert np.isinf(gtp.distance_field(xy, GT, SHAPE, max_dist=10000.0)).all()
+
+
+def test_classify_rings_boundaries():
+    d = np.array([0.0, 9999.9, 10000.0, 10000.5, 20000.0, 29999.0, 30000.0, 30000.01, np.inf])
+    np.testing.assert_array_equal(gtp.classify_rings(d), [3, 3, 3, 2, 2, 1, 1, 0, 0])
+    custom = gtp.classify_rings(np.array([500.0, 1000.0, 1500.0]), [(1000, 5)])
+    np.testing.assert_array_equal(custom, [5, 5, 0])
+
+
+def test_cell_exactly_on_ring_edge(backend):
+    gt = (0.0, 100.0, 0.0, 100.0, 0.0, -100.0)  # una fila, centros en x = 50, 150, ...
+    shape = (1, 400)
+    haz = gtp.classify_rings(gtp.distance_field([(50.0, 50.0)], gt, shape, max_dist=30000.0))
+    assert haz[0, 100] == 3   # exactamente 10 km: anillo interior
+    assert haz[0, 101] == 2
+    assert haz[0, 300] == 1   # exactamente 30 km
+    assert haz[0, 301] == 0   # 30 km + 100 m
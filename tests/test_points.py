@@ -0,0 +1,48 @@
+import numpy as np
+
+import guatemala_training_pack as gtp
+
+
+def test_read_point_table_strips_utf8_bom(tmp_path):
+    path = tmp_path / "excel.csv"
+    path.write_bytes(b"\xef\xbb\xbfLongitude,Latitude,Name\n-90.88,14.47,Fuego\n-91.55,14.76,Santa Maria\n")
+    xy, attrs = gtp.read_point_table(str(path))
+    np.testing.assert_allclose(xy, [[-90.88, 14.47], [-91.55, 14.76]])
+    assert [a["Name"] for a in attrs] == ["Fuego", "Santa Maria"]
+
+
+def test_read_point_table_drops_invalid_rows(tmp_path):
+    path = tmp_path / "puntos.csv"
+    path.write_text(
+        "Longitude,Latitude,Name\n"
+        "-90.88,14.47,ok\n"
+        ",14.0,vacio\n"
+        "abc,14.0,texto\n"
+        "-190,14.0,fuera_lon\n"
+        "-90.0,95,fuera_lat\n"
+        "nan,14.0,nan\n"
+        "inf,14.0,inf\n"
+        "-91.0,15.0,ok2\n", encoding="utf-8")
+    xy, attrs = gtp.read_point_table(str(path))
+    assert [a["Name"] for a in attrs] == ["ok", "ok2"]
+    np.testing.assert_allclose(xy, [[-90.88, 14.47], [-91.0, 15.0]])
+
+
+def test_read_point_table_geojson_bom(tmp_path):
+    path = tmp_path / "puntos.geojson"
+    path.write_bytes(b'\xef\xbb\xbf{"type": "FeatureCollection", "features": ['
+                     b'{"type": "Feature", "geometry": {"type": "Point", "coordinates": [-90.6, 14.4]},'
+                     b' "properties": {"Name": "Pacaya"}},'
+                     b'{"type": "Feature", "geometry": {"type": "Point", "coordinates": [200, 14.4]},'
+                     b' "properties": {"Name": "malo"}}]}')
+    xy, attrs = gtp.read_point_table(str(path))
+    np.testing.assert_allclose(xy, [[-90.6, 14.4]])
+    assert attrs == [{"Name": "Pacaya"}]
+
+
+def test_import_csv_points_bom_to_gpkg(tmp_path):
+    ogr = __import__("pytest").importorskip("osgeo.ogr")
+    src = tmp_path / "establecimientos.csv"
+    src.write_bytes(b"\xef\xbb\xbfLongitude,Latitude,Name\n-90.88,14.47,A\n-91.55,14.76,B\nx,y,malo\n")
+    out = gtp.import_csv_points(str(src), "Longitude", "Latitude", str(tmp_path / "out.gpkg"))
+    assert ogr.Open(out).GetLayer(0).GetFeatureCount() == 2
@@ -0,0 +1,35 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+def test_integer_ratio_is_exact_block_sum():
+    a = np.arange(20 * 30, dtype="float64").reshape(20, 30)
+    got = gtp.block_sum(a, Fraction(10))
+    expected = a.reshape(2, 10, 3, 10).sum(axis=(1, 3))
+    np.testing.assert_array_equal(got, expected)
+
+
+@pytest.mark.parametrize("ratio, shape", [
+    (Fraction(10), (20, 30)),
+    (Fraction(5, 2), (20, 30)),   # 250 m desde 100 m
+    (Fraction(4, 3), (12, 24)),
+    (Fraction(1), (7, 9)),
+])
+def test_block_sum_preserves_total_and_uniform_fields(ratio, shape):
+    a = np.random.default_rng(0).lognormal(size=shape)
+    out = gtp.block_sum(a, ratio)
+    assert out.shape == (int(shape[0] / ratio), int(shape[1] / ratio))
+    assert out.sum() == pytest.approx(a.sum(), rel=1e-12)
+    uniform = gtp.block_sum(np.full(shape, 3.0), ratio)
+    np.testing.assert_allclose(uniform, 3.0 * float(ratio) ** 2)
+
+
+def test_fractional_ratio_splits_cut_cells_by_area():
+    # 5 celdas finas en 2 gruesas de 2.5: la celda central se reparte mitad y mitad
+    a = np.array([[1.0, 2.0, 4.0, 8.0, 16.0]])
+    out = gtp._sum_axis(a, Fraction(5, 2), axis=1)
+    np.testing.assert_allclose(out, [[1 + 2 + 2, 2 + 8 + 16]])
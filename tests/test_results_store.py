@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    for name in ("pop2020.tif", "pop2010.tif", "haz.tif", "zonas.shp"):
+        (tmp_path / name).write_bytes(name.encode())
+    calls = []
+
+    def fake_compute(pop_path, haz_path, zones_path, thresholds, name_field):
+        calls.append((os.path.basename(pop_path), list(thresholds)))
+        scale = 2.0 if "2020" in pop_path else 1.0
+        return (["A", "B", "C"], scale * np.array([10.0, 20.0, 30.0]),
+                {t: scale * np.array([1.0, 2.0, 3.0]) / t for t in thresholds})
+
+    monkeypatch.setattr(gtp, "compute_exposure_thresholds", fake_compute)
+    gtp.clear_results_cache()
+    yield tmp_path, calls
+    gtp.clear_results_cache()
+
+
+def query(tmp_path, **kwargs):
+    pops = {2020: str(tmp_path / "pop2020.tif"), 2010: str(tmp_path / "pop2010.tif")}
+    return gtp.query_exposure(str(tmp_path / "store"), pops, str(tmp_path / "haz.tif"),
+                              str(tmp_path / "zonas.shp"), **kwargs)
+
+
+def test_computes_only_missing_keys(store):
+    tmp_path, calls = store
+    query(tmp_path, thresholds=(1, 2))
+    assert calls == [("pop2020.tif", [1.0, 2.0]), ("pop2010.tif", [1.0, 2.0])]
+    cols = query(tmp_path, thresholds=(2, 3))
+    assert calls[2:] == [("pop2020.tif", [3.0]), ("pop2010.tif", [3.0])]
+    np.testing.assert_allclose(cols["exp_sum"][:3], [1.0, 2.0, 3.0])  # 2020, umbral 2
+    assert cols["population"].tolist()[:3] == ["2020"] * 3
+
+
+def test_memory_hit_does_not_touch_disk(store, monkeypatch):
+    tmp_path, calls = store
+    first = query(tmp_path, thresholds=(2,))
+    monkeypatch.setattr(gtp, "load_result", lambda *a: pytest.fail("lectura de disco"))
+    again = query(tmp_path, thresholds=(2,))
+    assert len(calls) == 2
+    for c in first:
+        np.testing.assert_array_equal(first[c], again[c])
+
+
+def test_disk_hit_after_clearing_memory(store):
+    tmp_path, calls = store
+    first = query(tmp_path, thresholds=(1, 2))
+    gtp.clear_results_cache()
+    again = query(tmp_path, thresholds=(1, 2))
+    assert len(calls) == 2
+    for c in first:
+        np.testing.assert_array_equal(first[c], again[c])
+
+
+def test_filter_and_total(store):
+    tmp_path, _ = store
+    only_b = query(tmp_path, thresholds=(1,), zones=["B"])
+    assert only_b["zone"].tolist() == ["B", "B"]
+    total = query(tmp_path, thresholds=(1,), total=True)
+    assert "zone" not in total
+    np.testing.assert_allclose(total["pop_sum"], [120.0, 60.0])
+    np.testing.assert_allclose(total["exp_sum"], [12.0, 6.0])
+
+
+def test_corrupt_result_is_recomputed(store):
+    tmp_path, calls = store
+    query(tmp_path, thresholds=(2,))
+    gtp.clear_results_cache()
+    folder = tmp_path / "store" / "exposicion"
+    for f in folder.iterdir():
+        f.write_bytes(f.read_bytes()[:40])  # truncado
+    cols = query(tmp_path, thresholds=(2,))
+    assert len(calls) == 4
+    np.testing.assert_allclose(cols["exp_sum"][:3], [1.0, 2.0, 3.0])
+
+
+def test_lru_is_bounded_by_bytes():
+    gtp.clear_results_cache()
+    col = {"exp_sum": np.zeros(100)}  # 800 bytes
+    for i in range(5):
+        gtp._lru_put(f"k{i}", dict(col), max_bytes=2000)
+    assert list(gtp._RESULTS["lru"]) == ["k3", "k4"]
+    assert gtp._RESULTS["bytes"] == 1600
+    assert gtp._lru_get("k3") is not None
+    gtp._lru_put("k5", dict(col), max_bytes=2000)
+    assert list(gtp._RESULTS["lru"]) == ["k3", "k5"]  # k3 se usó: sale k4
+    gtp.clear_results_cache()
+    assert gtp._RESULTS["bytes"] == 0
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+RING_SETS = (
+    gtp.HAZARD_RINGS,
+    ((5000, 3), (15000, 1)),
+    ((8000, 2), (20000, 1), (40000, 1)),
+    ((25000, 3),),
+)
+
+
+def strip_table(dist, zid, pop, edges, nz):
+    nb = len(edges) + 1
+    b = gtp.distance_bins(dist, edges)
+    return np.bincount((zid * nb + b).ravel(), weights=pop.ravel(), minlength=nz * nb).reshape(nz, nb)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_scenario_rows_match_classify_rings(seed):
+    rng = np.random.default_rng(seed)
+    edges = np.unique([float(d) for rings in RING_SETS for d, _ in rings])
+    dist = rng.uniform(0, 45000, 500)
+    dist[:len(edges)] = edges  # celdas exactamente en un borde
+    dist[-5:] = np.inf
+    zid = rng.integers(0, 4, dist.size)
+    pop = rng.lognormal(size=dist.size)
+    names = ["A", "B", "C"]
+    rows = gtp.scenario_rows(names, strip_table(dist, zid, pop, edges, 4), edges, RING_SETS, (1, 2, 3))
+    assert len(rows) == len(RING_SETS) * 3 * len(names)
+    got = {(r["rings"], r["threshold"], r["zone"]): r["exp_sum"] for r in rows}
+    for rings in RING_SETS:
+        level = gtp.classify_rings(dist, rings)
+        for t in (1, 2, 3):
+            for i, n in enumerate(names, start=1):
+                expected = pop[(zid == i) & (level >= t)].sum()
+                assert got[(gtp.ring_set_label(rings), t, n)] == pytest.approx(expected, rel=1e-12)
+
+
+def test_scenario_rows_ring_edge_is_inner_ring():
+    edges = np.array([10000.0, 20000.0, 30000.0])
+    dist = np.array([10000.0, 10000.001, 30000.0, 30000.001])
+    rows = gtp.scenario_rows(["Z"], strip_table(dist, np.ones(4, int), np.array([1.0, 10, 100, 1000]), edges, 2),
+                             edges, (gtp.HAZARD_RINGS,), (1, 3))
+    assert [r["exp_sum"] for r in rows] == [111.0, 1.0]
+
+
+def test_run_scenarios_matches_hazard_raster(tmp_path):
+    pytest.importorskip("osgeo.gdal")
+    import benchmark_training_pack as bench
+    extent = bench.synthetic_extent(20)
+    zones = bench.make_zones(str(tmp_path / "zonas.gpkg"), extent)
+    pop = bench.make_population(str(tmp_path / "pop.tif"), extent, 100)
+    xy = bench.make_points(3, extent)
+    for rings in RING_SETS[1:3]:
+        haz = gtp.build_hazard_raster(xy, extent, 250, str(tmp_path / f"haz_{len(rings)}.tif"), bench.CRS, rings)
+        # junto a HAZARD_RINGS: los bordes de ambos conjuntos comparten la tabla
+        rows = gtp.run_scenarios(pop, xy, extent, bench.CRS, zones, thresholds=(1, 3),
+                                 ring_sets=(gtp.HAZARD_RINGS, rings), res=250, block_rows=37)
+        for t in (1, 3):
+            single = {r["zone"]: r["exp_sum"] for r in gtp.compute_exposure(pop, haz, zones, threshold=t)}
+            got = [r for r in rows if r["rings"] == gtp.ring_set_label(rings) and r["threshold"] == t]
+            assert len(got) == len(single)
+            for r in got:
+                assert r["exp_sum"] == pytest.approx(single[r["zone"]], rel=1e-6)
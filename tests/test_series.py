@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+
+def brute_force(cube, zid, exposed, nz):
+    out = np.zeros((cube.shape[0], nz * 2))
+    for y in range(cube.shape[0]):
+        for z in range(nz):
+            out[y, 2 * z] = cube[y][(zid == z) & ~exposed].sum()
+            out[y, 2 * z + 1] = cube[y][(zid == z) & exposed].sum()
+    return out
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_zone_exposed_sums_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    ny, nz, shape = 5, 7, (13, 17)
+    cube = rng.lognormal(size=(ny,) + shape)
+    zid = rng.integers(0, nz - 2, shape).astype("uint16")  # algunas zonas sin celdas
+    exposed = rng.integers(0, 4, shape) >= 2
+    got = gtp.zone_exposed_sums(cube, zid, exposed, nz)
+    np.testing.assert_allclose(got, brute_force(cube, zid, exposed, nz), rtol=1e-12)
+    np.testing.assert_allclose(got.sum(axis=1), cube.reshape(ny, -1).sum(axis=1), rtol=1e-12)
+
+
+def test_zone_exposed_sums_edge_cases():
+    cube = np.ones((3, 4, 4))
+    one_zone = gtp.zone_exposed_sums(cube, np.full((4, 4), 2), np.ones((4, 4), bool), 3)
+    np.testing.assert_array_equal(one_zone, [[0, 0, 0, 0, 0, 16]] * 3)
+    empty = gtp.zone_exposed_sums(np.zeros((2, 0, 5)), np.zeros((0, 5), int), np.zeros((0, 5), bool), 2)
+    np.testing.assert_array_equal(empty, np.zeros((2, 4)))
+
+
+def test_series_matches_per_year_exposure(tmp_path):
+    pytest.importorskip("osgeo.gdal")
+    import benchmark_training_pack as bench
+    extent = bench.synthetic_extent(20)
+    zones = bench.make_zones(str(tmp_path / "zonas.gpkg"), extent)
+    haz = gtp.build_hazard_raster(bench.make_points(3, extent), extent, 250, str(tmp_path / "haz.tif"), bench.CRS)
+    years = {2000 + y: bench.make_population(str(tmp_path / f"pop_{y}.tif"), extent, 100, seed=y)
+             for y in range(3)}
+    series = gtp.compute_exposure_series(years, haz, zones, block_rows=32)
+    for year, pth in years.items():
+        single = {r["zone"]: r for r in gtp.compute_exposure(pth, haz, zones)}
+        for row in (r for r in series if r["year"] == year):
+            assert row["pop_sum"] == pytest.approx(single[row["zone"]]["pop_sum"])
+            assert row["exp_sum"] == pytest.approx(single[row["zone"]]["exp_sum"])
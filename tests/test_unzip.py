@@ -0,0 +1,34 @@
+import os
+import zipfile
+
+import guatemala_training_pack as gtp
+
+
+def make_zip(path, payload):
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("geoBoundaries-GTM-ADM1.shp", payload)
+        zf.writestr("geoBoundaries-GTM-ADM1.dbf", b"dbf")
+    return str(path)
+
+
+def test_unzip_skips_unchanged_archive(tmp_path):
+    out = tmp_path / "vec"
+    zfile = make_zip(tmp_path / "adm.zip", b"v1")
+    gtp.unzip(zfile, str(out))
+    shp = out / "geoBoundaries-GTM-ADM1.shp"
+    os.utime(shp, (1_000_000, 1_000_000))
+    sig = gtp.file_signature(str(shp))
+    gtp.unzip(zfile, str(out))
+    assert gtp.file_signature(str(shp)) == sig
+
+
+def test_unzip_reextracts_changed_or_missing(tmp_path):
+    out = tmp_path / "vec"
+    zfile = make_zip(tmp_path / "adm.zip", b"v1")
+    gtp.unzip(zfile, str(out))
+    make_zip(tmp_path / "adm.zip", b"v2-nuevo")
+    gtp.unzip(zfile, str(out))
+    assert (out / "geoBoundaries-GTM-ADM1.shp").read_bytes() == b"v2-nuevo"
+    (out / "geoBoundaries-GTM-ADM1.dbf").unlink()
+    gtp.unzip(zfile, str(out))
+    assert (out / "geoBoundaries-GTM-ADM1.dbf").exists()
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+
+def write_raster(path, array, options):
+    rows, cols = array.shape
+    ds = gdal.GetDriverByName("GTiff").Create(path, cols, rows, 1, gdal.GDT_Float32, options)
+    ds.SetGeoTransform((0, 100, 0, rows * 100, 0, -100))
+    ds.GetRasterBand(1).WriteArray(array)
+    ds = None
+    return path
+
+
+@pytest.mark.parametrize("shape, options, access", [
+    ((300, 100), ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"], "memmap-tiles"),  # más angosto que una tesela
+    ((300, 600), ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"], "memmap-tiles"),
+    ((300, 256), ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"], None),
+    ((300, 100), ["BLOCKYSIZE=16"], "memmap-strips"),
+    ((300, 100), ["TILED=YES", "COMPRESS=DEFLATE"], "gdal-blocks"),
+])
+def test_iter_windows_matches_read_as_array(tmp_path, shape, options, access):
+    array = np.random.default_rng(0).random(shape, dtype="float32")
+    path = write_raster(str(tmp_path / "pop.tif"), array, options)
+    if access:
+        assert gtp.raster_access(path) == access
+    expected = gdal.Open(path).GetRasterBand(1).ReadAsArray()
+    got = np.vstack([block for _, block in gtp.iter_windows(path, block_rows=64)])
+    np.testing.assert_array_equal(got, expected)
+    assert gtp.raster_stats(path)["sum"] == pytest.approx(float(expected.astype("float64").sum()))
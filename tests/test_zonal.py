@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+import guatemala_training_pack as gtp
+
+gdal = pytest.importorskip("osgeo.gdal")
+bench = pytest.importorskip("benchmark_training_pack")
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    extent = bench.synthetic_extent(10)
+    zones = bench.make_zones(str(tmp_path / "zonas.gpkg"), extent, n=3)
+    ras = tmp_path / "ras"
+    ras.mkdir()
+    pop = bench.make_population(str(ras / "pop_100m.tif"), extent, 100)
+    haz = gtp.build_hazard_raster(bench.make_points(2, extent), extent, 250, str(ras / "haz_250m.tif"),
+                                  bench.CRS)
+    return extent, zones, pop, haz
+
+
+def test_zone_indexes_of_different_grids_coexist(inputs, monkeypatch):
+    _, zones, pop, haz = inputs
+    p_pop, p_haz = gtp.zone_index_path(zones, pop), gtp.zone_index_path(zones, haz)
+    assert p_pop != p_haz and os.path.dirname(p_pop) == os.path.dirname(p_haz)
+    gtp.zone_index(zones, pop)
+    gtp.zone_index(zones, haz)
+    monkeypatch.setattr(gtp, "load_zones", lambda *a: pytest.fail("índice reconstruido"))
+    assert gtp.zone_index(zones, pop)[0] == p_pop
+    assert gtp.zone_index(zones, haz)[0] == p_haz
+
+
+def brute_force_zones(extent, res, n=3):
+    """Nombre de zona de cada celda (por su centro) en la grilla de make_zones"""
+    xmin, xmax, ymin, ymax = extent
+    gt, shape = gtp.grid_from_extent(*extent, res)
+    xs, ys = gtp.cell_centers(gt, shape)
+    i = np.floor((xs - xmin) / ((xmax - xmin) / n)).astype(int)
+    j = np.floor((ys - ymin) / ((ymax - ymin) / n)).astype(int)
+    return np.array([[f"Zona_{a}_{b}" for a in i] for b in j])
+
+
+def brute_force_hazard(haz, extent, res):
+    """Nivel de amenaza de la celda de 250 m que contiene cada centro de la grilla de población"""
+    ds = gdal.Open(haz)
+    hgt, levels = ds.GetGeoTransform(), ds.ReadAsArray()
+    xs, ys = gtp.cell_centers(*gtp.grid_from_extent(*extent, res))
+    c = np.floor((xs - hgt[0]) / hgt[1]).astype(int)
+    r = np.floor((ys - hgt[3]) / hgt[5]).astype(int)
+    return levels[np.ix_(r, c)]
+
+
+@pytest.mark.parametrize("threshold", [1, 2, 3])
+def test_compute_exposure_matches_brute_force(inputs, threshold):
+    extent, zones, pop, haz = inputs
+    people = gdal.Open(pop).ReadAsArray().astype("float64")
+    people[people == -99999] = 0
+    zone = brute_force_zones(extent, 100)
+    exposed = brute_force_hazard(haz, extent, 100) >= threshold
+    rows = gtp.compute_exposure(pop, haz, zones, threshold=threshold, block_rows=23)
+    assert sorted(r["zone"] for r in rows) == sorted(np.unique(zone))
+    for r in rows:
+        assert r["pop_sum"] == pytest.approx(people[zone == r["zone"]].sum(), rel=1e-9)
+        assert r["exp_sum"] == pytest.approx(people[(zone == r["zone"]) & exposed].sum(), rel=1e-9)
+
+
+def test_zonal_stats_matches_brute_force(inputs, tmp_path):
+    extent, zones, pop, haz = inputs
+    exposed_tif = str(tmp_path / "ras" / "pop_expuesta_100m.tif")
+    gtp.compute_exposure(pop, haz, zones, exposed_out=exposed_tif)
+    people = gdal.Open(pop).ReadAsArray().astype("float64")
+    zone = brute_force_zones(extent, 100)
+    valid = people != -99999
+    for r in gtp.zonal_stats(pop, zones, block_rows=29):
+        sel = (zone == r["zone"]) & valid
+        assert r["count"] == sel.sum()
+        assert r["sum"] == pytest.approx(people[sel].sum(), rel=1e-9)
+        assert r["mean"] == pytest.approx(people[sel].mean(), rel=1e-9)
+    exposed = np.where(valid, people, 0) * (brute_force_hazard(haz, extent, 100) >= gtp.EXPOSURE_THRESHOLD)
+    for r in gtp.zonal_stats(exposed_tif, zones):
+        assert r["count"] == (zone == r["zone"]).sum()  # create_like no define NoData
+        assert r["sum"] == pytest.approx(exposed[zone == r["zone"]].sum(), rel=1e-6)